@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_file
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_file, Response
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -11,7 +11,10 @@ from pathlib import Path
 import sqlite3
 import secrets
 import string
+import time
 import config
+from services import alteracoes, logs, metricas, perfilamento, tracing
+from services.bot_pool import obter_pool, latencias_bots, SemWorkerOciosoError
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = config.SECRET_KEY
@@ -27,6 +30,20 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 }
 
 db = SQLAlchemy(app)
+logger = logs.obter_logger('app')
+logs.instrumentar_flask(app)
+
+if config.METRICAS_ATIVO:
+    metricas.instrumentar_flask(app)
+    with app.app_context():
+        metricas.instrumentar_banco(db.engine)
+
+perfilamento.instrumentar_flask(app, lambda: db.engine)
+
+if config.TRACING_ATIVO:
+    tracing.instrumentar_flask(app)
+    with app.app_context():
+        tracing.instrumentar_banco(db.engine)
 
 # Configurar SQLite para melhor concorrência (WAL mode)
 from sqlalchemy import text
@@ -215,6 +232,10 @@ class Romaneio(db.Model):
     apos_recebimento = db.Column(db.Boolean, default=False)
     programado = db.Column(db.Boolean, default=True)
     inserir_como_parcial = db.Column(db.Boolean, default=False)
+    # Lease do verificador: qual worker está processando e até quando
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expira_em = db.Column(db.DateTime, nullable=True, index=True)
+    proxima_verificacao_em = db.Column(db.DateTime, nullable=True, index=True)
     
     itens = db.relationship('RomaneioItem', backref='romaneio', lazy=True, cascade='all, delete-orphan')
     logs = db.relationship('RomaneioLog', backref='romaneio', lazy=True, cascade='all, delete-orphan')
@@ -320,6 +341,116 @@ class RomaneioLog(db.Model):
             'user_name': self.user.full_name if self.user else 'Sistema Automático'
         }
 
+class ApiOutbox(db.Model):
+    """Chamadas pendentes à API externa, gravadas na mesma transação da mudança local"""
+    __tablename__ = 'api_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    operacao = db.Column(db.String(30), nullable=False)  # atualizar_status, inserir_romaneio
+    romaneio_id = db.Column(db.Integer, db.ForeignKey('romaneio.id', ondelete='SET NULL'), nullable=True, index=True)
+    idro = db.Column(db.Integer, nullable=True)
+    payload = db.Column(db.Text, nullable=True)  # JSON string
+    estado = db.Column(db.String(20), nullable=False, default='pendente', index=True)  # pendente, enviado, falha_definitiva
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    bloqueado_por = db.Column(db.String(100), nullable=True)
+    bloqueado_ate = db.Column(db.DateTime, nullable=True)
+    ultimo_erro = db.Column(db.Text, nullable=True)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    enviado_em = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'operacao': self.operacao,
+            'romaneio_id': self.romaneio_id,
+            'idro': self.idro,
+            'payload': json.loads(self.payload) if self.payload else None,
+            'estado': self.estado,
+            'tentativas': self.tentativas,
+            'proxima_tentativa_em': self.proxima_tentativa_em.isoformat() if self.proxima_tentativa_em else None,
+            'ultimo_erro': self.ultimo_erro,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'enviado_em': self.enviado_em.isoformat() if self.enviado_em else None
+        }
+
+class VerificationRun(db.Model):
+    """Registro de cada passe do verificador automático"""
+    __tablename__ = 'verification_run'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    worker_id = db.Column(db.String(100), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='executando', index=True)  # executando, concluido, interrompido, falhou, ignorado
+    inicio = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    fim = db.Column(db.DateTime, nullable=True)
+    duracao = db.Column(db.Float, nullable=True)  # em segundos
+    backlog = db.Column(db.Integer, nullable=True)  # romaneios elegíveis no início do passe
+    total_verificados = db.Column(db.Integer, nullable=False, default=0)
+    atualizados_para_aberto = db.Column(db.Integer, nullable=False, default=0)
+    mantidos_pendente = db.Column(db.Integer, nullable=False, default=0)
+    max_tentativas_atingidas = db.Column(db.Integer, nullable=False, default=0)
+    aguardando_contagem = db.Column(db.Integer, nullable=False, default=0)
+    sem_alteracao = db.Column(db.Integer, nullable=False, default=0)  # API respondeu "não modificado"
+    erros = db.Column(db.Integer, nullable=False, default=0)
+    tempo_api = db.Column(db.Float, nullable=True)  # segundos em chamadas à API externa
+    tempo_db = db.Column(db.Float, nullable=True)   # segundos executando SQL
+    mensagem = db.Column(db.Text, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'worker_id': self.worker_id,
+            'status': self.status,
+            'inicio': self.inicio.isoformat() if self.inicio else None,
+            'fim': self.fim.isoformat() if self.fim else None,
+            'duracao': self.duracao,
+            'backlog': self.backlog,
+            'total_verificados': self.total_verificados,
+            'atualizados_para_aberto': self.atualizados_para_aberto,
+            'mantidos_pendente': self.mantidos_pendente,
+            'max_tentativas_atingidas': self.max_tentativas_atingidas,
+            'aguardando_contagem': self.aguardando_contagem,
+            'sem_alteracao': self.sem_alteracao,
+            'erros': self.erros,
+            'tempo_api': self.tempo_api,
+            'tempo_db': self.tempo_db,
+            'mensagem': self.mensagem
+        }
+
+class RomaneioAlteracao(db.Model):
+    """Feed append-only de mudanças de status de romaneios e de quantidades de itens (ver services/alteracoes.py)"""
+    __tablename__ = 'romaneio_alteracao'
+    __table_args__ = {'sqlite_autoincrement': True}  # seq nunca é reaproveitado
+    
+    seq = db.Column(db.Integer, primary_key=True)
+    entidade = db.Column(db.String(10), nullable=False)  # romaneio, item
+    # Sem chave estrangeira: a alteração continua no feed depois que o romaneio é excluído
+    romaneio_id = db.Column(db.Integer, nullable=False, index=True)
+    pedido_compra = db.Column(db.String(100), nullable=True)
+    item_id = db.Column(db.Integer, nullable=True)
+    codigo = db.Column(db.String(50), nullable=True)
+    campo = db.Column(db.String(30), nullable=False)  # status, criado, excluido, quantidade_nf, quantidade_contada
+    valor_anterior = db.Column(db.String(100), nullable=True)
+    valor_novo = db.Column(db.String(100), nullable=True)
+    registrado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'entidade': self.entidade,
+            'romaneio_id': self.romaneio_id,
+            'pedido_compra': self.pedido_compra,
+            'item_id': self.item_id,
+            'codigo': self.codigo,
+            'campo': self.campo,
+            'anterior': self.valor_anterior,
+            'novo': self.valor_novo,
+            'registrado_em': self.registrado_em.isoformat() if self.registrado_em else None
+        }
+
+# Mudanças feitas pelo ORM entram no feed de alterações no mesmo commit
+alteracoes.instalar_captura(db.session)
+
 # Configuração dos bots disponíveis
 AVAILABLE_BOTS = {
     'sic_full': {
@@ -332,7 +463,8 @@ AVAILABLE_BOTS = {
         'name': 'SIC - Apenas Login',
         'description': 'Realiza apenas o login no sistema SIC',
         'script': 'entrada-nf/Sic_Login.py',
-        'estimated_duration': 60
+        'estimated_duration': 60,
+        'usar_pool': True
     },
     'sic_inserir_nfs': {
         'name': 'SIC - Inserir NFs Pendentes',
@@ -344,13 +476,15 @@ AVAILABLE_BOTS = {
         'name': 'RM - Login',
         'description': 'Realiza login no sistema TOTVS RM',
         'script': 'entrada-nf/RM_Login.py',
-        'estimated_duration': 60
+        'estimated_duration': 60,
+        'usar_pool': True
     },
     'consulta_nfe': {
         'name': 'Consulta NFe',
         'description': 'Consulta nota fiscal eletrônica via API',
         'script': 'entrada-nf/Consulta_nfe.py',
-        'estimated_duration': 30
+        'estimated_duration': 30,
+        'usar_pool': True
     }
 }
 
@@ -770,17 +904,44 @@ def execute_bot(bot_id):
             # Executar o script do bot
             script_path = Path(bot_config['script'])
             if script_path.exists():
-                # Configurar variáveis de ambiente para o bot
-                env = os.environ.copy()
-                env['RPA_EXECUTION_ID'] = str(execution.id)
+                pool = obter_pool() if bot_config.get('usar_pool') else None
+                inicio = time.perf_counter()
                 
-                result = subprocess.run(
-                    ['python', str(script_path)],
-                    capture_output=True,
-                    text=True,
-                    cwd=Path.cwd(),
-                    env=env
-                )
+                result = None
+                if pool:
+                    # Worker pré-aquecido: só as variáveis extras são repassadas
+                    try:
+                        result, tempos = pool.executar(
+                            script_path,
+                            env={'RPA_EXECUTION_ID': str(execution.id)},
+                            cwd=Path.cwd()
+                        )
+                        modo = 'quente'
+                    except SemWorkerOciosoError as e:
+                        # Pool sem worker livre (todos ocupados ou sem subir): caminho frio
+                        db.session.add(BotLog(
+                            execution_id=execution.id,
+                            level='WARNING',
+                            message=f'{e}; executando em subprocess',
+                            module='orchestrator'
+                        ))
+                
+                if result is None:
+                    # Configurar variáveis de ambiente para o bot
+                    env = os.environ.copy()
+                    env['RPA_EXECUTION_ID'] = str(execution.id)
+                    
+                    result = subprocess.run(
+                        ['python', str(script_path)],
+                        capture_output=True,
+                        text=True,
+                        cwd=Path.cwd(),
+                        env=env
+                    )
+                    tempos = {'inicio': None}
+                    modo = 'frio'
+                
+                latencias_bots.registrar(bot_id, modo, time.perf_counter() - inicio, tempos['inicio'])
                 
                 # Atualizar execução
                 execution.status = 'completed' if result.returncode == 0 else 'failed'
@@ -793,6 +954,7 @@ def execute_bot(bot_id):
                 # Log final
                 log_level = 'INFO' if result.returncode == 0 else 'ERROR'
                 log_message = 'Execução concluída com sucesso' if result.returncode == 0 else f'Execução falhou: {result.stderr}'
+                log_message += f' (modo {modo}, {time.perf_counter() - inicio:.2f}s)'
                 
                 final_log = BotLog(
                     execution_id=execution.id,
@@ -832,8 +994,17 @@ def execute_bot(bot_id):
             db.session.add(error_log)
             db.session.commit()
     
+    def run_bot_medindo():
+        metricas.bots_em_execucao.inc()
+        inicio = time.perf_counter()
+        try:
+            run_bot()
+        finally:
+            metricas.bots_em_execucao.dec()
+            metricas.bot_execucao_segundos.observar(time.perf_counter() - inicio, bot=bot_id)
+    
     # Iniciar thread
-    thread = threading.Thread(target=run_bot)
+    thread = threading.Thread(target=run_bot_medindo)
     thread.daemon = True
     thread.start()
     
@@ -843,6 +1014,16 @@ def execute_bot(bot_id):
         'estimated_duration': bot_config['estimated_duration']
     })
 
+@app.route('/api/bots/latencia')
+@login_required
+def bots_latencia():
+    """API: Latência de execução por bot, separada em início frio e quente"""
+    pool = obter_pool()
+    return jsonify({
+        'pool': pool.estatisticas() if pool else {'ativo': False},
+        'latencias': latencias_bots.resumo()
+    })
+
 @app.route('/execution/<int:execution_id>')
 @login_required
 def execution_details(execution_id):
@@ -1050,7 +1231,7 @@ def romaneio_detalhes(romaneio_id):
 @login_required
 def add_romaneio():
     """Adicionar novo romaneio"""
-    from services.api_client import RomaneioAPIClient
+    from services.romaneio_service import RomaneioService
     
     try:
         pedido_compra = request.form.get('pedido_compra', '').strip()
@@ -1071,166 +1252,23 @@ def add_romaneio():
             flash('Chave de Acesso deve ter 44 caracteres', 'error')
             return redirect(url_for('romaneios'))
         
-        # Verificar se já existe
-        existing = Romaneio.query.filter_by(pedido_compra=pedido_compra).first()
-        if existing:
-            flash('Já existe um romaneio para este pedido', 'error')
-            return redirect(url_for('romaneios'))
-        
-        # Criar romaneio com valores padrão do .env
-        romaneio = Romaneio(
-            pedido_compra=pedido_compra,
-            nota_fiscal=nota_fiscal,
-            chave_acesso=chave_acesso,
-            created_by=current_user.id,
-            status='P',
-            apos_recebimento=config.API_APOS_RECEBIMENTO,
-            programado=config.API_PROGRAMADO,
-            inserir_como_parcial=config.API_INSERIR_PARCIAL_SE_EXISTIR
+        # Grava o romaneio pendente; inserção na API e itens seguem pelo outbox
+        romaneio, erro = RomaneioService().criar_romaneio(
+            pedido_compra, nota_fiscal, chave_acesso, current_user.id
         )
+        if erro:
+            flash(erro, 'error')
+            return redirect(url_for('romaneios'))
         
-        # Chamar API se não for modo teste
-        if not config.MODO_TESTE:
-            api_client = RomaneioAPIClient()
-            try:
-                print("\n" + "="*80)
-                print("🚀 CHAMANDO API DE INSERÇÃO DE ROMANEIO")
-                print("="*80)
-                print(f"📋 Pedido: {pedido_compra}")
-                print(f"📄 Nota Fiscal: {nota_fiscal}")
-                print(f"🔑 Chave: {chave_acesso}")
-                print("-"*80)
-                
-                resultado_api = api_client.inserir_romaneio(
-                    pedido_compra, nota_fiscal, chave_acesso
-                )
-                
-                print("\n✅ RESPOSTA DA API:")
-                print("-"*80)
-                print(f"📊 Status: SUCCESS")
-                print(f"📦 Response completo:")
-                import json
-                print(json.dumps(resultado_api, indent=2, ensure_ascii=False))
-                print("="*80 + "\n")
-                
-                # Verificar se a API retornou mensagem de romaneio já existente
-                if isinstance(resultado_api, dict):
-                    mensagem = resultado_api.get('mensagem', '')
-                    
-                    # Verificar se é um erro de romaneio já existente
-                    if 'já existente' in mensagem.lower() or 'ja existente' in mensagem.lower():
-                        print(f"⚠️ Romaneio já existe na API externa!")
-                        flash(f'❌ {mensagem}', 'error')
-                        return redirect(url_for('romaneios'))
-                    
-                    # Se tiver IDRO, atualizar
-                    if 'idro' in resultado_api:
-                        romaneio.idro = resultado_api['idro']
-                        print(f"✓ IDRO obtido: {resultado_api['idro']}")
-                
-                # Buscar itens do romaneio via GET
-                print("\n" + "="*80)
-                print("📥 BUSCANDO ITENS DO ROMANEIO (GET)")
-                print("="*80)
-                
-                try:
-                    dados_romaneio = api_client.get_romaneio(pedido_compra)
-                    
-                    if dados_romaneio and len(dados_romaneio) > 0:
-                        romaneio_data = dados_romaneio[0]
-                        
-                        # Atualizar IDRO se ainda não tiver
-                        if not romaneio.idro and 'IDRO' in romaneio_data:
-                            romaneio.idro = romaneio_data['IDRO']
-                            print(f"✓ IDRO obtido do GET: {romaneio_data['IDRO']}")
-                        
-                        # Processar itens
-                        itens_api = romaneio_data.get('ITEM', [])
-                        print(f"📦 {len(itens_api)} itens encontrados")
-                        
-                        # Salvar romaneio primeiro para ter o ID
-                        db.session.add(romaneio)
-                        db.session.flush()
-                        
-                        # Salvar itens
-                        for item_data in itens_api:
-                            item = RomaneioItem(
-                                romaneio_id=romaneio.id,
-                                codigo=item_data.get('CODIGO'),
-                                descricao=item_data.get('DESCRICAO'),
-                                quantidade_nf=item_data.get('QUANTIDADE_NF'),
-                                quantidade_contada=item_data.get('QUANTIDADE_CONTADA')
-                            )
-                            db.session.add(item)
-                            print(f"  ✓ Item: {item_data.get('CODIGO')} - {item_data.get('DESCRICAO')}")
-                        
-                        print("="*80 + "\n")
-                    else:
-                        print("⚠️ Nenhum item retornado pela API")
-                        print("="*80 + "\n")
-                        # Salvar romaneio mesmo sem itens
-                        db.session.add(romaneio)
-                        db.session.flush()
-                        
-                except Exception as e_get:
-                    print(f"\n⚠️ ERRO ao buscar itens: {str(e_get)}")
-                    print("="*80 + "\n")
-                    # Salvar romaneio mesmo com erro ao buscar itens
-                    db.session.add(romaneio)
-                    db.session.flush()
-                        
-            except Exception as e:
-                print("\n❌ ERRO NA API:")
-                print("-"*80)
-                print(f"🚨 Erro: {str(e)}")
-                print("="*80 + "\n")
-                flash(f'Erro ao chamar API: {str(e)}', 'error')
-                return redirect(url_for('romaneios'))
+        if config.MODO_TESTE:
+            logger.info("Modo teste: romaneio %s criado sem chamar a API (IDRO fictício 999999)", pedido_compra)
+            flash('Romaneio criado com sucesso!', 'success')
         else:
-            romaneio.idro = 999999
-            print("\n" + "="*80)
-            print("🧪 MODO TESTE - API NÃO CHAMADA")
-            print("="*80)
-            print(f"📋 Pedido: {pedido_compra}")
-            print(f"📄 Nota Fiscal: {nota_fiscal}")
-            print(f"🔑 Chave: {chave_acesso}")
-            print(f"✓ IDRO fictício: 999999")
-            print("="*80 + "\n")
-            
-            # No modo teste, criar itens fictícios
-            db.session.add(romaneio)
-            db.session.flush()
-            
-            # Itens de teste
-            item1 = RomaneioItem(
-                romaneio_id=romaneio.id,
-                codigo="01.000001",
-                descricao="PRODUTO TESTE A",
-                quantidade_nf=100,
-                quantidade_contada=100
-            )
-            item2 = RomaneioItem(
-                romaneio_id=romaneio.id,
-                codigo="01.000002",
-                descricao="PRODUTO TESTE B",
-                quantidade_nf=50,
-                quantidade_contada=50
-            )
-            db.session.add(item1)
-            db.session.add(item2)
-        
-        # Criar log
-        log = RomaneioLog(
-            romaneio_id=romaneio.id,
-            acao='criado',
-            status_novo='P',
-            detalhes=f'Romaneio criado {"[MODO TESTE]" if config.MODO_TESTE else ""}',
-            user_id=current_user.id
-        )
-        db.session.add(log)
-        db.session.commit()
-        
-        flash('Romaneio criado com sucesso!', 'success')
+            if config.OUTBOX_NO_APP:
+                iniciar_despachante_outbox().despertar()
+            logger.info("Romaneio %s criado, inserção na API agendada", pedido_compra,
+                        extra={'pedido': pedido_compra, 'romaneio_id': romaneio.id})
+            flash('Romaneio criado! A inserção na API e a busca dos itens estão sendo feitas em segundo plano.', 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -1238,6 +1276,144 @@ def add_romaneio():
     
     return redirect(url_for('romaneios'))
 
+@app.route('/romaneios/importar', methods=['POST'])
+@login_required
+def importar_romaneios():
+    """Importa romaneios de uma planilha xlsx/CSV e devolve o relatório por linha"""
+    from services.importacao_service import ImportacaoService, ImportacaoError
+    
+    arquivo = request.files.get('arquivo')
+    if not arquivo or not arquivo.filename:
+        return jsonify({'success': False, 'error': 'Envie a planilha no campo "arquivo"'}), 400
+    simular = request.form.get('simular', '').lower() in ('1', 'true', 'on')
+    
+    try:
+        resultado = ImportacaoService().importar(arquivo.stream, current_user.id,
+                                                 nome_arquivo=arquivo.filename, simular=simular)
+    except ImportacaoError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error("Erro ao importar planilha %s: %s", arquivo.filename, e)
+        return jsonify({'success': False, 'error': f'Erro ao importar planilha: {str(e)}'}), 500
+    
+    if resultado['romaneio_ids'] and not config.MODO_TESTE and config.OUTBOX_NO_APP:
+        iniciar_despachante_outbox().despertar()
+    logger.info("Planilha %s importada: %s", arquivo.filename, resultado['totais'],
+                extra={'simulacao': simular, 'total_linhas': resultado['total_linhas']})
+    
+    return jsonify({'success': True, **resultado})
+
+@app.route('/api/romaneios', methods=['GET'])
+@login_required
+def api_listar_romaneios():
+    """
+    API: Vários romaneios de uma vez, em páginas compactas (integrações)
+    
+    Filtros: ids=1,2,3 | status | pedido | nf | atualizado_desde (ISO 8601).
+    Paginação por cursor: limite e apos (o "proximo" da página anterior).
+    itens=1 inclui os itens de cada romaneio.
+    """
+    from services.romaneio_service import RomaneioService
+    
+    ids = None
+    if request.args.get('ids'):
+        try:
+            ids = [int(romaneio_id) for romaneio_id in request.args['ids'].split(',') if romaneio_id.strip()]
+        except ValueError:
+            return jsonify({'success': False, 'error': 'ids deve ser uma lista de números separados por vírgula'}), 400
+        if len(ids) > config.INTEGRACAO_PAGINA_MAX:
+            return jsonify({'success': False, 'error': f'Máximo de {config.INTEGRACAO_PAGINA_MAX} ids por consulta'}), 400
+    
+    atualizado_desde = None
+    if request.args.get('atualizado_desde'):
+        try:
+            atualizado_desde = datetime.fromisoformat(request.args['atualizado_desde'])
+        except ValueError:
+            return jsonify({'success': False, 'error': 'atualizado_desde deve estar no formato ISO 8601'}), 400
+    
+    limite = request.args.get('limite', config.INTEGRACAO_PAGINA_PADRAO, type=int)
+    limite = max(1, min(limite, config.INTEGRACAO_PAGINA_MAX))
+    romaneios, proximo = RomaneioService().listar_compacto(
+        ids=ids,
+        status=request.args.get('status', ''),
+        pedido=request.args.get('pedido', ''),
+        nf=request.args.get('nf', ''),
+        atualizado_desde=atualizado_desde,
+        apos=request.args.get('apos', 0, type=int),
+        limite=limite,
+        incluir_itens=request.args.get('itens', '').lower() in ('1', 'true')
+    )
+    
+    return jsonify({'success': True, 'romaneios': romaneios, 'proximo': proximo, 'limite': limite})
+
+@app.route('/api/romaneios/status', methods=['PUT'])
+@login_required
+def api_atualizar_status_em_massa():
+    """
+    API: Atualizar o status de vários romaneios em uma transação (apenas admin)
+    
+    JSON: {"ids": [1, 2], "status": "R", "observacoes": "..."} ou
+          {"alteracoes": [{"id": 1, "status": "R", "observacoes": "..."}, ...]}
+    """
+    from services.romaneio_service import RomaneioService
+    
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'error': 'Acesso negado'}), 403
+    
+    dados = request.get_json(silent=True) or {}
+    try:
+        if 'alteracoes' in dados:
+            itens = [{'id': int(alteracao['id']), 'status': alteracao.get('status'),
+                      'observacoes': alteracao.get('observacoes')} for alteracao in dados['alteracoes']]
+        elif 'ids' in dados:
+            itens = [{'id': int(romaneio_id), 'status': dados.get('status'),
+                      'observacoes': dados.get('observacoes')} for romaneio_id in dados['ids']]
+        else:
+            return jsonify({'success': False, 'error': 'Informe "ids" e "status" ou "alteracoes"'}), 400
+    except (TypeError, ValueError, KeyError):
+        return jsonify({'success': False, 'error': 'Cada alteração precisa de um id numérico'}), 400
+    
+    if not itens:
+        return jsonify({'success': False, 'error': 'Nenhum romaneio informado'}), 400
+    if len(itens) > config.INTEGRACAO_MAX_ALTERACOES:
+        return jsonify({'success': False,
+                        'error': f'Máximo de {config.INTEGRACAO_MAX_ALTERACOES} romaneios por requisição'}), 400
+    
+    resumo, erro = RomaneioService().atualizar_status_em_massa(itens, current_user.id)
+    if erro:
+        return jsonify({'success': False, 'error': erro}), 400
+    
+    logger.info("Status atualizado em massa: %d romaneio(s), %d sem alteracao",
+                resumo['atualizados'], resumo['sem_alteracao'], extra={'user_id': current_user.id})
+    return jsonify({'success': True, **resumo})
+
+@app.route('/api/changes', methods=['GET'])
+@login_required
+def api_alteracoes():
+    """
+    API: Feed de alterações após ?since=<seq> (status de romaneios e quantidades de itens)
+    
+    Com wait=N (segundos, até ALTERACOES_ESPERA_MAX_SEGUNDOS) e nada novo, a
+    resposta espera até a próxima alteração (long-poll). O consumidor guarda
+    o "proximo" da resposta e o usa como since na chamada seguinte.
+    """
+    desde = max(0, request.args.get('since', 0, type=int))
+    limite = max(1, min(request.args.get('limit', config.ALTERACOES_PAGINA_PADRAO, type=int),
+                        config.ALTERACOES_PAGINA_MAX))
+    espera = max(0.0, min(request.args.get('wait', 0, type=float), config.ALTERACOES_ESPERA_MAX_SEGUNDOS))
+    
+    linhas = alteracoes.aguardar(desde, limite, espera) if espera else alteracoes.listar(desde, limite)
+    mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    
+    return jsonify({
+        'success': True,
+        'alteracoes': [linha.to_dict() for linha in linhas],
+        'proximo': linhas[-1].seq if linhas else desde,
+        'mais': mais,
+        'ultimo_seq': alteracoes.ultimo_seq()
+    })
+
 @app.route('/api/romaneios/<int:romaneio_id>', methods=['GET'])
 @login_required
 def api_get_romaneio(romaneio_id):
@@ -1269,8 +1445,12 @@ def api_excluir_romaneio(romaneio_id):
         if not current_user.is_admin() and romaneio.created_by != current_user.id:
             return jsonify({'success': False, 'error': 'Sem permissão'}), 403
         
+        pedido_compra = romaneio.pedido_compra
         db.session.delete(romaneio)
         db.session.commit()
+        # Um romaneio novo com o mesmo pedido não pode herdar os validadores (em disco)
+        from services.api_client import RomaneioAPIClient
+        RomaneioAPIClient().esquecer_validadores(pedido_compra)
         
         return jsonify({'success': True, 'message': 'Romaneio excluído com sucesso'})
         
@@ -1282,6 +1462,8 @@ def api_excluir_romaneio(romaneio_id):
 @login_required
 def api_verificar_romaneio(romaneio_id):
     """API: Forçar verificação de um romaneio específico"""
+    from sqlalchemy import select
+    from services.outbox_dispatcher import insercao_nao_concluida
     from services.verificador_service import VerificadorService
     
     romaneio = Romaneio.query.get(romaneio_id)
@@ -1295,10 +1477,23 @@ def api_verificar_romaneio(romaneio_id):
             'error': 'Romaneio não pode ser verificado (finalizado ou máximo de tentativas atingido)'
         }), 400
     
+    if db.session.execute(select(insercao_nao_concluida(romaneio.id))).scalar():
+        return jsonify({
+            'success': False,
+            'error': 'Romaneio ainda não foi inserido na API (veja o histórico do romaneio)'
+        }), 400
+    
     try:
         verificador = VerificadorService()
         resultado = verificador.verificar_romaneio(romaneio)
         
+        if resultado['status'] == 'em_verificacao':
+            return jsonify({
+                'success': False,
+                'error': 'Romaneio já está sendo verificado. Tente novamente em instantes.',
+                'resultado': resultado
+            }), 409
+        
         return jsonify({
             'success': True,
             'message': 'Verificação realizada com sucesso',
@@ -1308,6 +1503,94 @@ def api_verificar_romaneio(romaneio_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+_gerenciador_lotes = None
+_gerenciador_lotes_lock = threading.Lock()
+
+def obter_gerenciador_lotes():
+    """Gerenciador (um por processo) dos lotes de verificação em segundo plano"""
+    from services.verificacao_lote import GerenciadorLotes
+    global _gerenciador_lotes
+    with _gerenciador_lotes_lock:
+        if _gerenciador_lotes is None:
+            _gerenciador_lotes = GerenciadorLotes(app)
+    return _gerenciador_lotes
+
+def _lote_do_usuario(lote_id):
+    """Lote visível para o usuário atual (quem criou ou admin), ou None"""
+    lote = obter_gerenciador_lotes().obter(lote_id)
+    if lote and (lote.usuario_id == current_user.id or current_user.is_admin()):
+        return lote
+    return None
+
+@app.route('/api/romaneios/verificar-lote', methods=['POST'])
+@login_required
+def api_verificar_lote():
+    """
+    API: Verificar vários romaneios em segundo plano
+    
+    JSON: {"ids": [1, 2, 3]} ou {"filtro": {"status": "P", "pedido": "...", "nf": "..."}}
+    (com filtro, só entram os romaneios verificáveis). Responde 202 com o id do lote.
+    """
+    from services.verificacao_lote import selecionar_ids, LoteVerificacaoError
+    
+    dados = request.get_json(silent=True) or {}
+    try:
+        if 'ids' in dados:
+            try:
+                ids = [int(romaneio_id) for romaneio_id in dados['ids']]
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'ids deve ser uma lista de números'}), 400
+        elif isinstance(dados.get('filtro'), dict):
+            filtro = dados['filtro']
+            ids = selecionar_ids(status=filtro.get('status'), pedido=filtro.get('pedido'), nf=filtro.get('nf'))
+        else:
+            return jsonify({'success': False, 'error': 'Informe "ids" ou "filtro"'}), 400
+        
+        lote = obter_gerenciador_lotes().criar(ids, current_user.id)
+    except LoteVerificacaoError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'lote': lote.progresso(),
+        'progresso_url': url_for('api_progresso_lote', lote_id=lote.id),
+        'eventos_url': url_for('api_eventos_lote', lote_id=lote.id)
+    }), 202
+
+@app.route('/api/romaneios/verificar-lote/<lote_id>')
+@login_required
+def api_progresso_lote(lote_id):
+    """API: Progresso do lote e resultados a partir de ?desde=N (polling)"""
+    lote = _lote_do_usuario(lote_id)
+    if not lote:
+        return jsonify({'success': False, 'error': 'Lote não encontrado'}), 404
+    desde = max(0, request.args.get('desde', 0, type=int))
+    return jsonify({'success': True, 'lote': lote.to_dict(desde)})
+
+@app.route('/api/romaneios/verificar-lote/<lote_id>/eventos')
+@login_required
+def api_eventos_lote(lote_id):
+    """API: Progresso do lote em Server-Sent Events (retoma pelo Last-Event-ID)"""
+    lote = _lote_do_usuario(lote_id)
+    if not lote:
+        return jsonify({'success': False, 'error': 'Lote não encontrado'}), 404
+    try:
+        desde = int(request.headers.get('Last-Event-ID') or request.args.get('desde') or 0)
+    except ValueError:
+        desde = 0
+    return Response(lote.eventos_sse(max(0, desde)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/romaneios/verificar-lote/<lote_id>/cancelar', methods=['POST'])
+@login_required
+def api_cancelar_lote(lote_id):
+    """API: Cancelar os romaneios do lote que ainda não começaram"""
+    lote = _lote_do_usuario(lote_id)
+    if not lote:
+        return jsonify({'success': False, 'error': 'Lote não encontrado'}), 404
+    lote.cancelar(f'Cancelado por {current_user.username}')
+    return jsonify({'success': True, 'lote': lote.progresso()})
+
 @app.route('/api/romaneios/<int:romaneio_id>/status', methods=['PUT'])
 @login_required
 def api_atualizar_status_romaneio(romaneio_id):
@@ -1320,7 +1603,7 @@ def api_atualizar_status_romaneio(romaneio_id):
         novo_status = dados.get('status')
         observacoes = dados.get('observacoes')
         
-        if not novo_status or novo_status not in config.STATUS_CHOICES:
+        if not isinstance(novo_status, str) or novo_status not in config.STATUS_CHOICES:
             return jsonify({'success': False, 'error': 'Status inválido'}), 400
         
         romaneio = Romaneio.query.get(romaneio_id)
@@ -1342,6 +1625,9 @@ def api_atualizar_status_romaneio(romaneio_id):
         )
         db.session.add(log)
         db.session.commit()
+        # Status mudado à mão: a próxima verificação baixa o romaneio inteiro
+        from services.api_client import RomaneioAPIClient
+        RomaneioAPIClient().esquecer_validadores(romaneio.pedido_compra)
         
         return jsonify({'success': True, 'message': f'Status atualizado para {config.STATUS_CHOICES[novo_status]}'})
         
@@ -1349,6 +1635,114 @@ def api_atualizar_status_romaneio(romaneio_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/verificador/execucoes')
+@login_required
+def verificador_execucoes():
+    """Histórico dos passes do verificador (duração x backlog)"""
+    execucoes = VerificationRun.query.order_by(VerificationRun.inicio.desc()).limit(200).all()
+    return render_template('verificador/execucoes.html', execucoes=execucoes)
+
+@app.route('/api/verificador/execucoes', methods=['GET'])
+@login_required
+def api_verificador_execucoes():
+    """API: Passes do verificador, do mais recente para o mais antigo"""
+    limite = min(request.args.get('limite', 200, type=int), 5000)
+    query = VerificationRun.query
+    status = request.args.get('status', '')
+    if status:
+        query = query.filter(VerificationRun.status == status)
+    execucoes = query.order_by(VerificationRun.inicio.desc()).limit(limite).all()
+    
+    return jsonify({
+        'success': True,
+        'execucoes': [execucao.to_dict() for execucao in execucoes]
+    })
+
+@app.route('/metrics')
+def metricas_prometheus():
+    """Métricas do processo no formato Prometheus (apenas localhost ou com METRICAS_TOKEN)"""
+    if not config.METRICAS_ATIVO:
+        return jsonify({'error': 'Métricas desativadas'}), 404
+    token = request.args.get('token') or request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if request.remote_addr not in ('127.0.0.1', '::1') and not metricas.token_valido(token):
+        return jsonify({'error': 'Acesso negado'}), 403
+    return Response(metricas.registro.exportar(), content_type=metricas.TIPO_CONTEUDO)
+
+@app.route('/api/outbox', methods=['GET'])
+@login_required
+def api_outbox():
+    """API: Chamadas à API externa pendentes ou em falha definitiva (apenas admin)"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'error': 'Acesso negado'}), 403
+    
+    estado = request.args.get('estado', 'falha_definitiva')
+    limite = min(request.args.get('limite', 100, type=int), 1000)
+    mensagens = ApiOutbox.query.filter_by(estado=estado)\
+        .order_by(ApiOutbox.id.desc()).limit(limite).all()
+    
+    return jsonify({'success': True, 'mensagens': [m.to_dict() for m in mensagens]})
+
+@app.route('/api/outbox/<int:mensagem_id>/reenviar', methods=['POST'])
+@login_required
+def api_outbox_reenviar(mensagem_id):
+    """API: Devolve uma mensagem em falha definitiva para a fila (apenas admin)"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'error': 'Acesso negado'}), 403
+    
+    mensagem = ApiOutbox.query.get(mensagem_id)
+    if not mensagem:
+        return jsonify({'success': False, 'error': 'Mensagem não encontrada'}), 404
+    
+    mensagem.estado = 'pendente'
+    mensagem.tentativas = 0
+    mensagem.proxima_tentativa_em = datetime.utcnow()
+    mensagem.bloqueado_por = None
+    mensagem.bloqueado_ate = None
+    db.session.commit()
+    
+    return jsonify({'success': True, 'message': 'Mensagem devolvida para a fila'})
+
+@app.route('/admin/perfis')
+@login_required
+def admin_perfis():
+    """Perfis de requisições gravados com ?_perfil=1 (apenas admin)"""
+    if not current_user.is_admin():
+        flash('Acesso negado. Apenas administradores podem ver os perfis.', 'error')
+        return redirect(url_for('romaneios'))
+    
+    return render_template('admin/perfis.html', perfis=perfilamento.listar())
+
+@app.route('/admin/perfis/<perfil_id>')
+@login_required
+def admin_perfil_detalhe(perfil_id):
+    """Top funções (pstats) e linha do tempo de SQL de um perfil (apenas admin)"""
+    if not current_user.is_admin():
+        flash('Acesso negado. Apenas administradores podem ver os perfis.', 'error')
+        return redirect(url_for('romaneios'))
+    
+    perfil = perfilamento.carregar(perfil_id)
+    if not perfil:
+        flash('Perfil não encontrado', 'error')
+        return redirect(url_for('admin_perfis'))
+    
+    ordem = request.args.get('ordem', 'cumulative')
+    if ordem not in ('cumulative', 'tottime', 'ncalls'):
+        ordem = 'cumulative'
+    return render_template('admin/perfil_detalhe.html', perfil=perfil, ordem=ordem,
+                           estatisticas=perfilamento.funcoes_mais_caras(perfil_id, ordem=ordem))
+
+@app.route('/admin/perfis/<perfil_id>/download/<tipo>')
+@login_required
+def admin_perfil_download(perfil_id, tipo):
+    """Baixa o .prof (pstats) ou o .json (metadados + SQL) de um perfil (apenas admin)"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'error': 'Acesso negado'}), 403
+    
+    arquivo = perfilamento.caminho(perfil_id, f'.{tipo}')
+    if not arquivo:
+        return jsonify({'success': False, 'error': 'Perfil não encontrado'}), 404
+    return send_file(os.path.abspath(arquivo), as_attachment=True, download_name=os.path.basename(arquivo))
+
 @app.route('/api/romaneios/<int:romaneio_id>/logs', methods=['GET'])
 @login_required
 def api_logs_romaneio(romaneio_id):
@@ -1361,6 +1755,19 @@ def api_logs_romaneio(romaneio_id):
         'logs': [log.to_dict() for log in logs]
     })
 
+_despachante_outbox = None
+_despachante_lock = threading.Lock()
+
+def iniciar_despachante_outbox():
+    """Inicia (uma vez por processo) a thread que entrega o outbox: inserções de romaneios e status"""
+    from services.outbox_dispatcher import OutboxDispatcher
+    global _despachante_outbox
+    with _despachante_lock:
+        if _despachante_outbox is None:
+            _despachante_outbox = OutboxDispatcher()
+            _despachante_outbox.iniciar_thread(app)
+    return _despachante_outbox
+
 def create_admin_user():
     """Cria o usuário administrador padrão se não existir"""
     try:
@@ -1408,6 +1815,10 @@ if __name__ == '__main__':
         db.create_all()
         create_admin_user()
     
+    # Com o reloader do debug, só o processo filho serve requisições
+    if config.OUTBOX_NO_APP and (not config.FLASK_DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        iniciar_despachante_outbox()
+    
     print("\n" + "="*60)
     print("🚀 RPA Profectum - Sistema de Romaneios")
     print("="*60)
@@ -0,0 +1,96 @@
+"""
+Benchmark da decodificação de respostas grandes de GET /api/romaneio/{pedido}
+Compara tempo e pico de memória de:
+- json.loads do corpo inteiro (caminho antigo, response.json())
+- orjson.loads do corpo inteiro (se instalado)
+- leitura incremental em lotes com ijson (se instalado)
+
+Uso:
+    python benchmarks/bench_parse.py --itens 20000 --lote 500
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import leitor_json
+from services.leitor_json import LeitorRomaneio
+
+
+def gerar_payload(quantidade_itens):
+    """Corpo JSON no formato da API com `quantidade_itens` itens"""
+    itens = [
+        {
+            "IDRO": 112244,
+            "CODIGO": f"02.{i:06d}",
+            "DESCRICAO": f"PRODUTO SINTETICO {i}",
+            "QUANTIDADE_CONTADA": i % 50,
+            "QUANTIDADE_NF": i % 50
+        }
+        for i in range(quantidade_itens)
+    ]
+    return json.dumps([{"PEDIDO": "000285847", "IDRO": 112244, "NOTA_FISCAL": "000123", "ITEM": itens}]).encode()
+
+
+def medir(nome, funcao, repeticoes):
+    """Executa `funcao` e retorna (nome, melhor tempo, pico de memória em MB)"""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    funcao()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return nome, min(tempos), pico / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de decodificação de romaneios grandes')
+    parser.add_argument('--itens', type=int, default=20000, help='Itens no romaneio (padrão: 20000)')
+    parser.add_argument('--lote', type=int, default=500, help='Itens por lote na leitura incremental (padrão: 500)')
+    parser.add_argument('--repeticoes', type=int, default=3, help='Repetições por caso (padrão: 3)')
+    args = parser.parse_args()
+
+    payload = gerar_payload(args.itens)
+    print(f"Payload: {args.itens} itens, {len(payload) / (1024 * 1024):.1f} MB")
+
+    def consumir_lotes():
+        total = 0
+        with LeitorRomaneio(io.BytesIO(payload)) as leitor:
+            for lote in leitor.lotes_itens(args.lote):
+                total += len(lote)
+        assert total == args.itens
+
+    casos = [('json.loads (corpo inteiro)', lambda: json.loads(payload))]
+    if leitor_json.orjson is not None:
+        casos.append(('orjson.loads (corpo inteiro)', lambda: leitor_json.orjson.loads(payload)))
+    else:
+        print("[AVISO] orjson nao instalado - caso ignorado")
+    if leitor_json.ijson is not None:
+        casos.append((f'ijson em lotes de {args.lote}', consumir_lotes))
+    else:
+        print("[AVISO] ijson nao instalado - caso ignorado")
+
+    print()
+    print(f"{'Caso':<34}{'Tempo (s)':>12}{'Pico (MB)':>12}")
+    print("-" * 58)
+    for nome, funcao in casos:
+        nome, tempo, pico = medir(nome, funcao, args.repeticoes)
+        print(f"{nome:<34}{tempo:>12.3f}{pico:>12.1f}")
+
+    # O pico da leitura incremental não cresce com o payload: a medição acima
+    # usa BytesIO (o corpo inteiro já está em memória); com response.raw só o
+    # buffer de leitura e um lote ficam vivos
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+Benchmarks do pipeline de verificação
+Mede, contra um banco SQLite temporário e respostas sintéticas da API:
+- executar_verificacao_automatica (passe completo)
+- _atualizar_itens_banco (upsert dos itens de um romaneio)
+- _verificar_quantidades (conferência das quantidades)
+- Romaneio.to_dict (serialização de todos os romaneios)
+
+Os parâmetros aceitam listas; todas as combinações são executadas. O
+resultado vai para um JSON que pode ser comparado entre commits.
+
+Uso:
+    python benchmarks/bench_verificacao.py --romaneios 50,200 --itens 10,500 --saida antes.json
+    python benchmarks/bench_verificacao.py --romaneios 50,200 --itens 10,500 --saida depois.json --comparar antes.json
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import config
+
+
+def lista(tipo):
+    """Tipo do argparse para listas separadas por vírgula"""
+    return lambda texto: [tipo(valor) for valor in texto.split(',')]
+
+
+def estatisticas(tempos):
+    return {
+        'min': round(min(tempos), 6),
+        'mediana': round(statistics.median(tempos), 6),
+        'media': round(statistics.mean(tempos), 6),
+        'desvio': round(statistics.stdev(tempos), 6) if len(tempos) > 1 else 0.0,
+        'repeticoes': len(tempos)
+    }
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Cenario:
+    """Banco e respostas sintéticas para uma combinação de parâmetros"""
+
+    def __init__(self, app, db, modelos, pasta, romaneios, itens, contados, latencia_ms):
+        self.app = app
+        self.db = db
+        self.modelos = modelos
+        self.pasta = pasta
+        self.romaneios = romaneios
+        self.itens = itens
+        self.contados = contados
+        self.latencia = latencia_ms / 1000
+        self.gravacao = os.path.join(pasta, f'respostas_{romaneios}_{itens}_{contados}_{latencia_ms}.jsonl.gz')
+
+    def pedido(self, indice):
+        return f"BENCH{indice:06d}"
+
+    def itens_api(self, indice):
+        """Itens da resposta da API; romaneios fora da fração `contados` têm um item sem contagem"""
+        contado = indice < round(self.romaneios * self.contados)
+        return [
+            {
+                "IDRO": 500000 + indice,
+                "CODIGO": f"02.{item:06d}",
+                "DESCRICAO": f"PRODUTO {item}",
+                "QUANTIDADE_CONTADA": (item % 50 + 1) if contado or item > 0 else None,
+                "QUANTIDADE_NF": item % 50 + 1
+            }
+            for item in range(self.itens)
+        ]
+
+    def corpo(self, indice):
+        return json.dumps([{
+            "PEDIDO": self.pedido(indice),
+            "IDRO": 500000 + indice,
+            "NOTA_FISCAL": f"{indice:06d}",
+            "ITEM": self.itens_api(indice)
+        }]).encode()
+
+    def gravar_respostas(self):
+        """Respostas sintéticas no formato do replay (uma por pedido)"""
+        from services.gravacao import GravadorRespostas
+
+        gravador = GravadorRespostas(self.gravacao, api_base_url='benchmark')
+        for indice in range(self.romaneios):
+            gravador.registrar(self.pedido(indice), gravador.inicio, self.latencia, 'resposta',
+                               corpo=self.corpo(indice).decode())
+        gravador.fechar()
+
+    def popular(self):
+        """Recria as tabelas e insere romaneios com itens ainda sem contagem"""
+        from sqlalchemy import insert
+
+        db = self.db
+        Romaneio, RomaneioItem, User = self.modelos
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+        agora = datetime.utcnow()
+        db.session.execute(insert(User), [{
+            'username': 'bench', 'email': 'bench@localhost', 'password_hash': '-', 'full_name': 'Benchmark',
+            'role': 'admin', 'created_at': agora
+        }])
+        db.session.execute(insert(Romaneio), [{
+            'id': indice + 1,
+            'pedido_compra': self.pedido(indice),
+            'nota_fiscal': f"{indice:06d}",
+            'chave_acesso': '3' * 44,
+            'status': 'P',
+            'tentativas_contagem': 0,
+            'created_by': 1,
+            'created_at': agora,
+            'updated_at': agora
+        } for indice in range(self.romaneios)])
+        for indice in range(self.romaneios):
+            db.session.execute(insert(RomaneioItem), [{
+                'romaneio_id': indice + 1,
+                'idro': 500000 + indice,
+                'codigo': item['CODIGO'],
+                'descricao': item['DESCRICAO'],
+                'quantidade_nf': item['QUANTIDADE_NF'],
+                'quantidade_contada': None,
+                'created_at': agora,
+                'updated_at': agora
+            } for item in self.itens_api(indice)])
+        db.session.commit()
+
+
+def medir(funcao, repeticoes, preparar=None, finalizar=None):
+    tempos = []
+    for _ in range(repeticoes):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+        if finalizar:
+            finalizar()
+    return estatisticas(tempos)
+
+
+def executar_cenario(cenario, repeticoes):
+    from services.gravacao import ClienteReproducao
+    from services.leitor_json import LeitorRomaneio
+    from services.verificador_service import VerificadorService
+
+    db = cenario.db
+    Romaneio = cenario.modelos[0]
+    cenario.gravar_respostas()
+    resultados = {}
+
+    # Passe completo (banco repopulado antes de cada repetição, fora da medição)
+    verificador = VerificadorService()
+
+    def preparar_passe():
+        cenario.popular()
+        verificador.api_client = ClienteReproducao(cenario.gravacao, tempo_real=cenario.latencia > 0)
+
+    resultados['executar_verificacao_automatica'] = medir(
+        verificador.executar_verificacao_automatica, repeticoes, preparar=preparar_passe)
+
+    cenario.popular()
+    romaneio = db.session.get(Romaneio, 1)
+    corpo = cenario.corpo(0)
+
+    def atualizar_itens():
+        with LeitorRomaneio(io.BytesIO(corpo)) as leitor:
+            verificador._atualizar_itens_banco(romaneio, leitor.lotes_itens(config.VERIFICADOR_ITENS_POR_LOTE))
+        db.session.flush()
+
+    resultados['_atualizar_itens_banco'] = medir(atualizar_itens, repeticoes, finalizar=db.session.rollback)
+
+    atualizar_itens()
+    db.session.commit()
+    resultados['_verificar_quantidades'] = medir(lambda: verificador._verificar_quantidades(romaneio), repeticoes)
+
+    def serializar_todos():
+        db.session.expire_all()
+        return [r.to_dict() for r in Romaneio.query.all()]
+
+    resultados['Romaneio.to_dict'] = medir(serializar_todos, repeticoes)
+    return resultados
+
+
+def comparar(atual, anterior_caminho):
+    with open(anterior_caminho, encoding='utf-8') as arquivo:
+        anterior = json.load(arquivo)
+
+    def chave(resultado):
+        return resultado['caso'], json.dumps(resultado['parametros'], sort_keys=True)
+
+    base = {chave(r): r for r in anterior['resultados']}
+    print(f"\nComparacao com {anterior_caminho} (commit {anterior['meta'].get('commit')}) - mediana")
+    print(f"{'Caso':<34}{'Parametros':<36}{'Antes (s)':>11}{'Depois (s)':>11}{'Dif.':>9}")
+    print("-" * 101)
+    for resultado in atual['resultados']:
+        antes = base.get(chave(resultado))
+        if not antes:
+            continue
+        t0 = antes['tempos']['mediana']
+        t1 = resultado['tempos']['mediana']
+        diferenca = (t1 - t0) / t0 * 100 if t0 else 0
+        parametros = ' '.join(f"{k}={v}" for k, v in resultado['parametros'].items())
+        print(f"{resultado['caso']:<34}{parametros:<36}{t0:>11.4f}{t1:>11.4f}{diferenca:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks do pipeline de verificacao')
+    parser.add_argument('--romaneios', type=lista(int), default=[50], help='Romaneios no banco (ex.: 50,200)')
+    parser.add_argument('--itens', type=lista(int), default=[20], help='Itens por romaneio (ex.: 10,500)')
+    parser.add_argument('--contados', type=lista(float), default=[0.5],
+                        help='Fração de romaneios já totalmente contados na API (ex.: 0,0.5,1)')
+    parser.add_argument('--latencia-ms', type=lista(float), default=[0],
+                        help='Latência simulada por consulta em ms (ex.: 0,20)')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--saida', default='benchmark_verificacao.json', help='Arquivo JSON de resultado')
+    parser.add_argument('--comparar', metavar='ANTERIOR', help='JSON de uma execução anterior para comparar')
+    parser.add_argument('--manter', action='store_true',
+                        help='Não apaga a pasta temporária (banco e respostas gravadas) ao terminar')
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix='bench_verificacao_')
+    try:
+        return executar(args, pasta)
+    finally:
+        if args.manter:
+            print(f"[INFO] Banco e respostas mantidos em {pasta}")
+        else:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+
+def executar(args, pasta):
+    # Banco temporário configurado antes de importar o app; logs, spans, perfis
+    # e validadores também vão para a pasta temporária, não para instance/
+    config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(pasta, 'bench.db')
+    config.LOG_ARQUIVO = os.path.join(pasta, 'logs', 'rpa.jsonl')
+    config.TRACING_ARQUIVO = os.path.join(pasta, 'traces', 'spans.jsonl')
+    config.PERFIL_PASTA = os.path.join(pasta, 'perfis')
+    config.API_VALIDADORES_ARQUIVO = os.path.join(pasta, 'validadores_api.db')
+    config.VERIFICADOR_LOG_DETALHADO = False
+    config.MODO_TESTE = True
+    config.MAX_TENTATIVAS_CONTAGEM = 1000000
+
+    from app import app, db, Romaneio, RomaneioItem, User
+
+    resultado = {
+        'meta': {
+            'commit': commit_atual(),
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'repeticoes': args.repeticoes
+        },
+        'resultados': []
+    }
+
+    combinacoes = list(itertools.product(args.romaneios, args.itens, args.contados, args.latencia_ms))
+    with app.app_context():
+        for numero, (romaneios, itens, contados, latencia_ms) in enumerate(combinacoes, 1):
+            parametros = {'romaneios': romaneios, 'itens': itens, 'contados': contados, 'latencia_ms': latencia_ms}
+            print(f"[{numero}/{len(combinacoes)}] {parametros}")
+            cenario = Cenario(app, db, (Romaneio, RomaneioItem, User), pasta,
+                              romaneios, itens, contados, latencia_ms)
+            for caso, tempos in executar_cenario(cenario, args.repeticoes).items():
+                resultado['resultados'].append({'caso': caso, 'parametros': parametros, 'tempos': tempos})
+                print(f"    {caso:<34} mediana {tempos['mediana']:.4f}s  min {tempos['min']:.4f}s")
+        # Solta o arquivo do banco para a pasta poder ser apagada (no Windows)
+        db.engine.dispose()
+
+    with open(args.saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, indent=2)
+    print(f"\n[INFO] Resultado salvo em {args.saida}")
+
+    if args.comparar:
+        comparar(resultado, args.comparar)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
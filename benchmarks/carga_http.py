@@ -0,0 +1,383 @@
+"""
+Teste de carga HTTP das rotas do painel
+Faz login e dispara requisições concorrentes, com pesos configuráveis, em:
+- /romaneios (páginas e filtros de status e pedido)
+- /romaneios/<id> e /api/romaneios/<id>
+- /logs
+- /romaneios/exportar-excel
+- /api/romaneios/<id>/verificar
+
+Mostra p50/p95/p99, vazão e taxa de erro por rota e salva um JSON que pode
+ser comparado entre commits. Os ids usados vêm do banco (--banco) ou do
+intervalo 1..--id-max.
+
+A rota verificar consulta a API de romaneios. Com --servidor, o app usa
+--api-url (só endereços locais) ou, por padrão, um simulador_api_romaneios.py
+iniciado pelo script. Contra um servidor externo (--url) essa rota fica com
+peso 0, a menos que --pesos a inclua.
+
+Uso:
+    python gerar_dados_sinteticos.py --banco instance/carga.db --perfil pequeno
+    python benchmarks/carga_http.py --banco instance/carga.db --servidor --duracao 30 --saida antes.json
+    python benchmarks/carga_http.py --url http://127.0.0.1:5000 --id-max 10000 --concorrencia 16
+    python benchmarks/carga_http.py --banco instance/carga.db --servidor --saida depois.json --comparar antes.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import urlparse
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Peso padrão de cada rota na mistura de requisições
+PESOS_PADRAO = {
+    'romaneios_pagina': 25,
+    'romaneios_filtro': 10,
+    'romaneio_detalhe': 20,
+    'api_romaneio': 25,
+    'logs': 10,
+    'exportar_excel': 2,
+    'verificar': 8,
+}
+
+HOSTS_LOCAIS = {'127.0.0.1', 'localhost', '::1'}
+
+
+def percentil(valores_ordenados, p):
+    """Percentil pelo método nearest-rank"""
+    if not valores_ordenados:
+        return None
+    indice = max(0, min(len(valores_ordenados) - 1, int(round(p / 100 * len(valores_ordenados) + 0.5)) - 1))
+    return valores_ordenados[indice]
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def carregar_alvos(banco, id_max):
+    """Ids e pedidos usados nas requisições"""
+    if banco:
+        conexao = sqlite3.connect(f'file:{os.path.abspath(banco)}?mode=ro', uri=True)
+        try:
+            linhas = conexao.execute('SELECT id, pedido_compra FROM romaneio').fetchall()
+        finally:
+            conexao.close()
+        if not linhas:
+            raise ValueError(f"Nenhum romaneio em {banco}")
+        return [linha[0] for linha in linhas], [linha[1] for linha in linhas]
+    return list(range(1, id_max + 1)), []
+
+
+class Rotas:
+    """Monta (nome, método, caminho) aleatórios segundo os pesos"""
+
+    def __init__(self, pesos, ids, pedidos, paginas, rng):
+        self.nomes = [nome for nome, peso in pesos.items() if peso > 0]
+        self.pesos = [pesos[nome] for nome in self.nomes]
+        self.ids = ids
+        self.pedidos = pedidos
+        self.paginas = paginas
+        self.rng = rng
+
+    def sortear(self):
+        nome = self.rng.choices(self.nomes, weights=self.pesos)[0]
+        return (nome,) + getattr(self, nome)()
+
+    def romaneios_pagina(self):
+        return 'GET', f"/romaneios?page={self.rng.randint(1, self.paginas)}"
+
+    def romaneios_filtro(self):
+        status = self.rng.choice(['P', 'A', 'R', 'F', ''])
+        if self.pedidos:
+            return 'GET', f"/romaneios?status={status}&pedido={self.rng.choice(self.pedidos)[-5:]}"
+        return 'GET', f"/romaneios?status={status}&page={self.rng.randint(1, self.paginas)}"
+
+    def romaneio_detalhe(self):
+        return 'GET', f"/romaneios/{self.rng.choice(self.ids)}"
+
+    def api_romaneio(self):
+        return 'GET', f"/api/romaneios/{self.rng.choice(self.ids)}"
+
+    def logs(self):
+        return 'GET', f"/logs?page={self.rng.randint(1, self.paginas)}"
+
+    def exportar_excel(self):
+        return 'GET', f"/romaneios/exportar-excel?status={self.rng.choice(['P', 'A', 'R', 'F'])}"
+
+    def verificar(self):
+        return 'POST', f"/api/romaneios/{self.rng.choice(self.ids)}/verificar"
+
+
+def abrir_sessao(url, usuario, senha, timeout):
+    sessao = requests.Session()
+    resposta = sessao.post(f"{url}/login", data={'username': usuario, 'password': senha},
+                           allow_redirects=False, timeout=timeout)
+    if resposta.status_code != 302 or '/login' in resposta.headers.get('Location', ''):
+        raise RuntimeError(f"Login falhou para {usuario} (HTTP {resposta.status_code})")
+    return sessao
+
+
+class Medicoes:
+    """Latências e códigos de resposta por rota (thread-safe)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.codigos = defaultdict(lambda: defaultdict(int))
+        self.falhas_conexao = defaultdict(int)
+
+    def registrar(self, rota, latencia, codigo):
+        with self.lock:
+            self.latencias[rota].append(latencia)
+            self.codigos[rota][codigo] += 1
+
+    def registrar_falha(self, rota):
+        with self.lock:
+            self.falhas_conexao[rota] += 1
+
+    def resumo(self, duracao):
+        resultado = {}
+        for rota in sorted(set(self.latencias) | set(self.falhas_conexao)):
+            latencias = sorted(self.latencias[rota])
+            codigos = dict(self.codigos[rota])
+            total = len(latencias) + self.falhas_conexao[rota]
+            erros = sum(n for codigo, n in codigos.items() if codigo >= 500) + self.falhas_conexao[rota]
+            resultado[rota] = {
+                'requisicoes': total,
+                'vazao': round(total / duracao, 2) if duracao else 0,
+                'p50': percentil(latencias, 50),
+                'p95': percentil(latencias, 95),
+                'p99': percentil(latencias, 99),
+                'max': latencias[-1] if latencias else None,
+                'taxa_erro': round(erros / total, 4) if total else 0,
+                'codigos': {str(codigo): n for codigo, n in sorted(codigos.items())},
+                'falhas_conexao': self.falhas_conexao[rota]
+            }
+        return resultado
+
+
+def trabalhador(url, sessao, rotas, medicoes, fim, timeout, parar):
+    while not parar.is_set() and time.perf_counter() < fim:
+        nome, metodo, caminho = rotas.sortear()
+        inicio = time.perf_counter()
+        try:
+            resposta = sessao.request(metodo, url + caminho, allow_redirects=False, timeout=timeout)
+            resposta.content
+        except requests.RequestException:
+            medicoes.registrar_falha(nome)
+            continue
+        medicoes.registrar(nome, round((time.perf_counter() - inicio) * 1000, 3), resposta.status_code)
+
+
+def aguardar_processo(processo, url, nome):
+    """Espera `url` responder (qualquer código HTTP) ou o processo encerrar"""
+    for _ in range(100):
+        if processo.poll() is not None:
+            raise RuntimeError(f"{nome} encerrou ao iniciar (codigo {processo.returncode})")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    processo.terminate()
+    raise RuntimeError(f"{nome} nao respondeu em 20s")
+
+
+def iniciar_simulador(porta):
+    """Sobe o simulador da API de romaneios para o servidor de teste não chamar o ERP"""
+    processo = subprocess.Popen(
+        [sys.executable, os.path.join(RAIZ, 'simulador_api_romaneios.py'), '--porta', str(porta)],
+        cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{porta}"
+    aguardar_processo(processo, url, 'Simulador da API')
+    return processo, url
+
+
+def iniciar_servidor(banco, porta, api_url):
+    """Sobe o app em um processo separado apontando para `banco` e para a API `api_url`"""
+    codigo = (
+        "import config, sys; config.SQLALCHEMY_DATABASE_URI = sys.argv[1]; "
+        "from app import app; app.run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True, debug=False)"
+    )
+    processo = subprocess.Popen(
+        [sys.executable, '-c', codigo, 'sqlite:///' + os.path.abspath(banco), str(porta)],
+        cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env=dict(os.environ, API_BASE_URL=api_url)
+    )
+    url = f"http://127.0.0.1:{porta}"
+    aguardar_processo(processo, f"{url}/login", 'Servidor')
+    return processo, url
+
+
+def comparar(atual, anterior_caminho):
+    with open(anterior_caminho, encoding='utf-8') as arquivo:
+        anterior = json.load(arquivo)
+
+    print(f"\nComparacao com {anterior_caminho} (commit {anterior['meta'].get('commit')})")
+    print(f"{'Rota':<20}{'p50 antes':>11}{'p50 depois':>12}{'p95 antes':>11}{'p95 depois':>12}{'Dif. p95':>10}")
+    print("-" * 76)
+    for rota, depois in atual['rotas'].items():
+        antes = anterior['rotas'].get(rota)
+        if not antes or not antes['p95'] or not depois['p95']:
+            continue
+        diferenca = (depois['p95'] - antes['p95']) / antes['p95'] * 100
+        print(f"{rota:<20}{antes['p50']:>11.1f}{depois['p50']:>12.1f}"
+              f"{antes['p95']:>11.1f}{depois['p95']:>12.1f}{diferenca:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga HTTP das rotas do painel')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='URL base do painel')
+    parser.add_argument('--banco', help='Banco SQLite do servidor (para obter ids e pedidos reais)')
+    parser.add_argument('--servidor', action='store_true', help='Sobe o app apontando para --banco')
+    parser.add_argument('--porta', type=int, default=5055, help='Porta do servidor iniciado com --servidor')
+    parser.add_argument('--api-url', help='API de romaneios do servidor iniciado com --servidor, só endereços '
+                                          'locais (padrão: sobe simulador_api_romaneios.py)')
+    parser.add_argument('--porta-api', type=int, default=8901, help='Porta do simulador iniciado (padrão: 8901)')
+    parser.add_argument('--id-max', type=int, default=1000, help='Ids de 1 a N quando --banco não é informado')
+    parser.add_argument('--paginas', type=int, default=20, help='Páginas sorteadas nas listagens (padrão: 20)')
+    parser.add_argument('--usuario', default='profectum')
+    parser.add_argument('--senha', default='123456')
+    parser.add_argument('--concorrencia', type=int, default=8, help='Clientes simultâneos (padrão: 8)')
+    parser.add_argument('--duracao', type=float, default=30, help='Duração da medição em segundos (padrão: 30)')
+    parser.add_argument('--aquecimento', type=float, default=3, help='Segundos de aquecimento não medidos (padrão: 3)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--pesos', help='Pesos por rota, ex.: api_romaneio=50,verificar=0')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help='Arquivo JSON de resultado')
+    parser.add_argument('--comparar', metavar='ANTERIOR', help='JSON de uma execução anterior para comparar')
+    args = parser.parse_args()
+
+    if args.servidor and not args.banco:
+        print("[ERRO] --servidor exige --banco")
+        return 1
+    if args.api_url and urlparse(args.api_url).hostname not in HOSTS_LOCAIS:
+        print(f"[ERRO] --api-url precisa ser local ({', '.join(sorted(HOSTS_LOCAIS))}): "
+              f"a rota verificar não deve gerar carga na API real")
+        return 1
+
+    pesos = dict(PESOS_PADRAO)
+    if args.pesos:
+        for par in args.pesos.split(','):
+            nome, _, valor = par.partition('=')
+            if nome not in pesos:
+                print(f"[ERRO] Rota desconhecida em --pesos: {nome} (opcoes: {', '.join(pesos)})")
+                return 1
+            pesos[nome] = float(valor)
+    if not args.servidor and 'verificar=' not in (args.pesos or ''):
+        pesos['verificar'] = 0
+        print("[AVISO] Servidor externo: rota verificar desativada (consultaria a API configurada nele); "
+              "use --pesos verificar=N para incluí-la")
+
+    ids, pedidos = carregar_alvos(args.banco, args.id_max)
+
+    processos = []
+    url = args.url.rstrip('/')
+    api_url = None
+    try:
+        if args.servidor:
+            api_url = args.api_url
+            if not api_url:
+                simulador, api_url = iniciar_simulador(args.porta_api)
+                processos.append(simulador)
+                print(f"[INFO] Simulador da API iniciado em {api_url}")
+            processo, url = iniciar_servidor(args.banco, args.porta, api_url)
+            processos.append(processo)
+            print(f"[INFO] Servidor iniciado em {url} (banco {args.banco}, API {api_url})")
+
+        sessoes = [abrir_sessao(url, args.usuario, args.senha, args.timeout) for _ in range(args.concorrencia)]
+        print(f"[INFO] {args.concorrencia} cliente(s), {len(ids)} romaneio(s) alvo, "
+              f"aquecimento {args.aquecimento:.0f}s, medicao {args.duracao:.0f}s")
+
+        parar = threading.Event()
+        for fase, duracao in (('aquecimento', args.aquecimento), ('medicao', args.duracao)):
+            if duracao <= 0:
+                continue
+            medicoes = Medicoes()
+            fim = time.perf_counter() + duracao
+            threads = [
+                threading.Thread(
+                    target=trabalhador,
+                    args=(url, sessao, Rotas(pesos, ids, pedidos, args.paginas, random.Random(args.semente + numero)),
+                          medicoes, fim, args.timeout, parar),
+                    daemon=True
+                )
+                for numero, sessao in enumerate(sessoes)
+            ]
+            inicio = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    thread.join()
+            except KeyboardInterrupt:
+                parar.set()
+                print("\n[AVISO] Interrompido - resultados parciais")
+            duracao_real = time.perf_counter() - inicio
+    finally:
+        for processo in reversed(processos):
+            processo.terminate()
+            processo.wait(timeout=10)
+
+    rotas = medicoes.resumo(duracao_real)
+    total = sum(rota['requisicoes'] for rota in rotas.values())
+    resultado = {
+        'meta': {
+            'commit': commit_atual(),
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'url': url,
+            'api_url': api_url,
+            'banco': args.banco,
+            'concorrencia': args.concorrencia,
+            'duracao': round(duracao_real, 2),
+            'pesos': pesos
+        },
+        'total_requisicoes': total,
+        'vazao_total': round(total / duracao_real, 2) if duracao_real else 0,
+        'rotas': rotas
+    }
+
+    print()
+    print(f"{'Rota':<20}{'Req.':>8}{'Req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'Erros':>8}  Codigos")
+    print("-" * 100)
+    for nome, rota in rotas.items():
+        latencias = [rota[p] if rota[p] is not None else float('nan') for p in ('p50', 'p95', 'p99')]
+        codigos = ' '.join(f"{codigo}:{n}" for codigo, n in rota['codigos'].items())
+        if rota['falhas_conexao']:
+            codigos += f" conexao:{rota['falhas_conexao']}"
+        print(f"{nome:<20}{rota['requisicoes']:>8}{rota['vazao']:>9.1f}"
+              f"{latencias[0]:>10.1f}{latencias[1]:>10.1f}{latencias[2]:>10.1f}"
+              f"{rota['taxa_erro'] * 100:>7.1f}%  {codigos}")
+    print("-" * 100)
+    print(f"Total: {total} requisicoes em {duracao_real:.1f}s ({resultado['vazao_total']:.1f} req/s)")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, indent=2)
+        print(f"[INFO] Resultado salvo em {args.saida}")
+
+    if args.comparar:
+        comparar(resultado, args.comparar)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,6 +22,47 @@ FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
 # ========================================
 API_BASE_URL = os.getenv('API_BASE_URL', 'http://172.16.17:3600')
 API_SYSTEM_ID = os.getenv('API_SYSTEM_ID', 'sys_1f02a9e8b5f24d73b8e74d8fae931c64_prod')
+API_TIMEOUT_CONEXAO_SEGUNDOS = float(os.getenv('API_TIMEOUT_CONEXAO_SEGUNDOS', 5))
+API_TIMEOUT_SEGUNDOS = float(os.getenv('API_TIMEOUT_SEGUNDOS', 30))
+
+# Retentativas por endpoint (total de tentativas; 1 = sem retentativa)
+# O POST de inserção só é repetido se a conexão nem chegou a ser aberta
+API_RETRY_GET_TENTATIVAS = int(os.getenv('API_RETRY_GET_TENTATIVAS', 3))
+API_RETRY_PUT_TENTATIVAS = int(os.getenv('API_RETRY_PUT_TENTATIVAS', 3))
+API_RETRY_POST_TENTATIVAS = int(os.getenv('API_RETRY_POST_TENTATIVAS', 2))
+API_RETRY_BACKOFF_BASE = float(os.getenv('API_RETRY_BACKOFF_BASE', 0.5))  # segundos
+API_RETRY_BACKOFF_MAX = float(os.getenv('API_RETRY_BACKOFF_MAX', 8))
+
+# Circuit breaker: após N falhas seguidas, falha na hora por X segundos
+API_CIRCUITO_LIMITE_FALHAS = int(os.getenv('API_CIRCUITO_LIMITE_FALHAS', 5))
+API_CIRCUITO_ABERTO_SEGUNDOS = int(os.getenv('API_CIRCUITO_ABERTO_SEGUNDOS', 60))
+
+# Limite adaptativo de requisições por segundo (por endpoint, por processo)
+# A taxa sobe enquanto a API responde rápido e cai pela metade em timeouts,
+# erros 5xx/429 ou latência acima do alvo
+API_LIMITE_ATIVO = os.getenv('API_LIMITE_ATIVO', 'True').lower() == 'true'
+API_LIMITE_GET_POR_SEGUNDO = float(os.getenv('API_LIMITE_GET_POR_SEGUNDO', 20))
+API_LIMITE_PUT_POR_SEGUNDO = float(os.getenv('API_LIMITE_PUT_POR_SEGUNDO', 10))
+API_LIMITE_POST_POR_SEGUNDO = float(os.getenv('API_LIMITE_POST_POR_SEGUNDO', 5))
+API_LIMITE_TAXA_MIN = float(os.getenv('API_LIMITE_TAXA_MIN', 0.5))
+API_LIMITE_LATENCIA_ALVO_SEGUNDOS = float(os.getenv('API_LIMITE_LATENCIA_ALVO_SEGUNDOS', 2))
+API_LIMITE_INCREMENTO = float(os.getenv('API_LIMITE_INCREMENTO', 1))
+API_LIMITE_FATOR_REDUCAO = float(os.getenv('API_LIMITE_FATOR_REDUCAO', 0.5))
+API_LIMITE_RAJADA = float(os.getenv('API_LIMITE_RAJADA', 5))
+
+# Cache das respostas de GET /api/romaneio/{pedido} (LRU + TTL, por processo)
+# API_CACHE_ARQUIVO (opcional) guarda as respostas em disco para o próximo processo
+API_CACHE_ATIVO = os.getenv('API_CACHE_ATIVO', 'False').lower() == 'true'
+API_CACHE_TTL_SEGUNDOS = float(os.getenv('API_CACHE_TTL_SEGUNDOS', 60))
+API_CACHE_MAX_ITENS = int(os.getenv('API_CACHE_MAX_ITENS', 1000))
+API_CACHE_ARQUIVO = os.getenv('API_CACHE_ARQUIVO', '')  # ex.: instance/cache_api.db
+
+# Validadores das consultas condicionais do verificador (ETag, Last-Modified e
+# hash do corpo por pedido). Ficam em disco para que o verificador --once, um
+# processo novo a cada passe, também receba 304 / sem_alteracao
+API_VALIDADORES_ARQUIVO = os.getenv('API_VALIDADORES_ARQUIVO', os.path.join('instance', 'validadores_api.db'))  # vazio = só memória
+API_VALIDADORES_TTL_SEGUNDOS = float(os.getenv('API_VALIDADORES_TTL_SEGUNDOS', 24 * 3600))
+API_VALIDADORES_MAX_ITENS = int(os.getenv('API_VALIDADORES_MAX_ITENS', 50000))
 
 # ========================================
 # Modo de Operação
@@ -36,6 +77,115 @@ INTERVALO_VERIFICACAO_MINUTOS = int(os.getenv('INTERVALO_VERIFICACAO_MINUTOS', 5
 MAX_TENTATIVAS_CONTAGEM = int(os.getenv('MAX_TENTATIVAS_CONTAGEM', 3))
 VERIFICADOR_ATIVO = os.getenv('VERIFICADOR_ATIVO', 'True').lower() == 'true'
 VERIFICADOR_LOG_DETALHADO = os.getenv('VERIFICADOR_LOG_DETALHADO', 'True').lower() == 'true'
+# Leases permitem vários verificadores em paralelo sem processar o mesmo romaneio
+LEASE_DURACAO_SEGUNDOS = int(os.getenv('LEASE_DURACAO_SEGUNDOS', 300))
+LEASE_LOTE = int(os.getenv('LEASE_LOTE', 10))
+# Trava contra passes sobrepostos na mesma máquina
+VERIFICADOR_ARQUIVO_TRAVA = os.getenv('VERIFICADOR_ARQUIVO_TRAVA', os.path.join('instance', 'verificador.lock'))
+VERIFICADOR_SE_OCUPADO = os.getenv('VERIFICADOR_SE_OCUPADO', 'pular')  # pular ou aguardar
+VERIFICADOR_ESPERA_MAX_SEGUNDOS = int(os.getenv('VERIFICADOR_ESPERA_MAX_SEGUNDOS', 600))
+
+# Itens gravados por lote ao ler a resposta da API em stream e limite de
+# itens listados nos logs de divergência / itens sem contagem
+VERIFICADOR_ITENS_POR_LOTE = int(os.getenv('VERIFICADOR_ITENS_POR_LOTE', 500))
+VERIFICADOR_MAX_ITENS_LOG = int(os.getenv('VERIFICADOR_MAX_ITENS_LOG', 50))
+
+# ========================================
+# Outbox - Envio assíncrono de status para a API
+# ========================================
+OUTBOX_CONCORRENCIA = int(os.getenv('OUTBOX_CONCORRENCIA', 4))
+OUTBOX_LOTE = int(os.getenv('OUTBOX_LOTE', 20))
+OUTBOX_MAX_TENTATIVAS = int(os.getenv('OUTBOX_MAX_TENTATIVAS', 8))
+OUTBOX_BACKOFF_BASE_SEGUNDOS = int(os.getenv('OUTBOX_BACKOFF_BASE_SEGUNDOS', 30))
+OUTBOX_BACKOFF_MAX_SEGUNDOS = int(os.getenv('OUTBOX_BACKOFF_MAX_SEGUNDOS', 3600))
+OUTBOX_INTERVALO_SEGUNDOS = int(os.getenv('OUTBOX_INTERVALO_SEGUNDOS', 10))
+# Despacha o outbox também no processo do Flask (inserções de romaneios criados no painel)
+OUTBOX_NO_APP = os.getenv('OUTBOX_NO_APP', 'True').lower() == 'true'
+
+# ========================================
+# Verificação em lote (vários romaneios em segundo plano)
+# ========================================
+VERIFICACAO_LOTE_CONCORRENCIA = int(os.getenv('VERIFICACAO_LOTE_CONCORRENCIA', 4))  # somando todos os lotes
+VERIFICACAO_LOTE_MAX_ROMANEIOS = int(os.getenv('VERIFICACAO_LOTE_MAX_ROMANEIOS', 500))
+VERIFICACAO_LOTE_MAX_LOTES = int(os.getenv('VERIFICACAO_LOTE_MAX_LOTES', 20))  # lotes concluídos mantidos em memória
+
+# ========================================
+# Integrações - leitura em lote, status em massa e feed de alterações
+# ========================================
+INTEGRACAO_PAGINA_PADRAO = int(os.getenv('INTEGRACAO_PAGINA_PADRAO', 100))
+INTEGRACAO_PAGINA_MAX = int(os.getenv('INTEGRACAO_PAGINA_MAX', 500))  # também o máximo de ids por consulta
+INTEGRACAO_MAX_ALTERACOES = int(os.getenv('INTEGRACAO_MAX_ALTERACOES', 500))  # romaneios por PUT em massa
+
+# Feed de alterações (/api/changes?since=<seq>)
+ALTERACOES_PAGINA_PADRAO = int(os.getenv('ALTERACOES_PAGINA_PADRAO', 500))
+ALTERACOES_PAGINA_MAX = int(os.getenv('ALTERACOES_PAGINA_MAX', 5000))
+ALTERACOES_ESPERA_MAX_SEGUNDOS = float(os.getenv('ALTERACOES_ESPERA_MAX_SEGUNDOS', 30))  # long-poll
+# Com long-poll, intervalo para enxergar alterações gravadas por outros processos
+ALTERACOES_INTERVALO_CONSULTA_SEGUNDOS = float(os.getenv('ALTERACOES_INTERVALO_CONSULTA_SEGUNDOS', 1))
+
+# ========================================
+# Importação de romaneios por planilha
+# ========================================
+IMPORTACAO_MAX_LINHAS = int(os.getenv('IMPORTACAO_MAX_LINHAS', 20000))
+
+# ========================================
+# Pool de Workers dos Bots
+# ========================================
+# True = executa bots marcados com 'usar_pool' em processos pré-aquecidos
+BOT_POOL_ATIVO = os.getenv('BOT_POOL_ATIVO', 'False').lower() == 'true'
+BOT_POOL_WORKERS = int(os.getenv('BOT_POOL_WORKERS', 2))
+BOT_POOL_MAX_EXECUCOES = int(os.getenv('BOT_POOL_MAX_EXECUCOES', 20))
+BOT_POOL_MAX_MEMORIA_MB = int(os.getenv('BOT_POOL_MAX_MEMORIA_MB', 512))  # crescimento máximo antes de reciclar
+BOT_POOL_PRE_IMPORTS = [m.strip() for m in os.getenv('BOT_POOL_PRE_IMPORTS', 'requests').split(',') if m.strip()]
+# Espera máxima por um worker ocioso; depois disso o bot roda em subprocess (frio)
+BOT_POOL_ESPERA_SEGUNDOS = float(os.getenv('BOT_POOL_ESPERA_SEGUNDOS', 30))
+# Worker que não fica pronto é recriado com backoff exponencial (base e teto)
+BOT_POOL_BACKOFF_SEGUNDOS = float(os.getenv('BOT_POOL_BACKOFF_SEGUNDOS', 5))
+BOT_POOL_BACKOFF_MAX_SEGUNDOS = float(os.getenv('BOT_POOL_BACKOFF_MAX_SEGUNDOS', 300))
+# Tempo máximo de um bot no worker; travado, o worker é morto e recriado (0 = sem limite)
+BOT_POOL_TIMEOUT_SEGUNDOS = float(os.getenv('BOT_POOL_TIMEOUT_SEGUNDOS', 1800))
+
+# ========================================
+# Logs (verificador, cliente da API e outbox)
+# ========================================
+# Gravados por uma thread de fundo: arquivo JSON lines rotativo + console
+LOG_NIVEL = os.getenv('LOG_NIVEL', 'INFO').upper()  # DEBUG mostra cada etapa de cada romaneio
+LOG_NIVEL_CONSOLE = os.getenv('LOG_NIVEL_CONSOLE', 'INFO').upper()
+LOG_CONSOLE = os.getenv('LOG_CONSOLE', 'True').lower() == 'true'
+LOG_ARQUIVO = os.getenv('LOG_ARQUIVO', os.path.join('instance', 'logs', 'rpa.jsonl'))  # vazio = sem arquivo
+LOG_ARQUIVO_MAX_MB = int(os.getenv('LOG_ARQUIVO_MAX_MB', 10))
+LOG_ARQUIVO_BACKUPS = int(os.getenv('LOG_ARQUIVO_BACKUPS', 5))
+
+# ========================================
+# Métricas (formato Prometheus)
+# ========================================
+# /metrics responde para 127.0.0.1 ou para quem enviar o token
+# (header "Authorization: Bearer <token>" ou ?token=<token>)
+METRICAS_ATIVO = os.getenv('METRICAS_ATIVO', 'True').lower() == 'true'
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN', '')
+# Escritas no SQLite acima deste tempo contam como espera pelo lock
+METRICAS_LIMIAR_LOCK_MS = float(os.getenv('METRICAS_LIMIAR_LOCK_MS', 100))
+
+# ========================================
+# Perfilamento de requisições (apenas admins)
+# ========================================
+# Admin logado pede com ?_perfil=1 ou header "X-Perfil: 1"; lista em /admin/perfis
+PERFIL_ATIVO = os.getenv('PERFIL_ATIVO', 'True').lower() == 'true'
+PERFIL_PASTA = os.getenv('PERFIL_PASTA', os.path.join('instance', 'perfis'))
+PERFIL_MAX_ARQUIVOS = int(os.getenv('PERFIL_MAX_ARQUIVOS', 50))  # perfis mais antigos são apagados
+
+# ========================================
+# Tracing (spans em arquivo, formato OTLP/JSON)
+# ========================================
+# Requisição Flask > chamadas à API > SQL, e as fases do verificador
+TRACING_ATIVO = os.getenv('TRACING_ATIVO', 'False').lower() == 'true'
+TRACING_ARQUIVO = os.getenv('TRACING_ARQUIVO', os.path.join('instance', 'traces', 'spans.jsonl'))
+TRACING_ARQUIVO_MAX_MB = int(os.getenv('TRACING_ARQUIVO_MAX_MB', 50))  # acima disso vira spans.jsonl.1
+TRACING_AMOSTRAGEM = float(os.getenv('TRACING_AMOSTRAGEM', 1.0))  # fração dos traces gravados (0 a 1)
+TRACING_SQL = os.getenv('TRACING_SQL', 'True').lower() == 'true'  # um span por statement
+TRACING_SERVICO = os.getenv('TRACING_SERVICO', 'rpa-romaneios')
+# Spans aguardando gravação; acima disso os novos são descartados (disco lento ou cheio)
+TRACING_FILA_MAX = int(os.getenv('TRACING_FILA_MAX', 20000))
 
 # ========================================
 # Opções Padrão da API de Inserção
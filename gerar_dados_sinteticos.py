@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Gera um banco SQLite com dados sintéticos para testes de escala
+Cria o schema do app (mesmas tabelas, configurações padrão e usuário
+profectum / 123456) e carrega Romaneio, RomaneioItem, RomaneioLog,
+BotExecution e BotLog com inserções em massa (sqlite3 executemany, índices
+secundários recriados no final).
+
+Os dados seguem o formato real:
+- chaves de acesso de 44 dígitos com dígito verificador (módulo 11)
+- mistura de status P/A/R/F e tentativas de contagem coerentes com os itens
+- SKUs com distribuição de Zipf (poucos produtos aparecem em muitos romaneios)
+
+Uso:
+    python gerar_dados_sinteticos.py --banco instance/sintetico.db --perfil pequeno
+    python gerar_dados_sinteticos.py --banco instance/escala.db --perfil grande
+    python gerar_dados_sinteticos.py --banco instance/x.db --romaneios 50000 --itens-por-romaneio 40
+
+Também pode ser usado por outros scripts (benchmarks):
+    from gerar_dados_sinteticos import gerar_banco
+    gerar_banco('/tmp/bench.db', romaneios=10000)
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Perfis prontos: (romaneios, itens por romaneio, execuções de bots, logs por execução)
+PERFIS = {
+    'pequeno': {'romaneios': 10000, 'itens_por_romaneio': 20, 'execucoes': 1000, 'logs_por_execucao': 50},
+    'medio': {'romaneios': 100000, 'itens_por_romaneio': 20, 'execucoes': 10000, 'logs_por_execucao': 200},
+    'grande': {'romaneios': 1000000, 'itens_por_romaneio': 20, 'execucoes': 100000, 'logs_por_execucao': 470},
+}
+
+# Proporção de cada status (P=Pendente, A=Aberto, R=Recebido, F=Finalizado)
+MISTURA_STATUS = {'P': 0.25, 'A': 0.20, 'R': 0.30, 'F': 0.25}
+
+MISTURA_EXECUCOES = {'completed': 0.85, 'failed': 0.10, 'stopped': 0.05}
+MISTURA_NIVEIS_LOG = {'INFO': 0.80, 'DEBUG': 0.10, 'WARNING': 0.07, 'ERROR': 0.03}
+
+NOMES_BOTS = ['SIC - Processo Completo', 'SIC - Apenas Login', 'SIC - Inserir NFs Pendentes', 'RM - Login']
+MODULOS_LOG = ['orchestrator', 'sic_login', 'sic_nf', 'rm_login', 'navegador']
+
+# Códigos de UF usados nas chaves (SP, PR, SC, RS, MG, RJ, GO, BA)
+UFS = ['35', '41', '42', '43', '31', '33', '52', '29']
+
+TABELAS = ['romaneio', 'romaneio_item', 'romaneio_log', 'bot_execution', 'bot_log']
+
+
+# ==================== DOCUMENTOS ====================
+
+def digito_modulo11(numero, peso_maximo=9):
+    """Dígito verificador módulo 11 (pesos 2..peso_maximo da direita para a esquerda)"""
+    soma = 0
+    peso = 2
+    for digito in reversed(numero):
+        soma += int(digito) * peso
+        peso = 2 if peso == peso_maximo else peso + 1
+    resto = soma % 11
+    return 0 if resto < 2 else 11 - resto
+
+
+def gerar_cnpj(rng):
+    """CNPJ de 14 dígitos com dígitos verificadores válidos"""
+    base = f"{rng.randrange(10 ** 8):08d}0001"
+    dv1 = digito_modulo11(base)
+    dv2 = digito_modulo11(base + str(dv1))
+    return f"{base}{dv1}{dv2}"
+
+
+def gerar_chave_acesso(rng, emissao, cnpj, nota_fiscal):
+    """
+    Chave de acesso da NF-e (44 dígitos):
+    cUF(2) AAMM(4) CNPJ(14) modelo(2) série(3) nNF(9) tpEmis(1) cNF(8) cDV(1)
+    """
+    chave = (f"{rng.choice(UFS)}{emissao:%y%m}{cnpj}55{rng.randrange(1, 4):03d}"
+             f"{int(nota_fiscal):09d}1{rng.randrange(10 ** 8):08d}")
+    return chave + str(digito_modulo11(chave))
+
+
+def chave_acesso_valida(chave):
+    """Confere tamanho e dígito verificador de uma chave de acesso"""
+    return (len(chave) == 44 and chave.isdigit()
+            and digito_modulo11(chave[:43]) == int(chave[43]))
+
+
+# ==================== DISTRIBUIÇÕES ====================
+
+class Zipf:
+    """Sorteio de índices 0..n-1 com probabilidade proporcional a 1/(k+1)^s"""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        acumulado = 0.0
+        self.acumulados = []
+        for k in range(1, n + 1):
+            acumulado += 1.0 / k ** s
+            self.acumulados.append(acumulado)
+        self.total = acumulado
+
+    def sortear(self):
+        return bisect.bisect(self.acumulados, self.rng.random() * self.total)
+
+
+def sorteador(mistura, rng):
+    """Função que sorteia uma chave de `mistura` segundo as proporções"""
+    chaves = list(mistura)
+    pesos = list(itertools.accumulate(mistura.values()))
+    return lambda: rng.choices(chaves, cum_weights=pesos)[0]
+
+
+def formatar_data(valor):
+    """Datas no formato que o SQLAlchemy grava no SQLite"""
+    return valor.strftime('%Y-%m-%d %H:%M:%S.%f') if valor else None
+
+
+# ==================== GERAÇÃO ====================
+
+class GeradorDados:
+    """Produz as linhas de cada tabela em lotes"""
+
+    def __init__(self, romaneios, itens_por_romaneio, execucoes, logs_por_execucao,
+                 skus=50000, zipf=1.1, fornecedores=2000, dias=365, usuarios=(1,), semente=42):
+        self.rng = random.Random(semente)
+        self.romaneios = romaneios
+        self.itens_por_romaneio = itens_por_romaneio
+        self.execucoes = execucoes
+        self.logs_por_execucao = logs_por_execucao
+        self.usuarios = list(usuarios)
+        self.fim = datetime.utcnow().replace(microsecond=0)
+        self.inicio = self.fim - timedelta(days=dias)
+        self.segundos = int((self.fim - self.inicio).total_seconds())
+
+        self.skus = Zipf(skus, zipf, self.rng)
+        self.fornecedores = Zipf(fornecedores, zipf, self.rng)
+        self.cnpjs = [gerar_cnpj(self.rng) for _ in range(fornecedores)]
+        self.status = sorteador(MISTURA_STATUS, self.rng)
+        self.status_execucao = sorteador(MISTURA_EXECUCOES, self.rng)
+        self.nivel_log = sorteador(MISTURA_NIVEIS_LOG, self.rng)
+
+    def _data(self):
+        return self.inicio + timedelta(seconds=self.rng.randrange(self.segundos))
+
+    def _quantidade(self):
+        return max(1, int(self.rng.lognormvariate(2.0, 1.0)))
+
+    def _itens(self, romaneio_id, idro, status, tentativas, criado_em):
+        """Itens do romaneio; quantidade de itens com cauda longa (exponencial)"""
+        quantidade = max(1, int(self.rng.expovariate(1 / self.itens_por_romaneio)))
+        codigos = sorted({self.skus.sortear() for _ in range(quantidade)})
+        for sku in codigos:
+            quantidade_nf = self._quantidade()
+            if status != 'P':
+                contada = quantidade_nf
+            elif tentativas == 0:
+                contada = None
+            else:
+                sorteio = self.rng.random()
+                if sorteio < 0.05:
+                    contada = None
+                elif sorteio < 0.15:
+                    contada = max(0, quantidade_nf + self.rng.choice((-2, -1, 1, 2)))
+                else:
+                    contada = quantidade_nf
+            yield (romaneio_id, idro, f"{sku // 10000 + 1:02d}.{sku % 10000:06d}",
+                   f"PRODUTO SINTETICO {sku:06d}", quantidade_nf, contada,
+                   formatar_data(criado_em), formatar_data(criado_em))
+
+    def _logs_romaneio(self, romaneio_id, status, tentativas, criado_em, atualizado_em, usuario):
+        yield (romaneio_id, formatar_data(criado_em), 'criado', None, 'P', None,
+               'Romaneio criado', usuario)
+        momento = criado_em
+        verificacoes = tentativas + (1 if status != 'P' else 0)
+        for tentativa in range(1, verificacoes + 1):
+            momento += timedelta(minutes=self.rng.randrange(10, 240))
+            if status != 'P' and tentativa == verificacoes:
+                yield (romaneio_id, formatar_data(momento), 'verificado', 'P', 'A', tentativa,
+                       'Todas as quantidades conferem. Status atualizado para Aberto.', None)
+            else:
+                yield (romaneio_id, formatar_data(momento), 'verificado', 'P', 'P', tentativa,
+                       'Divergencias encontradas:\n  - 02.000001: NF=10, Contado=9', None)
+        if status in ('R', 'F'):
+            yield (romaneio_id, formatar_data(atualizado_em), 'atualizado_manual', 'A', status, None,
+                   f'Status alterado manualmente para {status}', usuario)
+
+    def romaneios_itens_logs(self):
+        """Gera (romaneio, itens, logs) para cada romaneio"""
+        for romaneio_id in range(1, self.romaneios + 1):
+            criado_em = self._data()
+            status = self.status()
+            tentativas = self.rng.randrange(0, 4) if status == 'P' else self.rng.randrange(0, 3)
+            atualizado_em = min(self.fim, criado_em + timedelta(hours=self.rng.randrange(1, 24 * 15)))
+            usuario = self.rng.choice(self.usuarios)
+            nota_fiscal = f"{self.rng.randrange(1, 10 ** 6):06d}"
+            cnpj = self.cnpjs[self.fornecedores.sortear()]
+            idro = 100000 + romaneio_id if (status != 'P' or tentativas > 0) else None
+
+            romaneio = (romaneio_id, f"{romaneio_id:09d}", nota_fiscal,
+                        gerar_chave_acesso(self.rng, criado_em, cnpj, nota_fiscal),
+                        idro, status, tentativas, formatar_data(criado_em), formatar_data(atualizado_em),
+                        usuario, None, False, True, False, None, None,
+                        formatar_data(self.fim + timedelta(minutes=self.rng.randrange(60))) if status == 'P' else None)
+            itens = list(self._itens(romaneio_id, idro, status, tentativas, criado_em))
+            logs = list(self._logs_romaneio(romaneio_id, status, tentativas, criado_em, atualizado_em, usuario))
+            yield romaneio, itens, logs
+
+    def execucoes_logs(self):
+        """Gera (execução, logs) para cada execução de bot"""
+        for execucao_id in range(1, self.execucoes + 1):
+            inicio = self._data()
+            status = self.status_execucao()
+            quantidade_logs = max(1, int(self.rng.expovariate(1 / self.logs_por_execucao)))
+            duracao = quantidade_logs * self.rng.uniform(0.2, 2.0)
+            fim = inicio + timedelta(seconds=duracao)
+            erro = 'Timeout aguardando elemento na tela' if status == 'failed' else None
+            execucao = (execucao_id, self.rng.choice(NOMES_BOTS), status, formatar_data(inicio),
+                        formatar_data(fim), round(duracao, 2), '{}',
+                        'Execucao concluida' if status == 'completed' else None, erro)
+            logs = []
+            momento = inicio
+            for numero in range(quantidade_logs):
+                momento += timedelta(seconds=duracao / quantidade_logs)
+                nivel = 'ERROR' if (erro and numero == quantidade_logs - 1) else self.nivel_log()
+                logs.append((execucao_id, formatar_data(momento), nivel,
+                             f'Passo {numero + 1} de {quantidade_logs}', self.rng.choice(MODULOS_LOG)))
+            yield execucao, logs
+
+
+# ==================== CARGA ====================
+
+SQL_INSERT = {
+    'romaneio': (
+        "INSERT INTO romaneio (id, pedido_compra, nota_fiscal, chave_acesso, idro, status, "
+        "tentativas_contagem, created_at, updated_at, created_by, observacoes, apos_recebimento, "
+        "programado, inserir_como_parcial, lease_owner, lease_expira_em, proxima_verificacao_em) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    'romaneio_item': (
+        "INSERT INTO romaneio_item (romaneio_id, idro, codigo, descricao, quantidade_nf, "
+        "quantidade_contada, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    'romaneio_log': (
+        "INSERT INTO romaneio_log (romaneio_id, timestamp, acao, status_anterior, status_novo, "
+        "tentativa, detalhes, user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    'bot_execution': (
+        "INSERT INTO bot_execution (id, bot_name, status, start_time, end_time, duration, "
+        "parameters, result, error_message) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    'bot_log': (
+        "INSERT INTO bot_log (execution_id, timestamp, level, message, module) VALUES (?, ?, ?, ?, ?)"
+    ),
+}
+
+
+class Carregador:
+    """Acumula linhas por tabela e grava com executemany a cada `lote` linhas"""
+
+    def __init__(self, conexao, lote):
+        self.conexao = conexao
+        self.lote = lote
+        self.pendentes = {tabela: [] for tabela in TABELAS}
+        self.total = {tabela: 0 for tabela in TABELAS}
+
+    def adicionar(self, tabela, linhas):
+        pendentes = self.pendentes[tabela]
+        pendentes.extend(linhas)
+        if len(pendentes) >= self.lote:
+            self.gravar(tabela)
+
+    def gravar(self, tabela):
+        pendentes = self.pendentes[tabela]
+        if pendentes:
+            self.conexao.executemany(SQL_INSERT[tabela], pendentes)
+            self.total[tabela] += len(pendentes)
+            pendentes.clear()
+
+    def finalizar(self):
+        for tabela in TABELAS:
+            self.gravar(tabela)
+        self.conexao.commit()
+
+
+def criar_schema(caminho):
+    """Cria as tabelas, configurações padrão e usuário admin com o próprio app"""
+    import config
+    config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + caminho
+
+    from app import app, db, User
+    from init_database import init_database
+
+    init_database()
+    with app.app_context():
+        usuarios = [usuario.id for usuario in User.query.all()]
+        db.session.remove()
+        db.engine.dispose()
+    return usuarios
+
+
+def _remover_indices(conexao):
+    """Remove os índices secundários das tabelas carregadas e devolve o SQL para recriá-los"""
+    marcadores = ','.join('?' * len(TABELAS))
+    indices = conexao.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({marcadores})", TABELAS
+    ).fetchall()
+    for nome, _ in indices:
+        conexao.execute(f'DROP INDEX "{nome}"')
+    return [sql for _, sql in indices]
+
+
+def _progresso(inicio, carregador, finalizado=False):
+    decorrido = time.perf_counter() - inicio
+    linhas = sum(carregador.total.values())
+    print(f"[INFO] {carregador.total['romaneio']:,} romaneios, {carregador.total['romaneio_item']:,} itens, "
+          f"{carregador.total['romaneio_log']:,} logs, {carregador.total['bot_log']:,} logs de bots "
+          f"- {linhas / max(decorrido, 1e-9):,.0f} linhas/s" + (' (concluido)' if finalizado else ''))
+
+
+def gerar_banco(caminho, romaneios=10000, itens_por_romaneio=20, execucoes=1000, logs_por_execucao=50,
+                skus=50000, zipf=1.1, dias=365, semente=42, lote=50000, substituir=False, verbose=True):
+    """
+    Gera o banco sintético em `caminho`
+
+    Returns:
+        dict: linhas inseridas por tabela e duração em segundos
+    """
+    caminho = os.path.abspath(caminho)
+    if os.path.exists(caminho):
+        if not substituir:
+            raise FileExistsError(f"Banco ja existe: {caminho} (use --substituir)")
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(caminho + sufixo):
+                os.remove(caminho + sufixo)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+
+    usuarios = criar_schema(caminho)
+    gerador = GeradorDados(romaneios, itens_por_romaneio, execucoes, logs_por_execucao,
+                           skus=skus, zipf=zipf, dias=dias, usuarios=usuarios, semente=semente)
+
+    inicio = time.perf_counter()
+    conexao = sqlite3.connect(caminho)
+    try:
+        conexao.execute('PRAGMA journal_mode=OFF')
+        conexao.execute('PRAGMA synchronous=OFF')
+        conexao.execute('PRAGMA cache_size=-200000')
+        conexao.execute('PRAGMA temp_store=MEMORY')
+        indices = _remover_indices(conexao)
+
+        carregador = Carregador(conexao, lote)
+        for numero, (romaneio, itens, logs) in enumerate(gerador.romaneios_itens_logs(), 1):
+            carregador.adicionar('romaneio', (romaneio,))
+            carregador.adicionar('romaneio_item', itens)
+            carregador.adicionar('romaneio_log', logs)
+            if verbose and numero % 100000 == 0:
+                _progresso(inicio, carregador)
+        for execucao, logs in gerador.execucoes_logs():
+            carregador.adicionar('bot_execution', (execucao,))
+            carregador.adicionar('bot_log', logs)
+        carregador.finalizar()
+
+        if verbose:
+            print(f"[INFO] Recriando {len(indices)} indice(s)...")
+        for sql in indices:
+            conexao.execute(sql)
+        conexao.execute('ANALYZE')
+        conexao.commit()
+        conexao.execute('PRAGMA journal_mode=WAL')
+    finally:
+        conexao.close()
+
+    if verbose:
+        _progresso(inicio, carregador, finalizado=True)
+    return {'linhas': dict(carregador.total), 'duracao': round(time.perf_counter() - inicio, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera um banco SQLite com dados sinteticos para testes de escala')
+    parser.add_argument('--banco', required=True, help='Arquivo SQLite a gerar (ex.: instance/sintetico.db)')
+    parser.add_argument('--perfil', choices=sorted(PERFIS), default='pequeno',
+                        help='Volumes prontos (pequeno: 10 mil romaneios, grande: 1 milhao)')
+    parser.add_argument('--romaneios', type=int, help='Quantidade de romaneios (sobrepõe o perfil)')
+    parser.add_argument('--itens-por-romaneio', type=int, help='Média de itens por romaneio (sobrepõe o perfil)')
+    parser.add_argument('--execucoes', type=int, help='Execuções de bots (sobrepõe o perfil)')
+    parser.add_argument('--logs-por-execucao', type=int, help='Média de logs por execução (sobrepõe o perfil)')
+    parser.add_argument('--skus', type=int, default=50000, help='Produtos distintos no catálogo (padrão: 50000)')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Expoente da distribuição de SKUs (padrão: 1.1)')
+    parser.add_argument('--dias', type=int, default=365, help='Período coberto pelas datas (padrão: 365)')
+    parser.add_argument('--semente', type=int, default=42, help='Semente aleatória (padrão: 42)')
+    parser.add_argument('--lote', type=int, default=50000, help='Linhas por executemany (padrão: 50000)')
+    parser.add_argument('--substituir', action='store_true', help='Apaga o banco se ele já existir')
+    args = parser.parse_args()
+
+    parametros = dict(PERFIS[args.perfil])
+    for nome in parametros:
+        if getattr(args, nome) is not None:
+            parametros[nome] = getattr(args, nome)
+
+    print("=" * 70)
+    print("GERADOR DE DADOS SINTETICOS")
+    print("=" * 70)
+    print(f"Banco: {os.path.abspath(args.banco)}")
+    for nome, valor in parametros.items():
+        print(f"  {nome}: {valor:,}")
+    print("=" * 70)
+
+    try:
+        resultado = gerar_banco(args.banco, skus=args.skus, zipf=args.zipf, dias=args.dias,
+                                semente=args.semente, lote=args.lote, substituir=args.substituir,
+                                **parametros)
+    except FileExistsError as e:
+        print(f"[ERRO] {e}")
+        return 1
+
+    print("=" * 70)
+    for tabela, total in resultado['linhas'].items():
+        print(f"  {tabela}: {total:,} linha(s)")
+    print(f"Duracao: {resultado['duracao']:.1f}s")
+    print(f"Para usar: SQLALCHEMY_DATABASE_URI=sqlite:///{os.path.abspath(args.banco)}")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
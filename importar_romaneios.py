@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Importa romaneios em massa de uma planilha xlsx/CSV
+Valida todas as linhas antes de gravar, grava as válidas de uma vez e agenda
+a inserção de cada romaneio na API (outbox). Com --despachar, entrega as
+inserções aqui mesmo (OUTBOX_CONCORRENCIA chamadas simultâneas) e inclui o
+resultado da API no relatório.
+
+Uso:
+    python importar_romaneios.py "Massa de Dados Profectum.xlsx" --simular
+    python importar_romaneios.py pedidos.csv --usuario profectum --despachar --relatorio resultado.csv
+"""
+import argparse
+import csv
+import sys
+import time
+from app import app, User
+from services.importacao_service import ImportacaoService, ImportacaoError
+from services.outbox_dispatcher import OutboxDispatcher
+import config
+
+
+def despachar(servico, romaneio_ids):
+    """Entrega as inserções agendadas até nenhuma estar pendente para agora"""
+    despachante = OutboxDispatcher()
+    inicio = time.perf_counter()
+    try:
+        resumo = despachante.despachar_pendentes()
+    finally:
+        despachante.parar()
+    print(f"[INFO] API: {resumo['enviados']} inserido(s), {resumo['reagendados']} reagendado(s), "
+          f"{resumo['falhas_definitivas']} falha(s) definitiva(s) em {time.perf_counter() - inicio:.1f}s")
+    return servico.situacao_api(romaneio_ids)
+
+
+def gravar_relatorio(caminho, linhas):
+    campos = ['linha', 'pedido_compra', 'status', 'mensagem', 'romaneio_id', 'api_estado', 'api_erro']
+    with open(caminho, 'w', encoding='utf-8-sig', newline='') as saida:
+        escritor = csv.DictWriter(saida, fieldnames=campos, delimiter=';', extrasaction='ignore')
+        escritor.writeheader()
+        escritor.writerows(linhas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Importa romaneios de uma planilha xlsx/CSV')
+    parser.add_argument('arquivo', help='Planilha .xlsx ou .csv')
+    parser.add_argument('--usuario', default='profectum', help='Usuário registrado como criador (padrão: profectum)')
+    parser.add_argument('--simular', action='store_true', help='Só valida, não grava nada')
+    parser.add_argument('--despachar', action='store_true',
+                        help='Faz as inserções na API agora, em vez de deixar para o despachante do app/verificador')
+    parser.add_argument('--relatorio', help='Grava o resultado por linha em CSV')
+    args = parser.parse_args()
+
+    with app.app_context():
+        usuario = User.query.filter_by(username=args.usuario).first()
+        if not usuario:
+            print(f"[ERRO] Usuario nao encontrado: {args.usuario}")
+            return 1
+
+        servico = ImportacaoService()
+        inicio = time.perf_counter()
+        try:
+            resultado = servico.importar(args.arquivo, usuario.id, simular=args.simular)
+        except (ImportacaoError, OSError) as e:
+            print(f"[ERRO] {e}")
+            return 1
+
+        print(f"[INFO] {resultado['total_linhas']} linha(s) lidas em {time.perf_counter() - inicio:.2f}s"
+              f"{' (simulacao, nada gravado)' if args.simular else ''}")
+        for status, total in sorted(resultado['totais'].items()):
+            print(f"  {status}: {total}")
+
+        linhas = resultado['linhas']
+        if args.despachar and resultado['romaneio_ids']:
+            if config.MODO_TESTE:
+                print("[AVISO] MODO_TESTE=True: nenhuma insercao na API foi agendada")
+            else:
+                situacao = despachar(servico, resultado['romaneio_ids'])
+                for linha in linhas:
+                    api = situacao.get(linha.get('romaneio_id'))
+                    if api:
+                        linha['api_estado'] = api['estado']
+                        linha['api_erro'] = api['ultimo_erro']
+
+        problemas = [linha for linha in linhas if linha['status'] not in ('importado', 'valido')]
+        for linha in problemas[:50]:
+            print(f"[AVISO] Linha {linha['linha']} (pedido {linha['pedido_compra'] or '-'}): "
+                  f"{linha['status']} - {linha['mensagem']}")
+        if len(problemas) > 50:
+            print(f"[AVISO] ... e mais {len(problemas) - 50} linha(s) com problema")
+
+        if args.relatorio:
+            gravar_relatorio(args.relatorio, linhas)
+            print(f"[INFO] Relatorio gravado em {args.relatorio}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
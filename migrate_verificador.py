@@ -0,0 +1,64 @@
+"""
+Script de migração incremental do banco de dados
+Cria tabelas novas e adiciona colunas novas às tabelas existentes
+(ex.: colunas de lease em `romaneio`) sem apagar dados
+"""
+import sys
+from sqlalchemy import text
+from app import app, db
+
+def migrate():
+    """Executa a migração do banco de dados"""
+    print("=" * 60)
+    print("MIGRACAO INCREMENTAL DO BANCO DE DADOS")
+    print("=" * 60)
+
+    with app.app_context():
+        inspector = db.inspect(db.engine)
+        existing_tables = inspector.get_table_names()
+
+        print("\n[1/3] Criando tabelas que ainda nao existem...")
+        novas = [t for t in db.metadata.sorted_tables if t.name not in existing_tables]
+        for table in novas:
+            table.create(db.engine, checkfirst=True)
+            print(f"   - Tabela '{table.name}' criada")
+        if not novas:
+            print("   Nenhuma tabela nova")
+
+        print("\n[2/3] Adicionando colunas novas...")
+        adicionadas = 0
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            colunas_existentes = {c['name'] for c in inspector.get_columns(table.name)}
+            for coluna in table.columns:
+                if coluna.name in colunas_existentes:
+                    continue
+
+                tipo = coluna.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {coluna.name} {tipo}'))
+                print(f"   - {table.name}.{coluna.name} ({tipo})")
+                adicionadas += 1
+        if not adicionadas:
+            print("   Nenhuma coluna nova")
+
+        print("\n[3/3] Criando indices...")
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        print("   Indices verificados")
+
+        print("\n" + "=" * 60)
+        print("MIGRACAO CONCLUIDA COM SUCESSO!")
+        print("=" * 60)
+
+if __name__ == '__main__':
+    try:
+        migrate()
+    except Exception as e:
+        print(f"\nERRO durante a migracao: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
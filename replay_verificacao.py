@@ -0,0 +1,133 @@
+"""
+Reproduz um passe do verificador gravado com `verificador_romaneios.py --gravar`
+Roda o VerificadorService contra uma cópia nova do banco gravado, com as
+respostas da API gravadas, e mede duração e escritas no banco. Como as
+entradas são sempre as mesmas, os números podem ser comparados entre branches.
+
+Uso:
+    python verificador_romaneios.py --once --gravar passe.jsonl.gz
+    python replay_verificacao.py passe.jsonl.gz                 # o mais rápido possível
+    python replay_verificacao.py passe.jsonl.gz --tempo-real    # com a latência gravada
+    python replay_verificacao.py passe.jsonl.gz --json resultado.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reproduz um passe gravado do verificador')
+    parser.add_argument('arquivo', help='Arquivo gravado (.jsonl.gz)')
+    parser.add_argument('--banco', help='Banco SQLite de partida (padrão: a cópia salva na gravação)')
+    parser.add_argument('--tempo-real', action='store_true',
+                        help='Espera a duração gravada de cada consulta (padrão: o mais rápido possível)')
+    parser.add_argument('--json', metavar='SAIDA', help='Salva o resultado em JSON')
+    args = parser.parse_args()
+
+    # Cabeçalho lido antes de importar o app: ele define o banco ao ser importado
+    import config
+    from services.gravacao import ClienteReproducao
+    cliente = ClienteReproducao(args.arquivo, tempo_real=args.tempo_real)
+
+    banco_origem = args.banco or cliente.cabecalho.get('banco')
+    if not banco_origem or not os.path.exists(banco_origem):
+        print(f"[ERRO] Banco de partida nao encontrado: {banco_origem}")
+        print("       Informe --banco com uma copia do banco de antes do passe")
+        return 1
+
+    pasta_temporaria = tempfile.mkdtemp(prefix='replay_')
+    banco = os.path.join(pasta_temporaria, 'replay.db')
+    shutil.copyfile(banco_origem, banco)
+    config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + banco
+    config.VERIFICADOR_LOG_DETALHADO = False
+
+    from sqlalchemy import event, update
+    from app import app, db, Romaneio
+    from services.verificador_service import VerificadorService
+
+    escritas = Counter()
+    linhas_escritas = Counter()
+
+    try:
+        with app.app_context():
+            # Só entram no passe os pedidos com resposta gravada, e nenhum lease
+            # herdado da gravação bloqueia romaneios
+            db.session.execute(
+                update(Romaneio)
+                .where(Romaneio.pedido_compra.not_in(cliente.pedidos))
+                .values(proxima_verificacao_em=datetime(9999, 12, 31))
+                .execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                update(Romaneio)
+                .values(lease_owner=None, lease_expira_em=None, proxima_verificacao_em=None)
+                .where(Romaneio.pedido_compra.in_(cliente.pedidos))
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+
+            @event.listens_for(db.engine, 'after_cursor_execute')
+            def contar_escritas(conn, cursor, statement, parameters, context, executemany):
+                comando = statement.lstrip().split(None, 1)[0].upper()
+                if comando in ('INSERT', 'UPDATE', 'DELETE'):
+                    tabela = statement.split()[2 if comando != 'UPDATE' else 1].strip('"')
+                    escritas[f'{comando} {tabela}'] += 1
+                    linhas_escritas[f'{comando} {tabela}'] += max(cursor.rowcount, 0)
+
+            verificador = VerificadorService()
+            verificador.api_client = cliente
+
+            inicio = time.perf_counter()
+            resultado = verificador.executar_verificacao_automatica()
+            duracao = time.perf_counter() - inicio
+    finally:
+        # Solta o arquivo do banco para a pasta poder ser apagada (no Windows)
+        with app.app_context():
+            db.engine.dispose()
+        shutil.rmtree(pasta_temporaria, ignore_errors=True)
+
+    resumo = {
+        'arquivo': args.arquivo,
+        'modo': 'tempo_real' if args.tempo_real else 'rapido',
+        'duracao': round(duracao, 4),
+        'tempo_api': round(resultado['tempo_api'], 4),
+        'tempo_db': round(resultado['tempo_db'], 4),
+        'consultas_reproduzidas': cliente.consultas,
+        'consultas_sem_gravacao': cliente.faltantes,
+        'contadores': {chave: resultado[chave] for chave in (
+            'total_verificados', 'atualizados_para_aberto', 'mantidos_pendente',
+            'max_tentativas_atingidas', 'aguardando_contagem', 'sem_alteracao', 'erros')},
+        'escritas': dict(sorted(escritas.items())),
+        'linhas_escritas': dict(sorted(linhas_escritas.items())),
+        'total_escritas': sum(escritas.values())
+    }
+
+    print("=" * 70)
+    print("REPLAY DO PASSE DO VERIFICADOR")
+    print("=" * 70)
+    print(f"Arquivo: {args.arquivo} (gravado em {cliente.cabecalho.get('gravado_em')})")
+    print(f"Modo: {resumo['modo']}")
+    print(f"Duracao: {resumo['duracao']:.3f}s (API: {resumo['tempo_api']:.3f}s, DB: {resumo['tempo_db']:.3f}s)")
+    print(f"Consultas reproduzidas: {cliente.consultas} (sem gravacao: {cliente.faltantes})")
+    for chave, valor in resumo['contadores'].items():
+        print(f"  {chave}: {valor}")
+    print(f"Escritas no banco: {resumo['total_escritas']} statement(s)")
+    for chave, valor in resumo['escritas'].items():
+        print(f"  {chave}: {valor} statement(s), {resumo['linhas_escritas'][chave]} linha(s)")
+    print("=" * 70)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as arquivo:
+            json.dump(resumo, arquivo, indent=2)
+        print(f"[INFO] Resultado salvo em {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Agendador de taxa fixa para serviços de longa duração
+Os horários de início não acumulam o atraso da duração de cada execução
+"""
+import signal
+import threading
+import time
+from datetime import datetime
+
+
+class AgendadorTaxaFixa:
+    """
+    Executa uma tarefa a cada `intervalo` segundos, medidos a partir do horário
+    previsto (e não do fim da execução anterior).
+
+    - Execuções nunca se sobrepõem: a tarefa roda na própria thread do agendador
+    - Se uma execução atrasar uma ou mais janelas, as janelas perdidas são
+      agrupadas em uma única execução (coalescência)
+    - `parar()` (ou SIGTERM/SIGINT, via `instalar_sinais`) interrompe a espera
+      imediatamente; a execução em andamento decide quando parar consultando
+      `deve_parar()`
+    """
+
+    def __init__(self, intervalo, nome='Agendador'):
+        self.intervalo = intervalo
+        self.nome = nome
+        self._parar = threading.Event()
+        self.execucoes = 0
+        self.janelas_perdidas = 0
+
+    def _log(self, mensagem):
+        """Log interno"""
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        print(f"[{timestamp}] {self.nome}: {mensagem}")
+
+    def deve_parar(self):
+        return self._parar.is_set()
+
+    def parar(self, *args):
+        if not self._parar.is_set():
+            self._log("Sinal de parada recebido, encerrando apos a execucao atual...")
+        self._parar.set()
+
+    def instalar_sinais(self):
+        """Registra SIGTERM/SIGINT (e SIGBREAK no Windows) para parada graciosa"""
+        for nome_sinal in ('SIGTERM', 'SIGINT', 'SIGBREAK'):
+            sinal = getattr(signal, nome_sinal, None)
+            if sinal is not None:
+                signal.signal(sinal, self.parar)
+
+    def executar(self, tarefa):
+        """
+        Loop principal - bloqueia até `parar()` ser chamado
+
+        Args:
+            tarefa (callable): função executada a cada janela
+        """
+        proxima = time.monotonic()
+
+        while not self._parar.is_set():
+            agora = time.monotonic()
+            if agora < proxima:
+                self._parar.wait(proxima - agora)
+                continue
+
+            perdidas = int((agora - proxima) // self.intervalo)
+            if perdidas:
+                self.janelas_perdidas += perdidas
+                self._log(f"{perdidas} janela(s) perdida(s) agrupadas em uma unica execucao")
+
+            self.execucoes += 1
+            try:
+                tarefa()
+            except Exception as e:
+                self._log(f"ERRO na execucao #{self.execucoes}: {str(e)}")
+
+            proxima += (perdidas + 1) * self.intervalo
+            if not self._parar.is_set():
+                restante = max(0, proxima - time.monotonic())
+                self._log(f"Proxima execucao em {restante:.0f} segundos")
@@ -0,0 +1,185 @@
+"""
+Feed de alterações de romaneios e itens para sistemas externos
+Cada mudança de status de um romaneio (inclusive criação e exclusão) e de
+quantidade de um item vira uma linha em `romaneio_alteracao`, na mesma
+transação da mudança, com um `seq` crescente. Consumidores leem
+`/api/changes?since=<seq>` e guardam o último seq recebido, pagando só pelas
+alterações novas.
+
+- Mudanças feitas pelo ORM são capturadas no after_flush (instalar_captura).
+- Escritas em massa (Core insert/update, que não passam pelo flush) chamam
+  registrar() com as linhas montadas por alteracao().
+
+O seq é a chave primária AUTOINCREMENT: no SQLite só há uma transação de
+escrita por vez, então um seq menor nunca aparece depois de um maior (o
+consumidor não perde alterações por avançar o cursor).
+"""
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event, insert, select, func
+from sqlalchemy.orm import attributes
+import config
+
+ROMANEIO = 'romaneio'
+ITEM = 'item'
+
+CAMPOS_ROMANEIO = ('status',)
+CAMPOS_ITEM = ('quantidade_nf', 'quantidade_contada')
+
+# Acordado a cada commit com alterações neste processo; os de outros
+# processos (verificador standalone) são vistos pela consulta periódica
+_nova_alteracao = threading.Condition()
+
+
+def _texto(valor):
+    return None if valor is None else str(valor)
+
+
+def alteracao(entidade, romaneio_id, pedido_compra, campo, anterior, novo, item_id=None, codigo=None,
+              registrado_em=None):
+    """Linha de romaneio_alteracao para registrar()"""
+    return {
+        'entidade': entidade,
+        'romaneio_id': romaneio_id,
+        'pedido_compra': pedido_compra,
+        'item_id': item_id,
+        'codigo': codigo,
+        'campo': campo,
+        'valor_anterior': _texto(anterior),
+        'valor_novo': _texto(novo),
+        'registrado_em': registrado_em or datetime.utcnow(),
+    }
+
+
+def registrar(sessao, linhas):
+    """Grava as alterações na transação corrente da sessão (executemany)"""
+    from app import RomaneioAlteracao
+
+    if not linhas:
+        return
+    sessao.connection().execute(insert(RomaneioAlteracao), linhas)
+    sessao.info['_alteracoes_gravadas'] = True
+
+
+def _anterior_e_novo(objeto, campo):
+    """(valor anterior, valor novo) se o atributo mudou neste flush, senão None"""
+    historico = attributes.get_history(objeto, campo)
+    if not historico.has_changes():
+        return None
+    anterior = historico.deleted[0] if historico.deleted else None
+    novo = historico.added[0] if historico.added else None
+    if anterior == novo:
+        return None
+    return anterior, novo
+
+
+def _capturar(sessao, contexto_flush):
+    from app import Romaneio, RomaneioItem
+
+    agora = datetime.utcnow()
+    linhas = []
+    excluidos = {objeto.id for objeto in sessao.deleted if isinstance(objeto, Romaneio)}
+
+    for objeto in sessao.new:
+        if isinstance(objeto, Romaneio):
+            linhas.append(alteracao(ROMANEIO, objeto.id, objeto.pedido_compra, 'criado', None, objeto.status,
+                                    registrado_em=agora))
+        elif isinstance(objeto, RomaneioItem):
+            for campo in CAMPOS_ITEM:
+                if getattr(objeto, campo) is not None:
+                    linhas.append(alteracao(ITEM, objeto.romaneio_id, None, campo, None, getattr(objeto, campo),
+                                            item_id=objeto.id, codigo=objeto.codigo, registrado_em=agora))
+
+    for objeto in sessao.dirty:
+        if isinstance(objeto, Romaneio):
+            campos, entidade = CAMPOS_ROMANEIO, ROMANEIO
+        elif isinstance(objeto, RomaneioItem):
+            campos, entidade = CAMPOS_ITEM, ITEM
+        else:
+            continue
+        for campo in campos:
+            mudanca = _anterior_e_novo(objeto, campo)
+            if mudanca is None:
+                continue
+            if entidade == ROMANEIO:
+                linhas.append(alteracao(ROMANEIO, objeto.id, objeto.pedido_compra, campo, *mudanca,
+                                        registrado_em=agora))
+            else:
+                linhas.append(alteracao(ITEM, objeto.romaneio_id, None, campo, *mudanca,
+                                        item_id=objeto.id, codigo=objeto.codigo, registrado_em=agora))
+
+    for objeto in sessao.deleted:
+        if isinstance(objeto, Romaneio):
+            linhas.append(alteracao(ROMANEIO, objeto.id, objeto.pedido_compra, 'excluido', objeto.status, None,
+                                    registrado_em=agora))
+        elif isinstance(objeto, RomaneioItem) and objeto.romaneio_id not in excluidos:
+            linhas.append(alteracao(ITEM, objeto.romaneio_id, None, 'excluido', objeto.quantidade_contada, None,
+                                    item_id=objeto.id, codigo=objeto.codigo, registrado_em=agora))
+
+    # Itens: pedido do romaneio em uma consulta (na conexão, sem autoflush)
+    sem_pedido = {linha['romaneio_id'] for linha in linhas if linha['pedido_compra'] is None}
+    if sem_pedido:
+        pedidos = dict(sessao.connection().execute(
+            select(Romaneio.id, Romaneio.pedido_compra).where(Romaneio.id.in_(sem_pedido))
+        ).all())
+        for linha in linhas:
+            if linha['pedido_compra'] is None:
+                linha['pedido_compra'] = pedidos.get(linha['romaneio_id'])
+
+    registrar(sessao, linhas)
+
+
+def _avisar_consumidores(sessao):
+    if sessao.info.pop('_alteracoes_gravadas', False):
+        with _nova_alteracao:
+            _nova_alteracao.notify_all()
+
+
+def _descartar_aviso(sessao):
+    sessao.info.pop('_alteracoes_gravadas', None)
+
+
+def instalar_captura(sessao):
+    """Registra a captura das mudanças feitas pelo ORM (uma vez, no app)"""
+    event.listen(sessao, 'after_flush', _capturar)
+    event.listen(sessao, 'after_commit', _avisar_consumidores)
+    event.listen(sessao, 'after_rollback', _descartar_aviso)
+
+
+def ultimo_seq():
+    from app import db, RomaneioAlteracao
+    return db.session.execute(select(func.max(RomaneioAlteracao.seq))).scalar() or 0
+
+
+def listar(desde, limite):
+    """Alterações com seq > desde, em ordem, até `limite` (mais uma, para saber se há mais)"""
+    from app import db, RomaneioAlteracao
+
+    return db.session.execute(
+        select(RomaneioAlteracao)
+        .where(RomaneioAlteracao.seq > desde)
+        .order_by(RomaneioAlteracao.seq)
+        .limit(limite + 1)
+    ).scalars().all()
+
+
+def aguardar(desde, limite, espera):
+    """
+    Long-poll: devolve as alterações após `desde` assim que existir alguma,
+    ou uma lista vazia depois de `espera` segundos
+
+    Entre as consultas a transação de leitura é encerrada (para enxergar o que
+    outros processos gravaram) e a conexão volta ao pool.
+    """
+    from app import db
+
+    limite_espera = time.monotonic() + espera
+    while True:
+        linhas = listar(desde, limite)
+        restante = limite_espera - time.monotonic()
+        if linhas or restante <= 0:
+            return linhas
+        db.session.rollback()
+        with _nova_alteracao:
+            _nova_alteracao.wait(min(restante, config.ALTERACOES_INTERVALO_CONSULTA_SEGUNDOS))
@@ -1,10 +1,115 @@
 """
 Cliente para comunicação com a API externa de Romaneios
 """
+import hashlib
+import io
+import json
+import threading
+import time
 import requests
-from datetime import datetime
+from services.resiliencia import APIError, APIIndisponivelError, PoliticaRetry, obter_circuito
+from services.limitador import obter_limitador
+from services.chamada_unica import ChamadaUnica
+from services.cache import CacheTTL
+from services.leitor_json import LeitorRomaneio
+from services import logs, metricas, tracing
 import config
 
+logger = logs.obter_logger('api')
+
+# Consultas GET (get_romaneio) em andamento, compartilhadas por todos os
+# clientes do processo; a verificação usa abrir_romaneio, que não passa por aqui
+_consultas_romaneio = ChamadaUnica()
+
+_cache_romaneios = None
+_cache_lock = threading.Lock()
+
+def obter_cache_romaneios():
+    """Cache de respostas do GET do processo (None se desativado)"""
+    global _cache_romaneios
+    if not config.API_CACHE_ATIVO:
+        return None
+    with _cache_lock:
+        if _cache_romaneios is None:
+            _cache_romaneios = CacheTTL(config.API_CACHE_MAX_ITENS, config.API_CACHE_TTL_SEGUNDOS,
+                                        arquivo=config.API_CACHE_ARQUIVO or None)
+        return _cache_romaneios
+
+
+class _NaoModificado:
+    """Sentinela: o romaneio não mudou desde a última consulta condicional"""
+    
+    def __copy__(self):
+        return self
+    
+    def __deepcopy__(self, memo):
+        return self
+    
+    def __repr__(self):
+        return 'NAO_MODIFICADO'
+
+NAO_MODIFICADO = _NaoModificado()
+
+# Validadores (ETag, Last-Modified, hash do corpo) da última resposta processada
+# de cada pedido nas consultas condicionais; com API_VALIDADORES_ARQUIVO também
+# em disco, para o próximo processo (verificador --once)
+_validadores = None
+_validadores_lock = threading.Lock()
+_estatisticas_get = {'completas': 0, 'nao_modificadas_304': 0, 'nao_modificadas_hash': 0}
+
+
+def _obter_validadores():
+    global _validadores
+    with _validadores_lock:
+        if _validadores is None:
+            _validadores = CacheTTL(config.API_VALIDADORES_MAX_ITENS, config.API_VALIDADORES_TTL_SEGUNDOS,
+                                    arquivo=config.API_VALIDADORES_ARQUIVO or None)
+        return _validadores
+
+
+class _LeituraComHash:
+    """Repassa as leituras de um stream calculando o SHA-256 do que passou"""
+    
+    def __init__(self, fonte):
+        self.fonte = fonte
+        self._hash = hashlib.sha256()
+    
+    def read(self, tamanho=-1):
+        dados = self.fonte.read() if tamanho is None or tamanho < 0 else self.fonte.read(tamanho)
+        self._hash.update(dados)
+        return dados
+    
+    def assinatura(self):
+        """Hash do corpo inteiro (lê o que o parser deixou no stream)"""
+        while self.read(64 * 1024):
+            pass
+        return self._hash.hexdigest()
+
+
+class _LeitorComAssinatura(LeitorRomaneio):
+    """
+    Leitor de uma resposta sem ETag/Last-Modified: o hash do corpo é calculado
+    enquanto os itens são lidos e comparado com o da última consulta no fim,
+    sem guardar o corpo em memória. `inalterado` (depois dos lotes) só entra
+    nas estatísticas: os itens lidos são aplicados normalmente.
+    """
+    
+    def __init__(self, response, chave, hash_anterior):
+        response.raw.decode_content = True
+        self._leitura = _LeituraComHash(response.raw)
+        super().__init__(self._leitura, ao_fechar=response.close)
+        self._chave = chave
+        self._hash_anterior = hash_anterior
+    
+    def lotes_itens(self, tamanho):
+        yield from super().lotes_itens(tamanho)
+        assinatura = self._leitura.assinatura()
+        self.inalterado = assinatura == self._hash_anterior
+        _obter_validadores().definir(self._chave, {'etag': None, 'last_modified': None, 'hash': assinatura})
+        with _validadores_lock:
+            _estatisticas_get['nao_modificadas_hash' if self.inalterado else 'completas'] += 1
+
+
 class RomaneioAPIClient:
     """
     Cliente para fazer requisições à API externa de romaneios
@@ -18,19 +123,178 @@ class RomaneioAPIClient:
             'Content-Type': 'application/json',
             'x-system-id-romaneios': self.system_id
         }
+        # Sessão reaproveita conexões HTTP (keep-alive) entre chamadas
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.timeout = (config.API_TIMEOUT_CONEXAO_SEGUNDOS, config.API_TIMEOUT_SEGUNDOS)
+        # Um circuito por API, compartilhado por todos os clientes do processo
+        self.circuito = obter_circuito(self.base_url)
+        # POST /inserir não é idempotente: só repete se a conexão nem abriu
+        self.politicas = {
+            'get_romaneio': PoliticaRetry(config.API_RETRY_GET_TENTATIVAS),
+            'inserir_romaneio': PoliticaRetry(config.API_RETRY_POST_TENTATIVAS, idempotente=False),
+            'atualizar_status': PoliticaRetry(config.API_RETRY_PUT_TENTATIVAS)
+        }
+        self.cache = obter_cache_romaneios()
+        # Orçamento de requisições por endpoint, também compartilhado no processo
+        self.limitadores = {}
+        if config.API_LIMITE_ATIVO:
+            for endpoint, taxa_max in (('get_romaneio', config.API_LIMITE_GET_POR_SEGUNDO),
+                                       ('inserir_romaneio', config.API_LIMITE_POST_POR_SEGUNDO),
+                                       ('atualizar_status', config.API_LIMITE_PUT_POR_SEGUNDO)):
+                self.limitadores[endpoint] = obter_limitador(f"{self.base_url}#{endpoint}", taxa_max)
     
-    def _log(self, mensagem):
-        """Log interno para debug"""
-        if config.VERIFICADOR_LOG_DETALHADO:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            print(f"[{timestamp}] API Client: {mensagem}")
+    def estado_circuito(self):
+        """Estado do circuit breaker da API (para resumos e monitoramento)"""
+        return self.circuito.estado()
+    
+    def estado_cache(self):
+        """Contadores do cache de respostas (None se desativado)"""
+        return self.cache.estado() if self.cache else None
+    
+    def _chave_cache(self, pedido_compra):
+        return f"{self.base_url}|{pedido_compra}"
+    
+    def invalidar_cache(self, pedido_compra=None, idro=None):
+        """Descarta a resposta guardada de um pedido (ou do pedido de um IDRO)"""
+        if not self.cache:
+            return
+        if pedido_compra is not None:
+            self.cache.invalidar(self._chave_cache(pedido_compra))
+        if idro is not None:
+            self.cache.invalidar_alias(str(idro))
+    
+    def esquecer_validadores(self, pedido_compra):
+        """
+        Descarta os validadores do pedido: a próxima consulta condicional traz o
+        corpo completo (usar quando a resposta anterior não chegou a ser aplicada)
+        """
+        _obter_validadores().invalidar(self._chave_cache(pedido_compra))
+    
+    def registrar_resultado(self, pedido_compra, resultado):
+        """
+        Guarda, junto dos validadores, o resultado da verificação que aplicou a
+        última resposta do pedido (consultado quando a próxima vier sem mudança)
+        """
+        validadores = _obter_validadores()
+        chave = self._chave_cache(pedido_compra)
+        encontrado, valor = validadores.obter(chave)
+        if encontrado:
+            validadores.definir(chave, dict(valor, resultado=resultado))
+    
+    def resultado_anterior(self, pedido_compra):
+        """Resultado guardado com `registrar_resultado` (None se não houver)"""
+        encontrado, valor = _obter_validadores().obter(self._chave_cache(pedido_compra))
+        return valor.get('resultado') if encontrado else None
+    
+    def estado_consultas(self):
+        """Consultas GET completas x não modificadas (304 ou mesmo hash)"""
+        with _validadores_lock:
+            return dict(_estatisticas_get)
+    
+    def estado_limitadores(self):
+        """Taxa atual de cada endpoint (para resumos e monitoramento)"""
+        return {endpoint: limitador.estado() for endpoint, limitador in self.limitadores.items()}
+    
+    def _medir(self, endpoint, inicio, resultado):
+        """Registra latência e resultado da chamada nas métricas do processo"""
+        metricas.api_requisicao_segundos.observar(time.perf_counter() - inicio, endpoint=endpoint)
+        metricas.api_requisicoes_total.inc(endpoint=endpoint, resultado=resultado)
+    
+    def _requisitar(self, endpoint, metodo, url, **kwargs):
+        """
+        Executa a requisição aplicando a política de retry do endpoint e o circuit breaker
+        
+        Raises:
+            APIIndisponivelError: circuito aberto, a requisição não foi feita
+            APIError: falha definitiva (após as retentativas permitidas)
+        """
+        politica = self.politicas[endpoint]
+        limitador = self.limitadores.get(endpoint)
+        tentativa = 0
+        
+        while True:
+            tentativa += 1
+            try:
+                teste = self.circuito.permitir()
+            except APIIndisponivelError:
+                metricas.api_requisicoes_total.inc(endpoint=endpoint, resultado='circuito_aberto')
+                raise
+            
+            try:
+                if limitador:
+                    limitador.aguardar()
+                
+                inicio = time.perf_counter()
+                with tracing.span(f"API {endpoint}", kind=tracing.KIND_CLIENTE, tentativa=tentativa,
+                                  **{'http.method': metodo, 'http.url': url}) as span:
+                    try:
+                        response = self.session.request(metodo, url, timeout=self.timeout, **kwargs)
+                    except requests.exceptions.RequestException as e:
+                        resultado = ('timeout' if isinstance(e, requests.exceptions.Timeout)
+                                     else 'conexao' if isinstance(e, requests.exceptions.ConnectionError) else 'erro')
+                        self._medir(endpoint, inicio, resultado)
+                        raise
+                    span.definir('http.status_code', response.status_code)
+                    if response.status_code >= 500:
+                        span.erro(f"HTTP {response.status_code}")
+                self._medir(endpoint, inicio, response.status_code)
+                if response.status_code >= 500 or response.status_code == 429:
+                    if response.status_code == 429 and limitador:
+                        retry_after = response.headers.get('Retry-After', '')
+                        if retry_after.isdigit():
+                            limitador.pausar(int(retry_after))
+                    raise APIError(
+                        f"{response.status_code} {response.reason} para {url}",
+                        status_code=response.status_code,
+                        transiente=True
+                    )
+                response.raise_for_status()
+                self.circuito.registrar_sucesso()
+                if limitador:
+                    limitador.registrar(time.perf_counter() - inicio)
+                return response
+                
+            except requests.exceptions.HTTPError as e:
+                # 4xx: a API respondeu, não conta como falha de disponibilidade
+                self.circuito.registrar_sucesso()
+                if limitador:
+                    limitador.registrar(time.perf_counter() - inicio)
+                raise APIError(str(e), status_code=e.response.status_code)
+                
+            except (APIError, requests.exceptions.RequestException) as e:
+                # 429 é limite de taxa, não indisponibilidade: quem reage é o limitador
+                if not (isinstance(e, APIError) and e.status_code == 429):
+                    self.circuito.registrar_falha()
+                if limitador:
+                    limitador.registrar(time.perf_counter() - inicio, sobrecarga=True)
+                if not politica.pode_repetir(e, tentativa):
+                    if isinstance(e, APIError):
+                        raise
+                    raise APIError(str(e), transiente=isinstance(
+                        e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)))
+                
+                espera = politica.espera(tentativa)
+                logger.warning("%s %s falhou (%s), tentativa %d/%d, repetindo em %.1fs",
+                               metodo, url, e, tentativa, politica.tentativas, espera)
+                if teste:
+                    # Não segura a chamada de teste durante a espera
+                    self.circuito.liberar_teste()
+                    teste = False
+                time.sleep(espera)
+            
+            finally:
+                # Chamada de teste sem sucesso nem falha registrados (429, erro
+                # inesperado): devolvida para o circuito não ficar preso em meio_aberto
+                if teste:
+                    self.circuito.liberar_teste()
     
     def _mock_get_romaneio(self, pedido_compra):
         """
         Retorna dados mockados para teste (quando MODO_TESTE=True)
         Simula resposta da API GET /api/romaneio/{pedido}
         """
-        self._log(f"MODO TESTE: Simulando GET para pedido {pedido_compra}")
+        logger.debug("MODO TESTE: Simulando GET para pedido %s", pedido_compra)
         
         # Simular dados de romaneio
         return [{
@@ -60,7 +324,7 @@ class RomaneioAPIClient:
         Simula inserção de romaneio (quando MODO_TESTE=True)
         """
         romaneio = dados.get('romaneio', {})
-        self._log(f"MODO TESTE: Simulando POST para pedido {romaneio.get('pedidoCompra')}")
+        logger.info("MODO TESTE: Simulando POST para pedido %s", romaneio.get('pedidoCompra'))
         
         return {
             "success": True,
@@ -73,7 +337,7 @@ class RomaneioAPIClient:
         """
         Simula atualização de status (quando MODO_TESTE=True)
         """
-        self._log(f"MODO TESTE: Simulando PUT para IDRO {idro} -> Status {status}")
+        logger.info("MODO TESTE: Simulando PUT para IDRO %s -> Status %s", idro, status)
         
         return {
             "success": True,
@@ -82,12 +346,14 @@ class RomaneioAPIClient:
             "status": status
         }
     
-    def get_romaneio(self, pedido_compra):
+    def get_romaneio(self, pedido_compra, usar_cache=True):
         """
         Busca dados do romaneio na API externa
         
         Args:
             pedido_compra (str): Número do pedido de compra
+            usar_cache (bool): se False, ignora uma resposta em cache (ela é
+                substituída pela nova)
             
         Returns:
             list: Lista com dados do romaneio e itens
@@ -113,21 +379,100 @@ class RomaneioAPIClient:
         if self.modo_teste:
             return self._mock_get_romaneio(pedido_compra)
         
+        chave = self._chave_cache(pedido_compra)
+        if self.cache and usar_cache:
+            encontrado, dados = self.cache.obter(chave)
+            if encontrado:
+                logger.debug("Cache: resposta de %s reaproveitada", pedido_compra)
+                return dados
+        
+        # Chamadas simultâneas para o mesmo pedido compartilham uma única requisição
+        dados = _consultas_romaneio.executar((self.base_url, pedido_compra),
+                                             self._buscar_romaneio, pedido_compra)
+        if self.cache:
+            idro = dados[0].get('IDRO') if dados else None
+            self.cache.definir(chave, dados, alias=str(idro) if idro is not None else None)
+        return dados
+    
+    def abrir_romaneio(self, pedido_compra, condicional=False):
+        """
+        Versão incremental de `get_romaneio` para pedidos com muitos itens:
+        os itens são lidos do stream HTTP em lotes, sem montar a lista inteira
+        
+        Não passa pelo cache nem pela deduplicação de chamadas (o stream não
+        pode ser compartilhado); o verificador já evita consultas simultâneas
+        ao mesmo pedido com o lease do romaneio.
+        
+        Returns:
+            LeitorRomaneio (usar com `with`), ou NAO_MODIFICADO
+        """
+        if self.modo_teste:
+            conteudo = json.dumps(self._mock_get_romaneio(pedido_compra)).encode()
+            return LeitorRomaneio(io.BytesIO(conteudo))
+        
+        chave = self._chave_cache(pedido_compra)
+        try:
+            url = f"{self.base_url}/api/romaneio/{pedido_compra}"
+            logger.debug("GET %s (stream)", url)
+            
+            validadores = None
+            headers = {}
+            if condicional:
+                _, validadores = _obter_validadores().obter(chave)
+                if validadores and validadores['etag']:
+                    headers['If-None-Match'] = validadores['etag']
+                if validadores and validadores['last_modified']:
+                    headers['If-Modified-Since'] = validadores['last_modified']
+            
+            response = self._requisitar('get_romaneio', 'GET', url, headers=headers or None, stream=True)
+        except APIIndisponivelError:
+            raise
+        except APIError as e:
+            logger.error("ERRO na requisicao GET do pedido %s: %s", pedido_compra, e)
+            raise APIError(f"Erro ao buscar romaneio: {str(e)}", e.status_code, e.transiente)
+        
+        if response.status_code == 304:
+            response.close()
+            logger.debug("Romaneio %s nao modificado (304)", pedido_compra)
+            with _validadores_lock:
+                _estatisticas_get['nao_modificadas_304'] += 1
+            return NAO_MODIFICADO
+        
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        
+        if condicional and not (etag or last_modified):
+            # Sem validadores da API: o hash é calculado durante a leitura em
+            # lotes e o leitor indica `inalterado` ao final
+            return _LeitorComAssinatura(response, chave, validadores['hash'] if validadores else None)
+        
+        if condicional:
+            _obter_validadores().definir(chave, {'etag': etag, 'last_modified': last_modified, 'hash': None})
+        with _validadores_lock:
+            _estatisticas_get['completas'] += 1
+        response.raw.decode_content = True
+        return LeitorRomaneio(response.raw, ao_fechar=response.close)
+    
+    def _buscar_romaneio(self, pedido_compra):
+        """Executa o GET /api/romaneio/{pedido}"""
         try:
             url = f"{self.base_url}/api/romaneio/{pedido_compra}"
-            self._log(f"GET {url}")
+            logger.debug("GET %s", url)
             
-            response = requests.get(url, headers=self.headers, timeout=30)
-            response.raise_for_status()
+            response = self._requisitar('get_romaneio', 'GET', url)
             
+            with _validadores_lock:
+                _estatisticas_get['completas'] += 1
             data = response.json()
-            self._log(f"Resposta recebida: {len(data)} romaneio(s)")
+            logger.debug("Resposta recebida: %d romaneio(s)", len(data))
             
             return data
             
-        except requests.exceptions.RequestException as e:
-            self._log(f"ERRO na requisicao GET: {str(e)}")
-            raise Exception(f"Erro ao buscar romaneio: {str(e)}")
+        except APIIndisponivelError:
+            raise
+        except APIError as e:
+            logger.error("ERRO na requisicao GET do pedido %s: %s", pedido_compra, e)
+            raise APIError(f"Erro ao buscar romaneio: {str(e)}", e.status_code, e.transiente)
     
     def inserir_romaneio(self, pedido_compra, nota_fiscal, chave_acesso, 
                          apos_recebimento=None, programado=None, 
@@ -170,29 +515,23 @@ class RomaneioAPIClient:
         
         try:
             url = f"{self.base_url}/api/romaneio/inserir"
-            self._log(f"POST {url}")
-            self._log(f"Dados: {dados}")
-            
-            response = requests.post(url, json=dados, headers=self.headers, timeout=30)
+            logger.debug("POST %s", url, extra={'dados': dados})
             
-            # Log detalhado do status HTTP e response
-            print(f"\n📡 HTTP Status Code: {response.status_code}")
-            print(f"📝 Response Headers: {dict(response.headers)}")
-            print(f"📄 Response Text: {response.text[:500] if response.text else '(vazio)'}")
-            
-            response.raise_for_status()
+            response = self._requisitar('inserir_romaneio', 'POST', url, json=dados)
             
             result = response.json() if response.text else {"success": True}
-            self._log(f"Romaneio inserido com sucesso")
+            logger.info("Romaneio %s inserido (HTTP %d)", pedido_compra, response.status_code,
+                        extra={'pedido': pedido_compra})
+            self.invalidar_cache(pedido_compra=pedido_compra)
             
             return result
             
-        except requests.exceptions.RequestException as e:
-            self._log(f"ERRO na requisicao POST: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"\n🚨 HTTP Error Status: {e.response.status_code}")
-                print(f"📄 Error Response: {e.response.text}")
-            raise Exception(f"Erro ao inserir romaneio: {str(e)}")
+        except APIIndisponivelError:
+            raise
+        except APIError as e:
+            logger.error("ERRO na requisicao POST do pedido %s (HTTP %s): %s", pedido_compra, e.status_code, e,
+                         extra={'pedido': pedido_compra})
+            raise APIError(f"Erro ao inserir romaneio: {str(e)}", e.status_code, e.transiente)
     
     def atualizar_status_romaneio(self, idro, status):
         """
@@ -210,20 +549,20 @@ class RomaneioAPIClient:
         
         try:
             url = f"{self.base_url}/api/romaneio/atualizar/{idro}"
-            self._log(f"PUT {url}")
-            
             dados = {"status": status}
-            self._log(f"Dados: {dados}")
+            logger.debug("PUT %s", url, extra={'dados': dados})
             
-            response = requests.put(url, json=dados, headers=self.headers, timeout=30)
-            response.raise_for_status()
+            response = self._requisitar('atualizar_status', 'PUT', url, json=dados)
             
             result = response.json() if response.text else {"success": True}
-            self._log(f"Status atualizado com sucesso para {status}")
+            logger.debug("Status do IDRO %s atualizado para %s", idro, status)
+            self.invalidar_cache(idro=idro)
             
             return result
             
-        except requests.exceptions.RequestException as e:
-            self._log(f"ERRO na requisicao PUT: {str(e)}")
-            raise Exception(f"Erro ao atualizar status: {str(e)}")
+        except APIIndisponivelError:
+            raise
+        except APIError as e:
+            logger.error("ERRO na requisicao PUT do IDRO %s: %s", idro, e)
+            raise APIError(f"Erro ao atualizar status: {str(e)}", e.status_code, e.transiente)
 
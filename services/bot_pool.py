@@ -0,0 +1,438 @@
+"""
+Pool de workers pré-aquecidos para execução dos bots
+Mantém processos Python com a stack de automação já importada e executa
+os scripts dos bots dentro deles, evitando o custo de um interpretador frio
+"""
+import io
+import os
+import sys
+import queue
+import runpy
+import threading
+import time
+import traceback
+import importlib
+import subprocess
+import multiprocessing
+from collections import deque
+from contextlib import redirect_stdout, redirect_stderr
+from services import logs
+import config
+
+logger = logs.obter_logger('bot_pool')
+
+try:
+    import psutil
+except ImportError:  # psutil é opcional
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # indisponível no Windows
+    resource = None
+
+
+def _memoria_mb():
+    """Memória residente do processo atual em MB (None se não for possível medir)"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    if resource is not None:
+        # ru_maxrss é o pico de memória (KB no Linux, bytes no macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        return maxrss / divisor
+    return None
+
+
+def _executar_script(tarefa):
+    """
+    Executa um script de bot dentro do processo worker, simulando `python script.py`
+
+    Returns:
+        dict: returncode, stdout, stderr, tempo de início e duração
+    """
+    recebido_em = time.perf_counter()
+    script = os.path.abspath(tarefa['script'])
+    stdout, stderr = io.StringIO(), io.StringIO()
+
+    env_original = os.environ.copy()
+    cwd_original = os.getcwd()
+    argv_original = sys.argv[:]
+    path_original = sys.path[:]
+
+    returncode = 0
+    try:
+        os.environ.update(tarefa.get('env') or {})
+        if tarefa.get('cwd'):
+            os.chdir(tarefa['cwd'])
+        sys.argv = [script]
+        sys.path.insert(0, os.path.dirname(script))
+
+        inicio_script = time.perf_counter()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                runpy.run_path(script, run_name='__main__')
+            except SystemExit as e:
+                if e.code is None:
+                    returncode = 0
+                elif isinstance(e.code, int):
+                    returncode = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    returncode = 1
+            except BaseException:
+                traceback.print_exc()
+                returncode = 1
+    finally:
+        os.environ.clear()
+        os.environ.update(env_original)
+        os.chdir(cwd_original)
+        sys.argv = argv_original
+        sys.path[:] = path_original
+
+    return {
+        'returncode': returncode,
+        'stdout': stdout.getvalue(),
+        'stderr': stderr.getvalue(),
+        'inicio': inicio_script - recebido_em,
+        'duracao': time.perf_counter() - recebido_em,
+        'memoria_mb': _memoria_mb()
+    }
+
+
+def _worker_main(conn, pre_imports):
+    """Loop principal do processo worker"""
+    for modulo in pre_imports:
+        try:
+            importlib.import_module(modulo)
+        except Exception as e:
+            print(f"[bot_pool] Falha ao pré-importar {modulo}: {e}", file=sys.stderr)
+
+    conn.send({'pronto': True, 'memoria_mb': _memoria_mb()})
+
+    while True:
+        try:
+            tarefa = conn.recv()
+        except EOFError:
+            break
+        if tarefa is None:
+            break
+        conn.send(_executar_script(tarefa))
+
+
+class _Worker:
+    """Processo worker e seus contadores"""
+
+    def __init__(self, contexto, pre_imports):
+        self.conn, conn_filho = contexto.Pipe()
+        self.processo = contexto.Process(
+            target=_worker_main,
+            args=(conn_filho, pre_imports),
+            daemon=True
+        )
+        self.processo.start()
+        conn_filho.close()
+        self.execucoes = 0
+        self.memoria_inicial_mb = None
+
+    def aguardar_pronto(self, timeout):
+        try:
+            if not self.conn.poll(timeout):
+                return False
+            mensagem = self.conn.recv()
+        except (EOFError, OSError):
+            # Processo morreu antes de avisar que estava pronto
+            return False
+        self.memoria_inicial_mb = mensagem.get('memoria_mb')
+        return True
+
+    def encerrar(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.processo.join(timeout=5)
+        if self.processo.is_alive():
+            self.processo.terminate()
+        self.conn.close()
+
+    def matar(self):
+        """Mata o processo na hora (bot travado ou pool encerrando); a conexão fica com quem a usa"""
+        self.processo.kill()
+        self.processo.join(timeout=5)
+
+
+class EstatisticasLatencia:
+    """
+    Guarda as latências recentes de cada bot por modo de execução
+    ('frio' = subprocess novo, 'quente' = worker pré-aquecido)
+    """
+
+    def __init__(self, max_amostras=200):
+        self._amostras = {}
+        self._max_amostras = max_amostras
+        self._lock = threading.Lock()
+
+    def registrar(self, bot_id, modo, duracao, inicio=None):
+        with self._lock:
+            chave = (bot_id, modo)
+            if chave not in self._amostras:
+                self._amostras[chave] = deque(maxlen=self._max_amostras)
+            self._amostras[chave].append((duracao, inicio))
+
+    def resumo(self):
+        """
+        Returns:
+            dict: {bot_id: {modo: {execucoes, media, p50, p95, min, max, inicio_medio}}}
+        """
+        resumo = {}
+        with self._lock:
+            itens = [(chave, list(amostras)) for chave, amostras in self._amostras.items()]
+
+        for (bot_id, modo), amostras in itens:
+            duracoes = sorted(d for d, _ in amostras)
+            inicios = [i for _, i in amostras if i is not None]
+            total = len(duracoes)
+            resumo.setdefault(bot_id, {})[modo] = {
+                'execucoes': total,
+                'media': sum(duracoes) / total,
+                'p50': duracoes[int(0.50 * (total - 1))],
+                'p95': duracoes[int(0.95 * (total - 1))],
+                'min': duracoes[0],
+                'max': duracoes[-1],
+                'inicio_medio': (sum(inicios) / len(inicios)) if inicios else None
+            }
+        return resumo
+
+
+class SemWorkerOciosoError(Exception):
+    """Nenhum worker ficou ocioso dentro de BOT_POOL_ESPERA_SEGUNDOS"""
+
+
+class BotWorkerPool:
+    """
+    Pool de processos pré-importados que executam os scripts dos bots in-process.
+
+    Os workers são reciclados após `max_execucoes` execuções ou quando a memória
+    cresce mais que `max_memoria_mb` em relação ao início.
+    """
+
+    def __init__(self, num_workers=None, max_execucoes=None, max_memoria_mb=None,
+                 pre_imports=None, espera_segundos=None, timeout_segundos=None):
+        self.num_workers = num_workers if num_workers is not None else config.BOT_POOL_WORKERS
+        self.max_execucoes = max_execucoes if max_execucoes is not None else config.BOT_POOL_MAX_EXECUCOES
+        self.max_memoria_mb = max_memoria_mb if max_memoria_mb is not None else config.BOT_POOL_MAX_MEMORIA_MB
+        self.pre_imports = pre_imports if pre_imports is not None else config.BOT_POOL_PRE_IMPORTS
+        self.espera_segundos = espera_segundos if espera_segundos is not None else config.BOT_POOL_ESPERA_SEGUNDOS
+        self.timeout_segundos = timeout_segundos if timeout_segundos is not None else config.BOT_POOL_TIMEOUT_SEGUNDOS
+
+        # No Linux o forkserver já nasce com os módulos pré-carregados e cada
+        # worker é um fork dele; no Windows só existe spawn
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._contexto = multiprocessing.get_context('forkserver')
+            self._contexto.set_forkserver_preload(list(self.pre_imports))
+        else:
+            self._contexto = multiprocessing.get_context('spawn')
+
+        self._ociosos = queue.Queue()
+        self._ocupados = set()
+        self._lock = threading.Lock()
+        self._aguardando = 0
+        self._reciclados = 0
+        self._falhas_inicio = 0
+        self._sem_worker = 0
+        self._tempo_esgotado = 0
+        self._ativo = False
+        self._encerrando = threading.Event()
+
+    def _iniciar_worker(self):
+        """
+        Cria um worker e o coloca na fila de ociosos quando estiver pronto
+
+        Um worker que não fica pronto é descartado e recriado com backoff
+        exponencial até o pool ser encerrado, para o pool não encolher.
+        """
+        tentativa = 0
+        while self._ativo:
+            try:
+                worker = _Worker(self._contexto, self.pre_imports)
+            except Exception as e:
+                worker = None
+                logger.error("Falha ao criar worker: %s", e)
+            if worker is not None and worker.aguardar_pronto(timeout=120):
+                # Sob o lock: encerrar() não deixa passar um worker novo na fila
+                with self._lock:
+                    if self._ativo:
+                        self._ociosos.put(worker)
+                        return
+                worker.encerrar()
+                return
+            if worker is not None:
+                worker.encerrar()
+
+            tentativa += 1
+            with self._lock:
+                self._falhas_inicio += 1
+            espera = min(config.BOT_POOL_BACKOFF_SEGUNDOS * 2 ** (tentativa - 1), config.BOT_POOL_BACKOFF_MAX_SEGUNDOS)
+            logger.warning("Worker não ficou pronto (tentativa %d), nova tentativa em %.0fs", tentativa, espera)
+            if self._encerrando.wait(espera):
+                return
+
+    def _iniciar_worker_async(self):
+        threading.Thread(target=self._iniciar_worker, daemon=True).start()
+
+    def iniciar(self):
+        """Dispara a criação dos workers (não bloqueia)"""
+        with self._lock:
+            if self._ativo:
+                return
+            self._ativo = True
+            self._ociosos = queue.Queue()
+        self._encerrando.clear()
+        logger.info("Iniciando %d worker(s) pré-aquecidos", self.num_workers)
+        for _ in range(self.num_workers):
+            self._iniciar_worker_async()
+
+    def _deve_reciclar(self, worker, memoria_mb):
+        if worker.execucoes >= self.max_execucoes:
+            return True
+        if self.max_memoria_mb and memoria_mb is not None and worker.memoria_inicial_mb is not None:
+            return memoria_mb - worker.memoria_inicial_mb > self.max_memoria_mb
+        return False
+
+    def executar(self, script, env=None, cwd=None):
+        """
+        Executa um script em um worker ocioso
+
+        Um bot que passa de `timeout_segundos` tem o worker morto e
+        substituído, e a execução volta como falha (returncode 1).
+
+        Returns:
+            tuple: (subprocess.CompletedProcess, dict com tempos da execução)
+
+        Raises:
+            SemWorkerOciosoError: nenhum worker livre em `espera_segundos` ou
+                pool encerrado (quem chama executa o bot em subprocess)
+        """
+        with self._lock:
+            if not self._ativo:
+                raise SemWorkerOciosoError("Pool de workers encerrado")
+            self._aguardando += 1
+        try:
+            worker = self._ociosos.get(timeout=self.espera_segundos)
+        except queue.Empty:
+            with self._lock:
+                self._sem_worker += 1
+            raise SemWorkerOciosoError(f"Nenhum worker ocioso em {self.espera_segundos:.0f}s")
+        finally:
+            with self._lock:
+                self._aguardando -= 1
+
+        if worker is None:
+            # Aviso de encerrar() para quem estava esperando
+            raise SemWorkerOciosoError("Pool de workers encerrado")
+        with self._lock:
+            ativo = self._ativo
+            if ativo:
+                self._ocupados.add(worker)
+        if not ativo:
+            worker.encerrar()
+            raise SemWorkerOciosoError("Pool de workers encerrado")
+
+        try:
+            worker.conn.send({'script': str(script), 'env': env or {}, 'cwd': str(cwd) if cwd else None})
+            if not worker.conn.poll(self.timeout_segundos or None):
+                with self._lock:
+                    self._tempo_esgotado += 1
+                logger.warning("Bot %s passou de %.0fs no worker; worker reiniciado", script, self.timeout_segundos)
+                return self._descartar(worker, script,
+                                       f'Tempo limite de {self.timeout_segundos:.0f}s excedido (worker reiniciado)')
+            resposta = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            if not self._ativo:
+                return self._descartar(worker, script, 'Pool de workers encerrado durante a execução')
+            # Worker morreu durante a execução (ex.: bot chamou os._exit)
+            return self._descartar(worker, script, f'Worker encerrado inesperadamente: {e}')
+
+        worker.execucoes += 1
+        reciclar = self._deve_reciclar(worker, resposta['memoria_mb'])
+        with self._lock:
+            self._ocupados.discard(worker)
+            devolvido = self._ativo and not reciclar
+            if devolvido:
+                self._ociosos.put(worker)
+            elif reciclar:
+                self._reciclados += 1
+        if not devolvido:
+            worker.encerrar()
+            self._iniciar_worker_async()
+
+        resultado = subprocess.CompletedProcess(
+            [script], resposta['returncode'], resposta['stdout'], resposta['stderr']
+        )
+        return resultado, {'inicio': resposta['inicio'], 'duracao': resposta['duracao']}
+
+    def _descartar(self, worker, script, erro):
+        """Mata o worker de uma execução que falhou, repõe outro e devolve a falha"""
+        with self._lock:
+            self._ocupados.discard(worker)
+        worker.matar()
+        worker.conn.close()
+        # Com o pool encerrado, _iniciar_worker não cria nada
+        self._iniciar_worker_async()
+        resultado = subprocess.CompletedProcess([script], 1, '', erro)
+        return resultado, {'inicio': None, 'duracao': None}
+
+    def encerrar(self):
+        """Encerra os workers ociosos e interrompe as execuções em andamento"""
+        with self._lock:
+            self._ativo = False
+            ocupados = list(self._ocupados)
+        self._encerrando.set()
+        while True:
+            try:
+                worker = self._ociosos.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.encerrar()
+        with self._lock:
+            # Quem está esperando um worker desiste na hora
+            for _ in range(self._aguardando):
+                self._ociosos.put(None)
+        for worker in ocupados:
+            # executar() recebe o EOF e devolve a execução como falha
+            worker.matar()
+
+    def estatisticas(self):
+        return {
+            'ativo': self._ativo,
+            'workers': self.num_workers,
+            'ociosos': self._ociosos.qsize(),
+            'aguardando': self._aguardando,
+            'reciclados': self._reciclados,
+            'falhas_inicio': self._falhas_inicio,
+            'sem_worker': self._sem_worker,
+            'ocupados': len(self._ocupados),
+            'tempo_esgotado': self._tempo_esgotado,
+            'timeout_segundos': self.timeout_segundos,
+            'max_execucoes': self.max_execucoes,
+            'max_memoria_mb': self.max_memoria_mb
+        }
+
+
+latencias_bots = EstatisticasLatencia()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool():
+    """Retorna o pool global, criando-o na primeira chamada (None se desativado)"""
+    global _pool
+    if not config.BOT_POOL_ATIVO:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = BotWorkerPool()
+            _pool.iniciar()
+    return _pool
@@ -0,0 +1,169 @@
+"""
+Cache LRU com expiração (TTL) para respostas da API externa
+Opcionalmente persiste as entradas em um arquivo SQLite, para que um novo
+processo (ex.: o verificador disparado pelo Agendador de Tarefas) reaproveite
+respostas recentes
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheTTL:
+    """
+    Cache limitado a `max_itens` entradas, descartando a usada há mais tempo
+
+    Args:
+        max_itens (int): capacidade da camada em memória
+        ttl (float): validade de cada entrada em segundos
+        arquivo (str): arquivo SQLite da camada em disco (None = só memória)
+
+    Cada entrada pode ter um `alias` (texto, ex.: o IDRO do romaneio) para
+    ser invalidada quando só o alias é conhecido.
+    """
+
+    def __init__(self, max_itens, ttl, arquivo=None):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.arquivo = arquivo
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()   # chave -> (expira_em, valor, alias)
+        self._por_alias = {}
+        self.acertos = 0
+        self.acertos_disco = 0
+        self.faltas = 0
+        self.remocoes = 0
+        self.expirados = 0
+        if arquivo:
+            self._criar_tabela()
+
+    # ----- camada em disco -----
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.arquivo, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _criar_tabela(self):
+        pasta = os.path.dirname(self.arquivo)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                         'chave TEXT PRIMARY KEY, alias TEXT, valor TEXT NOT NULL, expira_em REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_alias ON cache (alias)')
+            conn.execute('DELETE FROM cache WHERE expira_em < ?', (time.time(),))
+
+    def _ler_disco(self, chave):
+        try:
+            with self._conectar() as conn:
+                linha = conn.execute('SELECT valor, alias, expira_em FROM cache WHERE chave = ? AND expira_em >= ?',
+                                     (chave, time.time())).fetchone()
+        except sqlite3.Error:
+            return None
+        if linha is None:
+            return None
+        return json.loads(linha[0]), linha[1], linha[2]
+
+    def _gravar_disco(self, sql, parametros):
+        try:
+            with self._conectar() as conn:
+                conn.execute(sql, parametros)
+        except sqlite3.Error:
+            # O disco é só uma otimização: falhar aqui não pode derrubar a chamada
+            pass
+
+    # ----- operações -----
+
+    def _guardar(self, chave, valor, alias, expira_em):
+        """Insere na memória (com o lock já adquirido), descartando a entrada mais antiga"""
+        if chave in self._itens:
+            self._itens.move_to_end(chave)
+        self._itens[chave] = (expira_em, valor, alias)
+        if alias is not None:
+            self._por_alias[alias] = chave
+        while len(self._itens) > self.max_itens:
+            _, (_, _, alias_antigo) = self._itens.popitem(last=False)
+            self._por_alias.pop(alias_antigo, None)
+            self.remocoes += 1
+
+    def obter(self, chave):
+        """
+        Returns:
+            tuple: (encontrado, valor) — o valor é uma cópia, pode ser alterado
+        """
+        agora = time.time()
+        with self._lock:
+            entrada = self._itens.get(chave)
+            if entrada is not None:
+                expira_em, valor, alias = entrada
+                if expira_em >= agora:
+                    self._itens.move_to_end(chave)
+                    self.acertos += 1
+                    return True, copy.deepcopy(valor)
+                del self._itens[chave]
+                self._por_alias.pop(alias, None)
+                self.expirados += 1
+
+        if self.arquivo:
+            do_disco = self._ler_disco(chave)
+            if do_disco is not None:
+                valor, alias, expira_em = do_disco
+                with self._lock:
+                    self._guardar(chave, valor, alias, expira_em)
+                    self.acertos_disco += 1
+                return True, copy.deepcopy(valor)
+
+        with self._lock:
+            self.faltas += 1
+        return False, None
+
+    def definir(self, chave, valor, alias=None):
+        expira_em = time.time() + self.ttl
+        with self._lock:
+            self._guardar(chave, copy.deepcopy(valor), alias, expira_em)
+        if self.arquivo:
+            self._gravar_disco('INSERT OR REPLACE INTO cache (chave, alias, valor, expira_em) VALUES (?, ?, ?, ?)',
+                               (chave, alias, json.dumps(valor), expira_em))
+
+    def invalidar(self, chave):
+        with self._lock:
+            entrada = self._itens.pop(chave, None)
+            if entrada is not None:
+                self._por_alias.pop(entrada[2], None)
+        if self.arquivo:
+            self._gravar_disco('DELETE FROM cache WHERE chave = ?', (chave,))
+
+    def invalidar_alias(self, alias):
+        with self._lock:
+            chave = self._por_alias.pop(alias, None)
+            if chave is not None:
+                self._itens.pop(chave, None)
+        if self.arquivo:
+            self._gravar_disco('DELETE FROM cache WHERE alias = ?', (alias,))
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._por_alias.clear()
+        if self.arquivo:
+            self._gravar_disco('DELETE FROM cache', ())
+
+    def estado(self):
+        with self._lock:
+            consultas = self.acertos + self.acertos_disco + self.faltas
+            return {
+                'itens': len(self._itens),
+                'max_itens': self.max_itens,
+                'ttl': self.ttl,
+                'acertos': self.acertos,
+                'acertos_disco': self.acertos_disco,
+                'faltas': self.faltas,
+                'remocoes': self.remocoes,
+                'expirados': self.expirados,
+                'taxa_acerto': round((self.acertos + self.acertos_disco) / consultas, 3) if consultas else None
+            }
@@ -0,0 +1,70 @@
+"""
+Deduplicação de chamadas simultâneas (single-flight)
+Quando várias threads pedem a mesma chave ao mesmo tempo, só a primeira faz
+a chamada; as outras aguardam e recebem o mesmo resultado (ou a mesma exceção)
+"""
+import copy
+import threading
+
+
+class _Chamada:
+    def __init__(self):
+        self.concluida = threading.Event()
+        self.resultado = None
+        self.erro = None
+        self.aguardando = 0
+
+
+class ChamadaUnica:
+    """Agrupa chamadas em andamento por chave"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._em_andamento = {}
+        self.executadas = 0
+        self.compartilhadas = 0
+
+    def executar(self, chave, funcao, *args, **kwargs):
+        """
+        Executa `funcao(*args, **kwargs)` ou aguarda a execução em andamento
+        para a mesma chave
+
+        Quem aguardou recebe uma cópia do resultado, para que nenhuma thread
+        altere os dados de outra.
+        """
+        with self._lock:
+            chamada = self._em_andamento.get(chave)
+            if chamada is None:
+                chamada = _Chamada()
+                self._em_andamento[chave] = chamada
+                lider = True
+                self.executadas += 1
+            else:
+                chamada.aguardando += 1
+                lider = False
+                self.compartilhadas += 1
+
+        if not lider:
+            chamada.concluida.wait()
+            if chamada.erro is not None:
+                raise chamada.erro
+            return copy.deepcopy(chamada.resultado)
+
+        try:
+            chamada.resultado = funcao(*args, **kwargs)
+            return chamada.resultado
+        except BaseException as e:
+            chamada.erro = e
+            raise
+        finally:
+            with self._lock:
+                del self._em_andamento[chave]
+            chamada.concluida.set()
+
+    def estado(self):
+        with self._lock:
+            return {
+                'em_andamento': len(self._em_andamento),
+                'executadas': self.executadas,
+                'compartilhadas': self.compartilhadas
+            }
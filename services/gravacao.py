@@ -0,0 +1,199 @@
+"""
+Gravação e reprodução das respostas da API usadas em um passe do verificador
+Permite repetir um passe real contra uma cópia do banco, de forma
+determinística, para comparar otimizações (ver replay_verificacao.py)
+
+Formato do arquivo (JSON lines com gzip):
+    1ª linha: cabeçalho {"versao", "gravado_em", "api_base_url", "banco"}
+    demais:   {"pedido", "t", "duracao", "tipo", "corpo" | "erro" | "resultado_anterior"}
+    tipo: resposta | nao_modificado | erro | indisponivel
+    (nao_modificado leva o resultado da verificação anterior do pedido)
+"""
+import gzip
+import io
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from services.api_client import NAO_MODIFICADO
+from services.leitor_json import LeitorRomaneio, decodificar_json
+from services.resiliencia import APIError, APIIndisponivelError
+
+VERSAO_FORMATO = 1
+
+
+def copiar_banco_sqlite(origem, destino):
+    """Cópia consistente de um banco SQLite em uso (API de backup do sqlite3)"""
+    conexao_origem = sqlite3.connect(origem)
+    conexao_destino = sqlite3.connect(destino)
+    try:
+        conexao_origem.backup(conexao_destino)
+    finally:
+        conexao_destino.close()
+        conexao_origem.close()
+
+
+class GravadorRespostas:
+    """Grava as respostas em um arquivo .jsonl.gz"""
+
+    def __init__(self, caminho, api_base_url=None, banco=None):
+        self.caminho = caminho
+        self.inicio = time.perf_counter()
+        self.total = 0
+        self._lock = threading.Lock()
+        self._arquivo = gzip.open(caminho, 'wt', encoding='utf-8')
+        self._escrever({
+            'versao': VERSAO_FORMATO,
+            'gravado_em': datetime.utcnow().isoformat(),
+            'api_base_url': api_base_url,
+            'banco': banco
+        })
+
+    def _escrever(self, registro):
+        self._arquivo.write(json.dumps(registro, separators=(',', ':')) + '\n')
+
+    def registrar(self, pedido, inicio, duracao, tipo, corpo=None, erro=None, resultado_anterior=None):
+        registro = {
+            'pedido': pedido,
+            't': round(inicio - self.inicio, 4),
+            'duracao': round(duracao, 4),
+            'tipo': tipo
+        }
+        if corpo is not None:
+            registro['corpo'] = corpo
+        if erro is not None:
+            registro['erro'] = erro
+        if resultado_anterior is not None:
+            registro['resultado_anterior'] = resultado_anterior
+        with self._lock:
+            self._escrever(registro)
+            self.total += 1
+
+    def fechar(self):
+        with self._lock:
+            self._arquivo.close()
+
+
+class ClienteGravador:
+    """
+    Envolve um RomaneioAPIClient e grava cada consulta feita pelo verificador
+
+    Durante a gravação o corpo é lido inteiro (para ser guardado) antes de
+    ser decodificado em lotes. A leitura passa pela fonte do próprio leitor
+    da resposta, que depois segue lendo da cópia: um leitor com assinatura
+    (API sem ETag/Last-Modified) ainda calcula o hash e grava os validadores.
+    """
+
+    def __init__(self, cliente, gravador):
+        self.cliente = cliente
+        self.gravador = gravador
+
+    def __getattr__(self, nome):
+        return getattr(self.cliente, nome)
+
+    def abrir_romaneio(self, pedido_compra, condicional=False):
+        inicio = time.perf_counter()
+        try:
+            resposta = self.cliente.abrir_romaneio(pedido_compra, condicional=condicional)
+            if resposta is NAO_MODIFICADO:
+                self.gravador.registrar(pedido_compra, inicio, time.perf_counter() - inicio, 'nao_modificado',
+                                        resultado_anterior=self.cliente.resultado_anterior(pedido_compra))
+                return resposta
+            try:
+                corpo = resposta.fonte.read()
+            except BaseException:
+                resposta.fechar()
+                raise
+        except APIIndisponivelError as e:
+            self.gravador.registrar(pedido_compra, inicio, time.perf_counter() - inicio, 'indisponivel', erro=str(e))
+            raise
+        except Exception as e:
+            self.gravador.registrar(pedido_compra, inicio, time.perf_counter() - inicio, 'erro', erro=str(e))
+            raise
+
+        self.gravador.registrar(pedido_compra, inicio, time.perf_counter() - inicio, 'resposta',
+                                corpo=corpo.decode('utf-8'))
+        # A resposta HTTP (já lida até o fim) é fechada pelo `with` de quem usa o leitor
+        resposta.fonte = io.BytesIO(corpo)
+        return resposta
+
+
+class ClienteReproducao:
+    """
+    Substitui o RomaneioAPIClient devolvendo as respostas gravadas
+
+    Args:
+        caminho (str): arquivo gravado com GravadorRespostas
+        tempo_real (bool): se True, espera a duração gravada de cada consulta;
+            se False, responde imediatamente
+    """
+
+    def __init__(self, caminho, tempo_real=False):
+        self.tempo_real = tempo_real
+        self.respostas = defaultdict(deque)
+        self.resultados = {}
+        self.consultas = 0
+        self.faltantes = 0
+
+        with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+            self.cabecalho = json.loads(arquivo.readline())
+            if self.cabecalho.get('versao') != VERSAO_FORMATO:
+                raise ValueError(f"Versao de gravacao nao suportada: {self.cabecalho.get('versao')}")
+            for linha in arquivo:
+                registro = json.loads(linha)
+                self.respostas[registro['pedido']].append(registro)
+
+    @property
+    def pedidos(self):
+        return set(self.respostas)
+
+    def _proxima(self, pedido_compra):
+        fila = self.respostas.get(pedido_compra)
+        if not fila:
+            self.faltantes += 1
+            raise APIError(f"Sem resposta gravada para o pedido {pedido_compra}")
+        registro = fila.popleft()
+        self.consultas += 1
+        if self.tempo_real:
+            time.sleep(registro['duracao'])
+        if registro['tipo'] == 'indisponivel':
+            raise APIIndisponivelError(registro['erro'])
+        if registro['tipo'] == 'erro':
+            raise APIError(registro['erro'])
+        return registro
+
+    def abrir_romaneio(self, pedido_compra, condicional=False):
+        registro = self._proxima(pedido_compra)
+        if registro['tipo'] == 'nao_modificado':
+            # Mesmo resultado anterior da gravação: o verificador decide igual
+            self.resultados[pedido_compra] = registro.get('resultado_anterior')
+            return NAO_MODIFICADO
+        return LeitorRomaneio(io.BytesIO(registro['corpo'].encode('utf-8')))
+
+    def get_romaneio(self, pedido_compra, usar_cache=True):
+        registro = self._proxima(pedido_compra)
+        return decodificar_json(registro['corpo'])
+
+    def esquecer_validadores(self, pedido_compra):
+        self.resultados.pop(pedido_compra, None)
+    
+    def registrar_resultado(self, pedido_compra, resultado):
+        self.resultados[pedido_compra] = resultado
+    
+    def resultado_anterior(self, pedido_compra):
+        return self.resultados.get(pedido_compra)
+
+    def estado_circuito(self):
+        return {'nome': 'reproducao', 'estado': 'fechado', 'falhas_seguidas': 0,
+                'vezes_aberto': 0, 'chamadas_rejeitadas': 0}
+
+    def estado_limitadores(self):
+        return {}
+
+    def estado_cache(self):
+        return None
+
+    def estado_consultas(self):
+        return {'completas': 0, 'nao_modificadas_304': 0, 'nao_modificadas_hash': 0}
@@ -0,0 +1,267 @@
+"""
+Importação de romaneios em massa a partir de planilhas (xlsx ou CSV)
+Lê a planilha em stream, valida todas as linhas antes de gravar (campos
+obrigatórios, chave de acesso, pedidos repetidos no arquivo e pedidos já
+cadastrados, consultados de uma vez) e grava as linhas válidas com
+inserções em massa. A inserção de cada romaneio na API vai para o outbox
+(operação inserir_romaneio), entregue pelo despachante com concorrência
+limitada (OUTBOX_CONCORRENCIA).
+
+Colunas reconhecidas (sem diferenciar maiúsculas/acentos), como na planilha
+`Massa de Dados Profectum.xlsx`:
+- pedido_compra: "Nº do Movimento", "Pedido", "Pedido de Compra"
+- nota_fiscal: "Nota", "Nota Fiscal", "NF"
+- chave_acesso: "Chave de acesso", "Chave"
+- observacoes (opcional): "Observações"
+"""
+import csv
+import io
+import os
+import unicodedata
+from datetime import datetime
+from sqlalchemy import select
+from services.romaneio_service import RomaneioService
+import config
+
+COLUNAS = {
+    'pedido_compra': ('n do movimento', 'no do movimento', 'numero do movimento', 'pedido', 'pedido de compra',
+                      'pedido_compra'),
+    'nota_fiscal': ('nota', 'nota fiscal', 'nota_fiscal', 'nf'),
+    'chave_acesso': ('chave de acesso', 'chave', 'chave_acesso'),
+    'observacoes': ('observacoes', 'observacao', 'obs'),
+}
+OBRIGATORIAS = ('pedido_compra', 'nota_fiscal', 'chave_acesso')
+
+# Pedidos consultados por SELECT ... IN (limite de parâmetros do SQLite)
+_LOTE_CONSULTA = 900
+
+
+class ImportacaoError(Exception):
+    """Arquivo que não pode ser importado (formato, colunas ou tamanho)"""
+
+
+def _normalizar_cabecalho(valor):
+    texto = unicodedata.normalize('NFKD', str(valor or '')).encode('ascii', 'ignore').decode()
+    texto = texto.lower().replace('.', ' ').replace('_', ' ')
+    return ' '.join(texto.split())
+
+
+def _mapear_colunas(cabecalho):
+    """{campo: índice da coluna} a partir da linha de cabeçalho"""
+    normalizados = [_normalizar_cabecalho(valor) for valor in cabecalho]
+    mapa = {}
+    for campo, apelidos in COLUNAS.items():
+        for apelido in apelidos:
+            apelido = _normalizar_cabecalho(apelido)
+            if apelido in normalizados:
+                mapa[campo] = normalizados.index(apelido)
+                break
+    faltando = [campo for campo in OBRIGATORIAS if campo not in mapa]
+    if faltando:
+        raise ImportacaoError(f"Coluna(s) obrigatória(s) não encontrada(s): {', '.join(faltando)} "
+                              f"(cabeçalho: {', '.join(str(valor) for valor in cabecalho if valor)})")
+    return mapa
+
+
+def _texto(valor):
+    """Célula como texto: números inteiros sem '.0', datas e vazios tratados"""
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d')
+    return str(valor).strip()
+
+
+def _linhas_xlsx(arquivo):
+    from openpyxl import load_workbook
+
+    planilha = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        yield from planilha.worksheets[0].iter_rows(values_only=True)
+    finally:
+        planilha.close()
+
+
+def _linhas_csv(arquivo):
+    if isinstance(arquivo, (str, os.PathLike)):
+        bruto = open(arquivo, 'rb')
+    else:
+        bruto = arquivo
+    try:
+        amostra = bruto.read(4096)
+        bruto.seek(0)
+        codificacao = 'utf-8-sig'
+        try:
+            amostra.decode(codificacao)
+        except UnicodeDecodeError:
+            codificacao = 'latin-1'
+        try:
+            dialeto = csv.Sniffer().sniff(amostra.decode(codificacao, errors='ignore'), delimiters=';,\t')
+        except csv.Error:
+            dialeto = csv.excel
+        texto = io.TextIOWrapper(bruto, encoding=codificacao, newline='')
+        try:
+            yield from csv.reader(texto, dialeto)
+        finally:
+            # Não fecha o arquivo de quem chamou junto com o wrapper
+            texto.detach()
+    finally:
+        if bruto is not arquivo:
+            bruto.close()
+
+
+def ler_planilha(arquivo, nome_arquivo=None):
+    """
+    Lê a planilha em stream
+
+    Args:
+        arquivo: caminho ou arquivo binário aberto (ex.: upload do Flask)
+        nome_arquivo: nome original, usado para escolher entre xlsx e CSV
+
+    Yields:
+        tuple: (número da linha na planilha, dict com os campos)
+    """
+    nome = (nome_arquivo or str(arquivo)).lower()
+    if nome.endswith(('.xlsx', '.xlsm')):
+        linhas = _linhas_xlsx(arquivo)
+    elif nome.endswith(('.csv', '.txt')):
+        linhas = _linhas_csv(arquivo)
+    else:
+        raise ImportacaoError("Formato não suportado: envie um arquivo .xlsx ou .csv")
+
+    mapa = None
+    for numero, linha in enumerate(linhas, start=1):
+        if not linha or all(valor is None or str(valor).strip() == '' for valor in linha):
+            continue
+        if mapa is None:
+            mapa = _mapear_colunas(linha)
+            continue
+        yield numero, {campo: _texto(linha[indice]) if indice < len(linha) else ''
+                       for campo, indice in mapa.items()}
+
+    if mapa is None:
+        raise ImportacaoError("Planilha vazia")
+
+
+class ImportacaoService:
+    """
+    Importa romaneios de uma planilha
+
+    Cada linha do relatório tem: linha, pedido_compra, status
+    (importado, invalido, duplicado, ja_existe, valido — em simulação) e mensagem.
+    """
+
+    def validar(self, linhas):
+        """
+        Valida todas as linhas antes de gravar
+
+        Returns:
+            tuple: (linhas válidas, relatório de todas as linhas)
+        """
+        from app import db, Romaneio
+
+        relatorio = []
+        validas = []
+        primeira_linha = {}
+
+        for numero, campos in linhas:
+            if len(relatorio) >= config.IMPORTACAO_MAX_LINHAS:
+                raise ImportacaoError(f"Planilha com mais de {config.IMPORTACAO_MAX_LINHAS} linhas "
+                                      f"(IMPORTACAO_MAX_LINHAS)")
+            pedido = campos['pedido_compra']
+            chave = ''.join(campos['chave_acesso'].split())
+            resultado = {'linha': numero, 'pedido_compra': pedido, 'status': 'valido', 'mensagem': ''}
+            relatorio.append(resultado)
+
+            faltando = [campo for campo in OBRIGATORIAS if not campos[campo]]
+            if faltando:
+                resultado.update(status='invalido', mensagem=f"Campo(s) vazio(s): {', '.join(faltando)}")
+            elif len(chave) != 44 or not chave.isdigit():
+                resultado.update(status='invalido',
+                                 mensagem=f"Chave de acesso deve ter 44 dígitos (recebido: {campos['chave_acesso'][:60]!r})")
+            elif pedido in primeira_linha:
+                resultado.update(status='duplicado',
+                                 mensagem=f"Pedido repetido na planilha (primeira ocorrência na linha {primeira_linha[pedido]})")
+            else:
+                primeira_linha[pedido] = numero
+                validas.append((resultado, dict(campos, chave_acesso=chave)))
+
+        # Pedidos já cadastrados: uma consulta (em lotes, pelo limite de parâmetros)
+        pedidos = [campos['pedido_compra'] for _, campos in validas]
+        existentes = set()
+        for inicio in range(0, len(pedidos), _LOTE_CONSULTA):
+            existentes.update(db.session.execute(
+                select(Romaneio.pedido_compra)
+                .where(Romaneio.pedido_compra.in_(pedidos[inicio:inicio + _LOTE_CONSULTA]))
+            ).scalars())
+
+        aceitas = []
+        for resultado, campos in validas:
+            if campos['pedido_compra'] in existentes:
+                resultado.update(status='ja_existe', mensagem='Já existe um romaneio para este pedido')
+            else:
+                aceitas.append((resultado, campos))
+        return aceitas, relatorio
+
+    def gravar(self, aceitas, user_id):
+        """Insere romaneios, logs e mensagens de outbox em massa, em uma transação"""
+        from app import db
+
+        if not aceitas:
+            return []
+
+        try:
+            ids = RomaneioService().criar_romaneios_em_massa([campos for _, campos in aceitas], user_id,
+                                                             origem='Romaneio importado de planilha')
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        for (resultado, _), romaneio_id in zip(aceitas, ids):
+            resultado.update(status='importado', romaneio_id=romaneio_id,
+                             mensagem='Importado' if config.MODO_TESTE else 'Importado, inserção na API agendada')
+        return ids
+
+    def importar(self, arquivo, user_id, nome_arquivo=None, simular=False):
+        """
+        Valida e importa uma planilha
+
+        Args:
+            simular (bool): só valida, não grava nada
+
+        Returns:
+            dict: totais por status e o relatório por linha
+
+        Raises:
+            ImportacaoError: arquivo em formato inválido, sem as colunas ou grande demais
+        """
+        aceitas, relatorio = self.validar(ler_planilha(arquivo, nome_arquivo))
+        ids = [] if simular else self.gravar(aceitas, user_id)
+
+        totais = {}
+        for resultado in relatorio:
+            totais[resultado['status']] = totais.get(resultado['status'], 0) + 1
+        return {
+            'total_linhas': len(relatorio),
+            'totais': totais,
+            'simulacao': simular,
+            'romaneio_ids': ids,
+            'linhas': relatorio,
+        }
+
+    def situacao_api(self, romaneio_ids):
+        """Estado da inserção na API (mensagens inserir_romaneio) de cada romaneio importado"""
+        from app import db, ApiOutbox
+
+        situacao = {}
+        for inicio in range(0, len(romaneio_ids), _LOTE_CONSULTA):
+            for romaneio_id, estado, erro in db.session.execute(
+                select(ApiOutbox.romaneio_id, ApiOutbox.estado, ApiOutbox.ultimo_erro)
+                .where(ApiOutbox.operacao == 'inserir_romaneio',
+                       ApiOutbox.romaneio_id.in_(romaneio_ids[inicio:inicio + _LOTE_CONSULTA]))
+            ):
+                situacao[romaneio_id] = {'estado': estado, 'ultimo_erro': erro}
+        return situacao
@@ -0,0 +1,114 @@
+"""
+Leitura incremental das respostas de GET /api/romaneio/{pedido}
+Pedidos com milhares de itens são lidos em lotes direto do stream HTTP, sem
+montar a lista inteira em memória
+
+Dependências opcionais:
+- ijson: leitura incremental (sem ele, o corpo é lido inteiro e decodificado)
+- orjson: decodificador rápido para o caminho sem ijson
+"""
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def decodificar_json(conteudo):
+    """Decodifica bytes JSON com o decodificador mais rápido disponível"""
+    if orjson is not None:
+        return orjson.loads(conteudo)
+    return json.loads(conteudo)
+
+
+class LeitorRomaneio:
+    """
+    Lê o primeiro romaneio de uma resposta da API
+
+    Args:
+        fonte: objeto "file-like" de bytes (ex.: `response.raw` ou BytesIO)
+        ao_fechar (callable): chamado ao fechar o leitor (ex.: `response.close`)
+
+    Uso:
+        with LeitorRomaneio(fonte) as leitor:
+            for lote in leitor.lotes_itens(500):
+                ...
+            leitor.cabecalho   # PEDIDO, IDRO, NOTA_FISCAL... (completo após os lotes)
+            leitor.vazio       # True se a API não retornou nenhum romaneio
+            leitor.inalterado  # True se o corpo é igual ao da última consulta (após os lotes)
+    """
+
+    def __init__(self, fonte, ao_fechar=None):
+        self.fonte = fonte
+        self.ao_fechar = ao_fechar
+        self.cabecalho = {}
+        self.vazio = True
+        self.total_itens = 0
+        self.inalterado = False
+
+    def fechar(self):
+        if self.ao_fechar:
+            self.ao_fechar()
+            self.ao_fechar = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fechar()
+
+    def lotes_itens(self, tamanho):
+        """Gera listas de até `tamanho` itens (dicts de ITEM)"""
+        if ijson is None:
+            yield from self._lotes_decodificando_tudo(tamanho)
+        else:
+            yield from self._lotes_incrementais(tamanho)
+
+    def _lotes_decodificando_tudo(self, tamanho):
+        dados = decodificar_json(self.fonte.read())
+        if not dados:
+            return
+        self.vazio = False
+        romaneio = dados[0]
+        itens = romaneio.get('ITEM') or []
+        self.cabecalho = {chave: valor for chave, valor in romaneio.items() if chave != 'ITEM'}
+        self.total_itens = len(itens)
+        for inicio in range(0, len(itens), tamanho):
+            yield itens[inicio:inicio + tamanho]
+
+    def _lotes_incrementais(self, tamanho):
+        lote = []
+        construtor = None
+
+        for prefixo, evento, valor in ijson.parse(self.fonte, use_float=True):
+            if construtor is not None:
+                construtor.event(evento, valor)
+                if prefixo == 'item.ITEM.item' and evento == 'end_map':
+                    lote.append(construtor.value)
+                    construtor = None
+                    self.total_itens += 1
+                    if len(lote) >= tamanho:
+                        yield lote
+                        lote = []
+                continue
+
+            if prefixo == 'item.ITEM.item' and evento == 'start_map':
+                construtor = ijson.ObjectBuilder()
+                construtor.event(evento, valor)
+            elif prefixo == 'item' and evento == 'start_map':
+                self.vazio = False
+            elif prefixo == 'item' and evento == 'end_map':
+                # Só o primeiro romaneio da resposta interessa
+                break
+            elif prefixo.count('.') == 1 and evento not in ('start_map', 'end_map', 'start_array',
+                                                            'end_array', 'map_key'):
+                self.cabecalho[prefixo[len('item.'):]] = valor
+
+        if lote:
+            yield lote
@@ -0,0 +1,120 @@
+"""
+Limitação adaptativa de taxa das chamadas à API externa
+Token bucket por endpoint cuja taxa se ajusta no estilo AIMD (aumento
+aditivo, redução multiplicativa) conforme a latência e os erros observados
+"""
+import threading
+import time
+import config
+
+
+class LimitadorAdaptativo:
+    """
+    Token bucket compartilhado entre threads
+
+    - cada chamada consome um token; sem token disponível, a thread aguarda
+    - resposta rápida e sem erro: a taxa sobe aos poucos (+incremento por
+      segundo de chamadas bem-sucedidas) até `taxa_max`
+    - timeout, erro de conexão, 5xx, 429 ou latência acima do alvo: a taxa cai
+      pela metade (no máximo uma redução por `janela_reducao` segundos, para
+      uma rajada de erros simultâneos não derrubar a taxa até o mínimo)
+    """
+
+    def __init__(self, nome, taxa_max, taxa_min=None, latencia_alvo=None,
+                 incremento=None, fator_reducao=None, rajada=None):
+        self.nome = nome
+        self.taxa_max = float(taxa_max)
+        self.taxa_min = float(taxa_min if taxa_min is not None else config.API_LIMITE_TAXA_MIN)
+        self.latencia_alvo = latencia_alvo or config.API_LIMITE_LATENCIA_ALVO_SEGUNDOS
+        self.incremento = incremento or config.API_LIMITE_INCREMENTO
+        self.fator_reducao = fator_reducao or config.API_LIMITE_FATOR_REDUCAO
+        self.rajada = rajada or config.API_LIMITE_RAJADA
+        self.janela_reducao = 1.0
+
+        self._lock = threading.Lock()
+        # Começa no meio do caminho: sobe rápido se a API aguentar
+        self.taxa = max(self.taxa_min, self.taxa_max / 2)
+        self._tokens = 1.0
+        self._atualizado_em = time.monotonic()
+        self._ultima_reducao = 0.0
+        self._pausado_ate = 0.0
+        self.chamadas = 0
+        self.reducoes = 0
+        self.tempo_espera = 0.0
+
+    def _repor(self, agora):
+        decorrido = agora - self._atualizado_em
+        self._atualizado_em = agora
+        if agora >= self._pausado_ate:
+            self._tokens = min(self.rajada, self._tokens + decorrido * self.taxa)
+
+    def aguardar(self):
+        """
+        Bloqueia até haver um token para a chamada
+
+        Returns:
+            float: segundos aguardados
+        """
+        inicio = time.monotonic()
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._repor(agora)
+                if agora >= self._pausado_ate and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.chamadas += 1
+                    esperado = agora - inicio
+                    self.tempo_espera += esperado
+                    return esperado
+                if agora < self._pausado_ate:
+                    espera = self._pausado_ate - agora
+                else:
+                    espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+    def registrar(self, latencia, sobrecarga=False):
+        """
+        Ajusta a taxa com o resultado de uma chamada
+
+        Args:
+            latencia (float): duração da chamada em segundos
+            sobrecarga (bool): a chamada falhou por timeout, conexão, 5xx ou 429
+        """
+        with self._lock:
+            if sobrecarga or latencia > self.latencia_alvo:
+                agora = time.monotonic()
+                if agora - self._ultima_reducao >= self.janela_reducao:
+                    self.taxa = max(self.taxa_min, self.taxa * self.fator_reducao)
+                    self._ultima_reducao = agora
+                    self.reducoes += 1
+            else:
+                self.taxa = min(self.taxa_max, self.taxa + self.incremento / self.taxa)
+
+    def pausar(self, segundos):
+        """Suspende as chamadas (ex.: cabeçalho Retry-After de um 429)"""
+        with self._lock:
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+            self._tokens = 0.0
+
+    def estado(self):
+        with self._lock:
+            return {
+                'nome': self.nome,
+                'taxa': round(self.taxa, 2),
+                'taxa_max': self.taxa_max,
+                'chamadas': self.chamadas,
+                'reducoes': self.reducoes,
+                'tempo_espera': round(self.tempo_espera, 3)
+            }
+
+
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+
+
+def obter_limitador(nome, taxa_max):
+    """Limitador do processo para `nome` (ex.: URL base + endpoint)"""
+    with _limitadores_lock:
+        if nome not in _limitadores:
+            _limitadores[nome] = LimitadorAdaptativo(nome, taxa_max)
+        return _limitadores[nome]
@@ -0,0 +1,206 @@
+"""
+Logging estruturado do verificador, do cliente da API e do outbox
+Os registros vão para uma fila e são gravados por uma thread de fundo
+(QueueHandler + QueueListener), então quem loga não espera o console nem o
+disco. A thread grava:
+- um arquivo JSON lines rotativo (LOG_ARQUIVO), um objeto por linha
+- o console, no formato "[data hora] componente: mensagem"
+
+Cada registro leva o id de correlação do contexto atual (um por passe do
+verificador e um por requisição HTTP), para juntar as linhas de um mesmo passe.
+
+Uso:
+    logger = obter_logger('verificador')
+    logger.info("Verificando romaneio %s", pedido, extra={'pedido': pedido})
+    with correlacao('passe-42'):
+        ...
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+import config
+
+RAIZ_LOGGERS = 'rpa'
+
+# Nome exibido no console para cada componente
+NOMES_COMPONENTES = {
+    'verificador': 'Verificador',
+    'api': 'API Client',
+    'outbox': 'Outbox',
+    'app': 'App',
+    'bot_pool': 'Bot Pool',
+}
+
+# Componentes silenciados (exceto avisos e erros) com VERIFICADOR_LOG_DETALHADO=False
+COMPONENTES_DETALHADOS = ('verificador', 'api', 'outbox')
+
+id_correlacao = contextvars.ContextVar('id_correlacao', default=None)
+
+# Atributos padrão do LogRecord; o resto veio de `extra=` e vai para o JSON
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'correlacao'}
+
+_configurado = False
+_configuracao_lock = threading.Lock()
+_listener = None
+
+
+class _FiltroCorrelacao(logging.Filter):
+    """Anexa o id de correlação do contexto de quem logou"""
+
+    def filter(self, record):
+        record.correlacao = id_correlacao.get()
+        return True
+
+
+class _QueueHandlerAdiado(logging.handlers.QueueHandler):
+    """
+    Enfileira o registro sem formatar: a mensagem (msg % args) só é montada
+    na thread de fundo. Os args não devem ser alterados depois da chamada.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # O traceback referencia frames vivos: formata já
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro"""
+
+    def format(self, record):
+        dados = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'componente': record.name.split('.', 1)[-1],
+            'mensagem': record.getMessage(),
+        }
+        if getattr(record, 'correlacao', None):
+            dados['correlacao'] = record.correlacao
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_PADRAO and not chave.startswith('_'):
+                dados[chave] = valor
+        if record.exc_text:
+            dados['excecao'] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class FormatadorConsole(logging.Formatter):
+    """Mesmo formato dos prints antigos: [data hora] Componente: mensagem"""
+
+    def format(self, record):
+        componente = record.name.split('.', 1)[-1]
+        texto = (f"[{datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S')}] "
+                 f"{NOMES_COMPONENTES.get(componente, componente)}: {record.getMessage()}")
+        if record.exc_text:
+            texto += '\n' + record.exc_text
+        return texto
+
+
+def configurar(forcar=False):
+    """Monta a fila, os handlers e a thread de fundo (uma vez por processo)"""
+    global _configurado, _listener
+    with _configuracao_lock:
+        if _configurado and not forcar:
+            return
+        if _listener is not None:
+            _listener.stop()
+
+        handlers = []
+        if config.LOG_ARQUIVO:
+            pasta = os.path.dirname(config.LOG_ARQUIVO)
+            if pasta:
+                os.makedirs(pasta, exist_ok=True)
+            arquivo = logging.handlers.RotatingFileHandler(
+                config.LOG_ARQUIVO,
+                maxBytes=config.LOG_ARQUIVO_MAX_MB * 1024 * 1024,
+                backupCount=config.LOG_ARQUIVO_BACKUPS,
+                encoding='utf-8',
+                delay=True
+            )
+            arquivo.setFormatter(FormatadorJSON())
+            handlers.append(arquivo)
+        if config.LOG_CONSOLE:
+            console = logging.StreamHandler()
+            console.setFormatter(FormatadorConsole())
+            console.setLevel(config.LOG_NIVEL_CONSOLE)
+            handlers.append(console)
+
+        fila = queue.SimpleQueue()
+        raiz = logging.getLogger(RAIZ_LOGGERS)
+        for handler in list(raiz.handlers):
+            raiz.removeHandler(handler)
+        manipulador_fila = _QueueHandlerAdiado(fila)
+        manipulador_fila.addFilter(_FiltroCorrelacao())
+        raiz.addHandler(manipulador_fila)
+        raiz.setLevel(config.LOG_NIVEL)
+        raiz.propagate = False
+
+        nivel_componentes = logging.NOTSET if config.VERIFICADOR_LOG_DETALHADO else logging.WARNING
+        for componente in COMPONENTES_DETALHADOS:
+            logging.getLogger(f'{RAIZ_LOGGERS}.{componente}').setLevel(nivel_componentes)
+
+        _listener = logging.handlers.QueueListener(fila, *handlers, respect_handler_level=True)
+        _listener.start()
+        _configurado = True
+
+
+def encerrar():
+    """Grava o que ainda estiver na fila e para a thread de fundo"""
+    global _listener, _configurado
+    with _configuracao_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+        _configurado = False
+
+
+atexit.register(encerrar)
+
+
+def obter_logger(componente):
+    """Logger de um componente (verificador, api, outbox, app)"""
+    configurar()
+    return logging.getLogger(f'{RAIZ_LOGGERS}.{componente}')
+
+
+def novo_id():
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def correlacao(identificador=None):
+    """Define o id de correlação dos registros feitos dentro do bloco"""
+    identificador = identificador or novo_id()
+    token = id_correlacao.set(identificador)
+    try:
+        yield identificador
+    finally:
+        id_correlacao.reset(token)
+
+
+def instrumentar_flask(app):
+    """Um id de correlação por requisição (reaproveita o header X-Request-ID se vier)"""
+    from flask import g, request
+
+    @app.before_request
+    def _correlacao_inicio():
+        g._token_correlacao = id_correlacao.set(request.headers.get('X-Request-ID') or novo_id())
+
+    @app.teardown_request
+    def _correlacao_fim(erro=None):
+        token = g.pop('_token_correlacao', None)
+        if token is not None:
+            try:
+                id_correlacao.reset(token)
+            except ValueError:
+                id_correlacao.set(None)
@@ -0,0 +1,97 @@
+"""
+Cronômetro compartilhado dos statements SQL
+Um único par before/after_cursor_execute (mais o handle_error) por engine mede
+cada statement e avisa os observadores registrados: tempo de banco do passe do
+verificador, métricas, perfil de requisição e spans do tracing. A pilha de
+início fica em um só lugar de `conn.info` e é desempilhada também quando o
+statement falha, então nenhum observador precisa do próprio par de eventos.
+"""
+import threading
+import time
+from sqlalchemy import event
+
+_CHAVE_PILHA = '_medidor_sql'
+
+_observadores = {}   # id(engine) -> lista de observadores
+_lock = threading.Lock()
+
+
+class StatementSQL:
+    """Um statement em execução (duracao e cursor preenchidos no fim)"""
+
+    __slots__ = ('statement', 'parameters', 'executemany', 'inicio', 'duracao', 'cursor')
+
+    def __init__(self, statement, parameters, executemany):
+        self.statement = statement
+        self.parameters = parameters
+        self.executemany = executemany
+        self.inicio = time.perf_counter()
+        self.duracao = None
+        self.cursor = None
+
+    @property
+    def comando(self):
+        """Primeira palavra do SQL em maiúsculas (SELECT, INSERT, ...)"""
+        return self.statement.lstrip().split(None, 1)[0].upper() if self.statement.strip() else 'SQL'
+
+
+class ObservadorSQL:
+    """
+    Base dos observadores: sobrescreva só o que precisar
+
+    `iniciar` devolve um estado qualquer, entregue de volta a `terminar`
+    (sucesso) ou a `falhar` (exceção do driver) do mesmo statement. Erros
+    fora de um statement (ex.: no COMMIT) chegam a `falhar` com sql e estado None.
+    """
+
+    def iniciar(self, sql):
+        return None
+
+    def terminar(self, sql, estado):
+        pass
+
+    def falhar(self, sql, estado, contexto):
+        pass
+
+
+def registrar(engine, observador):
+    """Adiciona um observador aos statements do engine (instala os eventos na primeira vez)"""
+    with _lock:
+        observadores = _observadores.get(id(engine))
+        if observadores is None:
+            observadores = _observadores[id(engine)] = []
+            _instalar(engine, observadores)
+        observadores.append(observador)
+
+
+def _instalar(engine, observadores):
+    # A lista só cresce: um observador registrado com um statement em andamento
+    # fica de fora dele (o zip para no menor)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        sql = StatementSQL(statement, parameters, executemany)
+        estados = [observador.iniciar(sql) for observador in list(observadores)]
+        conn.info.setdefault(_CHAVE_PILHA, []).append((sql, estados))
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _depois(conn, cursor, statement, parameters, context, executemany):
+        pilha = conn.info.get(_CHAVE_PILHA)
+        if not pilha:
+            return
+        sql, estados = pilha.pop()
+        sql.duracao = time.perf_counter() - sql.inicio
+        sql.cursor = cursor
+        for observador, estado in zip(observadores, estados):
+            observador.terminar(sql, estado)
+
+    @event.listens_for(engine, 'handle_error')
+    def _erro(contexto):
+        pilha = contexto.connection.info.get(_CHAVE_PILHA) if contexto.connection is not None else None
+        if pilha:
+            sql, estados = pilha.pop()
+            sql.duracao = time.perf_counter() - sql.inicio
+        else:
+            sql, estados = None, [None] * len(observadores)
+        for observador, estado in zip(observadores, estados):
+            observador.falhar(sql, estado, contexto)
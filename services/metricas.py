@@ -0,0 +1,332 @@
+"""
+Métricas do processo no formato de exposição de texto do Prometheus
+Contadores, medidores e histogramas com rótulos, mantidos em memória por
+processo e expostos em /metrics (app) ou em uma porta própria
+(verificador_romaneios.py --metricas-porta).
+
+Instrumentação:
+- instrumentar_flask(app): latência e contagem de requisições por endpoint
+- instrumentar_banco(engine): quantidade e tempo de SQL, esperas por lock e
+  erros "database is locked" do SQLite
+- chamadas à API externa, passes do verificador e bots registram direto nas
+  métricas declaradas abaixo
+"""
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+from services import medidor_sql
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_LONGOS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+TIPO_CONTEUDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _formatar_valor(valor):
+    if valor == math.inf:
+        return '+Inf'
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+        self._series = {}
+        if not self.rotulos and self.tipo != 'histogram':
+            self._series[()] = 0
+
+    def _chave(self, rotulos):
+        if set(rotulos) != set(self.rotulos):
+            raise ValueError(f"Metrica {self.nome} espera os rotulos {self.rotulos}, recebeu {tuple(rotulos)}")
+        return tuple(str(rotulos[nome]) for nome in self.rotulos)
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for chave, valor in series:
+            linhas.extend(self._linhas(chave, valor))
+        return linhas
+
+    def _linhas(self, chave, valor):
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_valor(valor)}"]
+
+
+class Contador(_Metrica):
+    """Valor que só cresce (total de requisições, erros...)"""
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+
+class Medidor(_Metrica):
+    """Valor que sobe e desce; pode ser calculado na hora da coleta com `funcao`"""
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, rotulos=(), funcao=None):
+        super().__init__(nome, ajuda, rotulos)
+        self.funcao = funcao
+
+    def definir(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = valor
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+    def dec(self, valor=1, **rotulos):
+        self.inc(-valor, **rotulos)
+
+    def exportar(self):
+        if self.funcao is not None:
+            try:
+                valores = self.funcao()
+            except Exception:
+                valores = None
+            if isinstance(valores, dict):
+                with self._lock:
+                    for chave, valor in valores.items():
+                        self._series[chave if isinstance(chave, tuple) else (chave,)] = valor
+            elif valores is not None:
+                with self._lock:
+                    self._series[()] = valores
+        return super().exportar()
+
+
+class Histograma(_Metrica):
+    """Distribuição de durações em buckets cumulativos"""
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = {'buckets': [0] * len(self.buckets), 'soma': 0.0, 'total': 0}
+            for indice, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie['buckets'][indice] += 1
+                    break
+            serie['soma'] += valor
+            serie['total'] += 1
+
+    def _linhas(self, chave, serie):
+        linhas = []
+        acumulado = 0
+        for limite, quantidade in zip(self.buckets, serie['buckets']):
+            acumulado += quantidade
+            rotulos = _formatar_rotulos(self.rotulos, chave, ('le', _formatar_valor(limite)))
+            linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+        rotulos = _formatar_rotulos(self.rotulos, chave)
+        linhas.append(f"{self.nome}_sum{rotulos} {_formatar_valor(serie['soma'])}")
+        linhas.append(f"{self.nome}_count{rotulos} {serie['total']}")
+        return linhas
+
+
+class Registro:
+    """Conjunto das métricas do processo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas = {}
+
+    def _obter(self, classe, nome, *args, **kwargs):
+        with self._lock:
+            metrica = self._metricas.get(nome)
+            if metrica is None:
+                metrica = self._metricas[nome] = classe(nome, *args, **kwargs)
+            elif not isinstance(metrica, classe):
+                raise ValueError(f"Metrica {nome} ja registrada como {metrica.tipo}")
+            return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._obter(Contador, nome, ajuda, rotulos)
+
+    def medidor(self, nome, ajuda, rotulos=(), funcao=None):
+        return self._obter(Medidor, nome, ajuda, rotulos, funcao=funcao)
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        return self._obter(Histograma, nome, ajuda, rotulos, buckets=buckets)
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus"""
+        with self._lock:
+            metricas = sorted(self._metricas.items())
+        linhas = []
+        for _, metrica in metricas:
+            linhas.extend(metrica.exportar())
+        return '\n'.join(linhas) + '\n'
+
+
+registro = Registro()
+
+# ==================== MÉTRICAS DO APP ====================
+
+http_requisicao_segundos = registro.histograma(
+    'rpa_http_requisicao_segundos', 'Duracao das requisicoes HTTP por endpoint do Flask',
+    ('endpoint', 'metodo'))
+http_requisicoes_total = registro.contador(
+    'rpa_http_requisicoes_total', 'Requisicoes HTTP atendidas por endpoint e codigo',
+    ('endpoint', 'metodo', 'codigo'))
+
+db_consulta_segundos = registro.histograma(
+    'rpa_db_consulta_segundos', 'Duracao dos statements SQL por comando', ('comando',))
+db_espera_lock_total = registro.contador(
+    'rpa_sqlite_espera_lock_total',
+    'Escritas que demoraram mais que METRICAS_LIMIAR_LOCK_MS (espera provavel pelo lock do SQLite)')
+db_espera_lock_segundos_total = registro.contador(
+    'rpa_sqlite_espera_lock_segundos_total', 'Tempo total das escritas contadas em rpa_sqlite_espera_lock_total')
+db_ocupado_total = registro.contador(
+    'rpa_sqlite_ocupado_total', 'Erros "database is locked"/"database is busy" do SQLite')
+
+api_requisicao_segundos = registro.histograma(
+    'rpa_api_requisicao_segundos', 'Duracao das chamadas a API de romaneios por endpoint', ('endpoint',))
+api_requisicoes_total = registro.contador(
+    'rpa_api_requisicoes_total',
+    'Chamadas a API de romaneios por endpoint e resultado (codigo HTTP, timeout, conexao, circuito_aberto)',
+    ('endpoint', 'resultado'))
+
+verificador_passe_segundos = registro.histograma(
+    'rpa_verificador_passe_segundos', 'Duracao dos passes do verificador', ('status',), buckets=BUCKETS_LONGOS)
+verificador_backlog = registro.medidor(
+    'rpa_verificador_backlog', 'Romaneios elegiveis no inicio do ultimo passe')
+verificador_romaneios_total = registro.contador(
+    'rpa_verificador_romaneios_total', 'Romaneios processados pelo verificador por resultado', ('resultado',))
+verificador_ultimo_passe = registro.medidor(
+    'rpa_verificador_ultimo_passe_timestamp', 'Fim do ultimo passe do verificador (epoch)')
+
+tracing_spans_descartados_total = registro.contador(
+    'rpa_tracing_spans_descartados_total',
+    'Spans nao gravados pelo exportador de tracing por motivo (erro_gravacao, fila_cheia)', ('motivo',))
+
+bots_em_execucao = registro.medidor(
+    'rpa_bots_em_execucao', 'Execucoes de bots em andamento neste processo')
+bot_execucao_segundos = registro.histograma(
+    'rpa_bot_execucao_segundos', 'Duracao das execucoes de bots', ('bot',), buckets=BUCKETS_LONGOS)
+
+
+def _fila_bots():
+    from services import bot_pool
+    return bot_pool._pool.estatisticas()['aguardando'] if bot_pool._pool else 0
+
+
+bots_aguardando_worker = registro.medidor(
+    'rpa_bots_aguardando_worker', 'Execucoes de bots esperando um worker livre do pool', funcao=_fila_bots)
+
+
+# ==================== INSTRUMENTAÇÃO ====================
+
+def instrumentar_flask(app):
+    """Registra latência e contagem de cada requisição atendida pelo app"""
+    from flask import g, request
+
+    @app.before_request
+    def _metricas_inicio():
+        g._metricas_inicio = time.perf_counter()
+
+    @app.after_request
+    def _metricas_fim(response):
+        inicio = g.pop('_metricas_inicio', None)
+        if inicio is not None:
+            endpoint = request.endpoint or 'desconhecido'
+            http_requisicao_segundos.observar(time.perf_counter() - inicio, endpoint=endpoint, metodo=request.method)
+            http_requisicoes_total.inc(endpoint=endpoint, metodo=request.method, codigo=response.status_code)
+        return response
+
+
+_engines_instrumentados = set()
+
+
+def instrumentar_banco(engine):
+    """Cronometra cada statement e conta os erros de lock do SQLite (uma vez por engine)"""
+    if id(engine) in _engines_instrumentados:
+        return
+    _engines_instrumentados.add(id(engine))
+    medidor_sql.registrar(engine, _MetricasSQL(config.METRICAS_LIMIAR_LOCK_MS / 1000))
+
+
+class _MetricasSQL(medidor_sql.ObservadorSQL):
+    """Histograma por comando e esperas/erros de lock do SQLite"""
+
+    def __init__(self, limiar_lock):
+        self.limiar_lock = limiar_lock
+
+    def terminar(self, sql, estado):
+        comando = sql.comando
+        if comando not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+            comando = 'OUTRO'
+        db_consulta_segundos.observar(sql.duracao, comando=comando)
+        if comando != 'SELECT' and sql.duracao >= self.limiar_lock:
+            db_espera_lock_total.inc()
+            db_espera_lock_segundos_total.inc(sql.duracao)
+
+    def falhar(self, sql, estado, contexto):
+        mensagem = str(contexto.original_exception).lower()
+        if 'database is locked' in mensagem or 'database is busy' in mensagem:
+            db_ocupado_total.inc()
+
+
+# ==================== SERVIDOR ====================
+
+def token_valido(token):
+    """Confere o token de acesso a /metrics (sempre falso se METRICAS_TOKEN não estiver definido)"""
+    return bool(config.METRICAS_TOKEN) and token == config.METRICAS_TOKEN
+
+
+def iniciar_servidor(porta, host='127.0.0.1'):
+    """
+    Expõe as métricas em http://host:porta/metrics em uma thread de fundo
+    (usado pelo verificador standalone, que não tem o Flask rodando)
+    """
+
+    class _Manipulador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            corpo = registro.exportar().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', TIPO_CONTEUDO)
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, formato, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, porta), _Manipulador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='metricas', daemon=True).start()
+    return servidor
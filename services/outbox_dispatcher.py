@@ -0,0 +1,363 @@
+"""
+Despachante do outbox de chamadas à API externa
+Entrega em paralelo as mensagens gravadas em `api_outbox`, com retentativas,
+backoff exponencial e falha definitiva (dead-letter) após o limite
+
+Operações:
+- atualizar_status: envia o novo status de um romaneio
+- inserir_romaneio: insere o romaneio criado no painel e grava o IDRO e os
+  itens devolvidos pela API
+"""
+import json
+import os
+import random
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, or_
+from services.api_client import RomaneioAPIClient
+from services.resiliencia import APIIndisponivelError
+from services import logs
+import config
+
+logger = logs.obter_logger('outbox')
+
+
+def enfileirar_atualizacao_status(romaneio, status):
+    """
+    Adiciona na sessão atual a mensagem de atualização de status na API.
+    Deve ser chamada antes do commit que grava a mudança de status local,
+    para que as duas coisas sejam persistidas na mesma transação.
+    """
+    from app import db, ApiOutbox
+
+    mensagem = ApiOutbox(
+        operacao='atualizar_status',
+        romaneio_id=romaneio.id,
+        idro=romaneio.idro,
+        payload=json.dumps({'status': status})
+    )
+    db.session.add(mensagem)
+    return mensagem
+
+
+def payload_insercao(pedido_compra, nota_fiscal, chave_acesso, apos_recebimento, programado, inserir_como_parcial):
+    """Payload JSON da mensagem inserir_romaneio (gravada por RomaneioService.criar_romaneios_em_massa)"""
+    return json.dumps({
+        'pedido_compra': pedido_compra,
+        'nota_fiscal': nota_fiscal,
+        'chave_acesso': chave_acesso,
+        'apos_recebimento': apos_recebimento,
+        'programado': programado,
+        'inserir_como_parcial': inserir_como_parcial
+    })
+
+
+def _ja_existente(resultado_api):
+    """True se a API respondeu que o romaneio já existe"""
+    mensagem = resultado_api.get('mensagem', '') if isinstance(resultado_api, dict) else ''
+    return 'já existente' in mensagem.lower() or 'ja existente' in mensagem.lower()
+
+
+class RomaneioDivergenteError(Exception):
+    """O pedido já existe na API com outra nota fiscal/chave: falha definitiva, sem retentativa"""
+
+
+def _documento(valor):
+    """Nota fiscal/chave comparável (sem espaços e zeros à esquerda)"""
+    return ''.join(str(valor or '').split()).lstrip('0')
+
+
+def _conferir_existente(registro, payload):
+    """
+    Só aceita vincular o romaneio local a um registro que já existia na API
+    se a nota fiscal (e a chave, quando a API a devolve) forem as mesmas
+
+    Raises:
+        RomaneioDivergenteError: documentos diferentes ou sem nota fiscal para conferir
+    """
+    nota_api = registro.get('NOTA_FISCAL')
+    chave_api = registro.get('CHAVE_ACESSO') or registro.get('CHAVE')
+    if nota_api is None or _documento(nota_api) != _documento(payload['nota_fiscal']):
+        raise RomaneioDivergenteError(
+            f"Pedido {payload['pedido_compra']} já existe na API com outra nota fiscal "
+            f"(API: {nota_api}, local: {payload['nota_fiscal']})")
+    if chave_api is not None and _documento(chave_api) != _documento(payload['chave_acesso']):
+        raise RomaneioDivergenteError(
+            f"Pedido {payload['pedido_compra']} já existe na API com outra chave de acesso")
+
+
+def insercao_nao_concluida(romaneio_id):
+    """
+    Condição (EXISTS) para romaneios cuja inserção na API ainda não foi
+    entregue: pendente ou em falha definitiva (ex.: pedido divergente na API).
+    O verificador não consulta esses romaneios na API.
+    """
+    from app import ApiOutbox
+
+    return select(ApiOutbox.id).where(
+        ApiOutbox.romaneio_id == romaneio_id,
+        ApiOutbox.operacao == 'inserir_romaneio',
+        ApiOutbox.estado != 'enviado'
+    ).exists()
+
+
+class OutboxDispatcher:
+    """
+    Despacha mensagens pendentes do outbox
+
+    As mensagens são reivindicadas com um bloqueio temporário (como os leases
+    do verificador), então vários despachantes podem rodar ao mesmo tempo.
+    As chamadas HTTP rodam em threads; toda escrita no banco fica na thread
+    do despachante.
+    """
+
+    def __init__(self, api_client=None, concorrencia=None, lote=None):
+        self.api_client = api_client or RomaneioAPIClient()
+        self.concorrencia = concorrencia or config.OUTBOX_CONCORRENCIA
+        self.lote = lote or config.OUTBOX_LOTE
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._executor = ThreadPoolExecutor(max_workers=self.concorrencia,
+                                            thread_name_prefix='outbox')
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _backoff(self, tentativas):
+        """Espera até a próxima tentativa: exponencial com jitter"""
+        espera = min(config.OUTBOX_BACKOFF_MAX_SEGUNDOS,
+                     config.OUTBOX_BACKOFF_BASE_SEGUNDOS * (2 ** (tentativas - 1)))
+        return timedelta(seconds=espera * random.uniform(0.5, 1.0))
+
+    def _reivindicar(self):
+        """Bloqueia um lote de mensagens vencidas para este despachante"""
+        from app import db, ApiOutbox
+
+        agora = datetime.utcnow()
+        bloqueado_ate = agora + timedelta(seconds=config.LEASE_DURACAO_SEGUNDOS)
+        livre = or_(ApiOutbox.bloqueado_ate.is_(None), ApiOutbox.bloqueado_ate < agora)
+
+        candidatos = select(ApiOutbox.id)\
+            .where(ApiOutbox.estado == 'pendente', ApiOutbox.proxima_tentativa_em <= agora, livre)\
+            .order_by(ApiOutbox.id)\
+            .limit(self.lote)
+
+        db.session.execute(
+            update(ApiOutbox)
+            .where(ApiOutbox.id.in_(candidatos), livre)
+            .values(bloqueado_por=self.worker_id, bloqueado_ate=bloqueado_ate)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        return ApiOutbox.query\
+            .filter(ApiOutbox.bloqueado_por == self.worker_id, ApiOutbox.bloqueado_ate == bloqueado_ate)\
+            .order_by(ApiOutbox.id)\
+            .execution_options(populate_existing=True)\
+            .all()
+
+    def _enviar(self, operacao, idro, payload, tentativas):
+        """
+        Executa a chamada HTTP (roda em thread do pool, sem acesso ao banco)
+        
+        Returns:
+            tuple: (Exception ou None se a entrega deu certo, resultado a aplicar no banco)
+        """
+        try:
+            if operacao == 'atualizar_status':
+                self.api_client.atualizar_status_romaneio(idro, payload['status'])
+                return None, None
+            if operacao == 'inserir_romaneio':
+                return None, self._inserir_romaneio(payload, tentativas)
+            raise ValueError(f"Operacao desconhecida: {operacao}")
+        except Exception as e:
+            return e, None
+
+    def _inserir_romaneio(self, payload, tentativas):
+        """
+        Insere o romaneio na API e busca os itens
+
+        Numa retentativa consulta antes do POST: a tentativa anterior pode ter
+        inserido e falhado só depois (ex.: timeout lendo a resposta).
+        """
+        pedido = payload['pedido_compra']
+        ja_existia = False
+        dados = self.api_client.get_romaneio(pedido, usar_cache=False) if tentativas else None
+
+        if dados:
+            ja_existia = True
+        else:
+            resultado_api = self.api_client.inserir_romaneio(
+                pedido, payload['nota_fiscal'], payload['chave_acesso'],
+                apos_recebimento=payload.get('apos_recebimento'),
+                programado=payload.get('programado'),
+                inserir_como_parcial=payload.get('inserir_como_parcial')
+            )
+            ja_existia = _ja_existente(resultado_api)
+            dados = self.api_client.get_romaneio(pedido, usar_cache=False)
+            if not dados and isinstance(resultado_api, dict) and resultado_api.get('idro'):
+                dados = [{'IDRO': resultado_api['idro'], 'ITEM': []}]
+
+        if not dados:
+            raise ValueError(f"API nao retornou o romaneio {pedido} apos a insercao")
+        if ja_existia:
+            _conferir_existente(dados[0], payload)
+        return {'idro': dados[0].get('IDRO'), 'itens': dados[0].get('ITEM', []), 'ja_existia': ja_existia}
+
+    def _aplicar_insercao(self, mensagem, resultado):
+        """Grava o IDRO e os itens devolvidos pela API e registra no log do romaneio"""
+        from app import db, Romaneio, RomaneioItem, RomaneioLog
+
+        romaneio = db.session.get(Romaneio, mensagem.romaneio_id) if mensagem.romaneio_id else None
+        if romaneio is None:
+            # Excluído antes da inserção terminar
+            return
+
+        if resultado['idro'] and not romaneio.idro:
+            romaneio.idro = resultado['idro']
+        mensagem.idro = romaneio.idro
+
+        existentes = {codigo for (codigo,) in db.session.execute(
+            select(RomaneioItem.codigo).where(RomaneioItem.romaneio_id == romaneio.id)
+        )}
+        novos = [item for item in resultado['itens'] if item.get('CODIGO') not in existentes]
+        for item in novos:
+            db.session.add(RomaneioItem(
+                romaneio_id=romaneio.id,
+                idro=item.get('IDRO'),
+                codigo=item.get('CODIGO'),
+                descricao=item.get('DESCRICAO') or '',
+                quantidade_nf=item.get('QUANTIDADE_NF') or 0,
+                quantidade_contada=item.get('QUANTIDADE_CONTADA')
+            ))
+
+        origem = 'ja existia na API' if resultado['ja_existia'] else 'inserido na API'
+        db.session.add(RomaneioLog(
+            romaneio_id=romaneio.id,
+            acao='inserido_api',
+            detalhes=f'Romaneio {origem} (IDRO {romaneio.idro}), {len(novos)} item(ns) importado(s)',
+            tentativa=romaneio.tentativas_contagem
+        ))
+        logger.info("Romaneio %s %s: IDRO %s, %d itens", romaneio.pedido_compra, origem, romaneio.idro, len(novos),
+                    extra={'pedido': romaneio.pedido_compra})
+
+    def _aplicar_insercao_isolada(self, mensagem, resultado):
+        """
+        Aplica o resultado de uma inserção em um SAVEPOINT: um item inválido
+        desfaz só esta mensagem, não o lote inteiro
+
+        Returns:
+            Exception ou None se foi aplicado
+        """
+        from app import db
+
+        try:
+            with db.session.begin_nested():
+                self._aplicar_insercao(mensagem, resultado)
+        except Exception as e:
+            logger.error("Mensagem %s: erro ao gravar o resultado da insercao: %s", mensagem.id, e)
+            return e
+        return None
+
+    def despachar_lote(self):
+        """
+        Reivindica e entrega um lote de mensagens
+
+        Returns:
+            dict: enviados, reagendados, falhas_definitivas
+        """
+        from app import db, RomaneioLog
+
+        mensagens = self._reivindicar()
+        resumo = {'enviados': 0, 'reagendados': 0, 'falhas_definitivas': 0}
+        if not mensagens:
+            return resumo
+
+        futuros = [
+            self._executor.submit(self._enviar, m.operacao, m.idro, json.loads(m.payload or '{}'), m.tentativas)
+            for m in mensagens
+        ]
+
+        agora = datetime.utcnow()
+        for mensagem, futuro in zip(mensagens, futuros):
+            erro, resultado = futuro.result()
+            if erro is None and mensagem.operacao == 'inserir_romaneio':
+                # Falha ao gravar conta como tentativa; a próxima consulta a API antes do POST
+                erro = self._aplicar_insercao_isolada(mensagem, resultado)
+            mensagem.bloqueado_por = None
+            mensagem.bloqueado_ate = None
+
+            if erro is None:
+                mensagem.estado = 'enviado'
+                mensagem.enviado_em = agora
+                resumo['enviados'] += 1
+                continue
+
+            if isinstance(erro, APIIndisponivelError):
+                # Circuito aberto: a chamada nem saiu, não consome tentativa
+                mensagem.proxima_tentativa_em = agora + timedelta(seconds=erro.retomar_em or 0)
+                resumo['reagendados'] += 1
+                continue
+            
+            mensagem.tentativas += 1
+            mensagem.ultimo_erro = str(erro)
+            if mensagem.tentativas >= config.OUTBOX_MAX_TENTATIVAS or isinstance(erro, RomaneioDivergenteError):
+                mensagem.estado = 'falha_definitiva'
+                resumo['falhas_definitivas'] += 1
+                logger.error("Mensagem %s (%s) em falha definitiva: %s", mensagem.id, mensagem.operacao, erro)
+                if mensagem.romaneio_id:
+                    db.session.add(RomaneioLog(
+                        romaneio_id=mensagem.romaneio_id,
+                        acao='erro_sincronizacao_api',
+                        detalhes=str(erro) if isinstance(erro, RomaneioDivergenteError) else
+                                 f'Falha definitiva ao enviar {mensagem.operacao} para a API '
+                                 f'apos {mensagem.tentativas} tentativas: {erro}'
+                    ))
+            else:
+                mensagem.proxima_tentativa_em = agora + self._backoff(mensagem.tentativas)
+                resumo['reagendados'] += 1
+
+        db.session.commit()
+        logger.info("Lote despachado: %s", dict(resumo))
+        return resumo
+
+    def despachar_pendentes(self, deve_parar=None):
+        """Despacha lotes até não haver mais mensagens vencidas"""
+        total = {'enviados': 0, 'reagendados': 0, 'falhas_definitivas': 0}
+        while not (deve_parar and deve_parar()):
+            resumo = self.despachar_lote()
+            for chave, valor in resumo.items():
+                total[chave] += valor
+            if not any(resumo.values()):
+                break
+        return total
+
+    def despertar(self):
+        """Acorda a thread de fundo para despachar imediatamente"""
+        self._despertar.set()
+
+    def iniciar_thread(self, app):
+        """Inicia o despacho contínuo em uma thread de fundo"""
+        def loop():
+            while not self._parar.is_set():
+                try:
+                    with app.app_context():
+                        self.despachar_pendentes(deve_parar=self._parar.is_set)
+                except Exception as e:
+                    logger.error("ERRO no despacho: %s", e)
+                self._despertar.wait(config.OUTBOX_INTERVALO_SEGUNDOS)
+                self._despertar.clear()
+
+        self._thread = threading.Thread(target=loop, name='outbox-dispatcher', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def parar(self, timeout=30):
+        """Para a thread de fundo, deixando terminar o lote em andamento"""
+        self._parar.set()
+        self._despertar.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,236 @@
+"""
+Perfilamento de requisições sob demanda (apenas administradores)
+Um admin pede o perfil de uma requisição com `?_perfil=1` ou com o header
+`X-Perfil: 1`. A requisição roda sob o cProfile e cada SQL executado é
+anotado com o instante e a duração; no fim são gravados em PERFIL_PASTA:
+- <id>.prof: estatísticas do cProfile (abre com `python -m pstats`,
+  snakeviz ou, convertido, no speedscope)
+- <id>.json: rota, usuário, status, duração e a linha do tempo dos SQLs
+
+Sem o parâmetro nada é ligado: os ouvintes de SQL só são registrados no
+primeiro perfil pedido e o cProfile só roda na requisição perfilada.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from datetime import datetime
+import config
+from services import medidor_sql
+
+PARAMETRO = '_perfil'
+HEADER = 'X-Perfil'
+
+# Um perfil por vez: o cProfile de uma requisição não deve somar chamadas de outra
+_lock_perfil = threading.Lock()
+_sql_atual = contextvars.ContextVar('perfil_sql_atual', default=None)
+_engines_instrumentados = set()
+_engines_lock = threading.Lock()
+
+
+def pedido_na_requisicao(request):
+    """True se a requisição pediu perfil (parâmetro ou header)"""
+    return (request.args.get(PARAMETRO) or request.headers.get(HEADER, '')) not in ('', '0')
+
+
+def _instrumentar_banco(engine):
+    """Anota os SQLs da requisição perfilada (registrado só no primeiro perfil)"""
+    with _engines_lock:
+        if id(engine) in _engines_instrumentados:
+            return
+        _engines_instrumentados.add(id(engine))
+    medidor_sql.registrar(engine, _AnotadorSQL())
+
+
+class _AnotadorSQL(medidor_sql.ObservadorSQL):
+    """Anota na coleta da requisição perfilada os SQLs que ela executou"""
+
+    def iniciar(self, sql):
+        return _sql_atual.get()
+
+    def terminar(self, sql, coleta):
+        self._anotar(sql, coleta, sql.cursor.rowcount)
+
+    def falhar(self, sql, coleta, contexto):
+        if sql is not None:
+            self._anotar(sql, coleta, None, erro=str(contexto.original_exception))
+
+    def _anotar(self, sql, coleta, linhas, erro=None):
+        if coleta is None:
+            return
+        anotacao = {
+            'inicio_ms': round((sql.inicio - coleta.inicio) * 1000, 3),
+            'duracao_ms': round(sql.duracao * 1000, 3),
+            'sql': sql.statement,
+            'parametros': repr(sql.parameters)[:500],
+            'executemany': sql.executemany,
+            'linhas': linhas,
+        }
+        if erro is not None:
+            anotacao['erro'] = erro
+        coleta.append(anotacao)
+
+
+class _ColetaSQL(list):
+    """Lista de SQLs de uma requisição, com o instante de início do perfil"""
+
+    def __init__(self):
+        super().__init__()
+        self.inicio = time.perf_counter()
+
+
+class Perfil:
+    """Um perfil em andamento: cProfile + linha do tempo de SQL"""
+
+    def __init__(self, metodo, rota, usuario):
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.metodo = metodo
+        self.rota = rota
+        self.usuario = usuario
+        self.criado_em = datetime.now()
+        self.sql = _ColetaSQL()
+        self._token = _sql_atual.set(self.sql)
+        self._profiler = cProfile.Profile()
+        self._inicio = time.perf_counter()
+        self._profiler.enable()
+
+    def parar(self):
+        """Desliga o profiler e a coleta de SQL (idempotente)"""
+        if self._profiler is None:
+            return
+        self._profiler.disable()
+        self.duracao = time.perf_counter() - self._inicio
+        try:
+            _sql_atual.reset(self._token)
+        except ValueError:
+            _sql_atual.set(None)
+
+    def salvar(self, status):
+        """Grava <id>.prof e <id>.json em PERFIL_PASTA e devolve o id"""
+        self.parar()
+        os.makedirs(config.PERFIL_PASTA, exist_ok=True)
+        self._profiler.dump_stats(os.path.join(config.PERFIL_PASTA, f'{self.id}.prof'))
+        self._profiler = None
+
+        tempo_sql = sum(item['duracao_ms'] for item in self.sql)
+        dados = {
+            'id': self.id,
+            'criado_em': self.criado_em.isoformat(timespec='seconds'),
+            'metodo': self.metodo,
+            'rota': self.rota,
+            'usuario': self.usuario,
+            'status': status,
+            'duracao_ms': round(self.duracao * 1000, 3),
+            'total_sql': len(self.sql),
+            'tempo_sql_ms': round(tempo_sql, 3),
+            'sql': list(self.sql),
+        }
+        with open(os.path.join(config.PERFIL_PASTA, f'{self.id}.json'), 'w', encoding='utf-8') as arquivo:
+            json.dump(dados, arquivo, ensure_ascii=False, indent=1)
+        _limpar_antigos()
+        return self.id
+
+
+def _limpar_antigos():
+    """Mantém só os PERFIL_MAX_ARQUIVOS perfis mais recentes"""
+    perfis = listar()
+    for perfil in perfis[config.PERFIL_MAX_ARQUIVOS:]:
+        for extensao in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(config.PERFIL_PASTA, perfil['id'] + extensao))
+            except FileNotFoundError:
+                pass
+
+
+def listar():
+    """Resumo dos perfis gravados, do mais recente para o mais antigo"""
+    if not os.path.isdir(config.PERFIL_PASTA):
+        return []
+    perfis = []
+    for nome in sorted(os.listdir(config.PERFIL_PASTA), reverse=True):
+        if not nome.endswith('.json'):
+            continue
+        dados = carregar(nome[:-len('.json')])
+        if dados:
+            dados.pop('sql', None)
+            perfis.append(dados)
+    return perfis
+
+
+def caminho(perfil_id, extensao):
+    """Caminho de um artefato (None se o id for inválido ou o arquivo não existir)"""
+    if not perfil_id or os.path.basename(perfil_id) != perfil_id or extensao not in ('.prof', '.json'):
+        return None
+    arquivo = os.path.join(config.PERFIL_PASTA, perfil_id + extensao)
+    return arquivo if os.path.isfile(arquivo) else None
+
+
+def carregar(perfil_id):
+    """Metadados e linha do tempo de SQL de um perfil"""
+    arquivo = caminho(perfil_id, '.json')
+    if not arquivo:
+        return None
+    try:
+        with open(arquivo, encoding='utf-8') as entrada:
+            return json.load(entrada)
+    except (OSError, ValueError):
+        return None
+
+
+def funcoes_mais_caras(perfil_id, limite=40, ordem='cumulative'):
+    """Saída do pstats (top funções) de um perfil, como texto"""
+    arquivo = caminho(perfil_id, '.prof')
+    if not arquivo:
+        return ''
+    saida = io.StringIO()
+    estatisticas = pstats.Stats(arquivo, stream=saida)
+    estatisticas.strip_dirs().sort_stats(ordem).print_stats(limite)
+    return saida.getvalue()
+
+
+def instrumentar_flask(app, engine_factory):
+    """
+    Liga o perfil nas requisições de admins que pedirem `?_perfil=1` ou
+    `X-Perfil: 1`. O id do perfil volta no header X-Perfil-Id.
+    """
+    from flask import g, request
+    from flask_login import current_user
+
+    @app.before_request
+    def _perfil_inicio():
+        if not config.PERFIL_ATIVO or not pedido_na_requisicao(request):
+            return
+        if not (current_user.is_authenticated and current_user.is_admin()):
+            return
+        if not _lock_perfil.acquire(blocking=False):
+            g._perfil_ocupado = True
+            return
+        _instrumentar_banco(engine_factory())
+        g._perfil = Perfil(request.method, request.full_path.rstrip('?'), current_user.username)
+
+    @app.after_request
+    def _perfil_fim(response):
+        perfil = g.pop('_perfil', None)
+        if perfil is not None:
+            try:
+                response.headers['X-Perfil-Id'] = perfil.salvar(response.status_code)
+            finally:
+                _lock_perfil.release()
+        elif g.pop('_perfil_ocupado', False):
+            response.headers['X-Perfil-Id'] = 'ocupado'
+        return response
+
+    @app.teardown_request
+    def _perfil_erro(erro=None):
+        # after_request não roda quando a view estoura uma exceção
+        perfil = g.pop('_perfil', None)
+        if perfil is not None:
+            try:
+                perfil.salvar(500)
+            finally:
+                _lock_perfil.release()
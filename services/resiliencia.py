@@ -0,0 +1,165 @@
+"""
+Resiliência nas chamadas à API externa
+Políticas de retentativa com backoff exponencial e circuit breaker
+"""
+import random
+import threading
+import time
+import requests
+import config
+
+
+class APIError(Exception):
+    """Erro em uma chamada à API externa"""
+
+    def __init__(self, mensagem, status_code=None, transiente=False):
+        super().__init__(mensagem)
+        self.status_code = status_code
+        self.transiente = transiente
+
+
+class APIIndisponivelError(APIError):
+    """Circuito aberto: a API está fora e a chamada nem foi feita"""
+
+    def __init__(self, mensagem, retomar_em=None):
+        super().__init__(mensagem, transiente=True)
+        self.retomar_em = retomar_em
+
+
+def conexao_nao_estabelecida(erro):
+    """
+    True se a requisição com certeza não chegou ao servidor
+    (timeout de conexão, recusa, DNS), o que torna seguro repetir até um POST
+    """
+    if isinstance(erro, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(erro, requests.exceptions.ConnectionError):
+        causa = erro.args[0] if erro.args else None
+        motivo = getattr(causa, 'reason', None)
+        return type(motivo).__name__ in ('NewConnectionError', 'NameResolutionError')
+    return False
+
+
+class PoliticaRetry:
+    """
+    Quantas vezes e em quais erros repetir uma chamada
+
+    Args:
+        tentativas (int): total de tentativas (1 = sem retentativa)
+        idempotente (bool): se False, só repete quando a requisição comprovadamente
+            não saiu (ver `conexao_nao_estabelecida`)
+    """
+
+    def __init__(self, tentativas, idempotente=True, backoff_base=None, backoff_max=None):
+        self.tentativas = max(1, tentativas)
+        self.idempotente = idempotente
+        self.backoff_base = backoff_base if backoff_base is not None else config.API_RETRY_BACKOFF_BASE
+        self.backoff_max = backoff_max if backoff_max is not None else config.API_RETRY_BACKOFF_MAX
+
+    def pode_repetir(self, erro, tentativa):
+        if tentativa >= self.tentativas:
+            return False
+        if conexao_nao_estabelecida(erro):
+            return True
+        if not self.idempotente:
+            return False
+        if isinstance(erro, APIError):
+            return erro.transiente
+        return isinstance(erro, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+    def espera(self, tentativa):
+        """Backoff exponencial com jitter completo"""
+        teto = min(self.backoff_max, self.backoff_base * (2 ** (tentativa - 1)))
+        return random.uniform(0, teto)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker compartilhado entre threads
+
+    - fechado: chamadas passam normalmente
+    - aberto: após `limite_falhas` falhas seguidas, chamadas falham na hora
+      durante `tempo_aberto` segundos
+    - meio_aberto: passado esse tempo, uma chamada de teste é liberada; sucesso
+      fecha o circuito, falha abre de novo. Quem recebe a chamada de teste
+      sempre a devolve com `liberar_teste` (ex.: 429 ou exceção inesperada,
+      que não contam nem como sucesso nem como falha)
+    """
+
+    def __init__(self, nome, limite_falhas=None, tempo_aberto=None):
+        self.nome = nome
+        self.limite_falhas = limite_falhas or config.API_CIRCUITO_LIMITE_FALHAS
+        self.tempo_aberto = tempo_aberto or config.API_CIRCUITO_ABERTO_SEGUNDOS
+        self._lock = threading.Lock()
+        self._estado = 'fechado'
+        self._falhas_seguidas = 0
+        self._aberto_em = None
+        self._teste_em_andamento = False
+        self.vezes_aberto = 0
+        self.chamadas_rejeitadas = 0
+
+    def permitir(self):
+        """
+        Returns:
+            bool: True se esta é a chamada de teste do estado meio_aberto
+
+        Raises:
+            APIIndisponivelError: se o circuito estiver aberto
+        """
+        with self._lock:
+            if self._estado == 'fechado':
+                return False
+            restante = self._aberto_em + self.tempo_aberto - time.monotonic()
+            if self._estado == 'aberto' and restante <= 0:
+                self._estado = 'meio_aberto'
+            if self._estado == 'meio_aberto' and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            self.chamadas_rejeitadas += 1
+            raise APIIndisponivelError(
+                f"API indisponivel (circuito {self.nome} aberto)",
+                retomar_em=max(0, restante)
+            )
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self._estado = 'fechado'
+            self._falhas_seguidas = 0
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self._falhas_seguidas += 1
+            self._teste_em_andamento = False
+            if self._estado == 'meio_aberto' or self._falhas_seguidas >= self.limite_falhas:
+                if self._estado != 'aberto':
+                    self.vezes_aberto += 1
+                self._estado = 'aberto'
+                self._aberto_em = time.monotonic()
+
+    def liberar_teste(self):
+        """Devolve a chamada de teste sem resultado: a próxima chamada testa de novo"""
+        with self._lock:
+            self._teste_em_andamento = False
+
+    def estado(self):
+        with self._lock:
+            return {
+                'nome': self.nome,
+                'estado': self._estado,
+                'falhas_seguidas': self._falhas_seguidas,
+                'vezes_aberto': self.vezes_aberto,
+                'chamadas_rejeitadas': self.chamadas_rejeitadas
+            }
+
+
+_circuitos = {}
+_circuitos_lock = threading.Lock()
+
+
+def obter_circuito(nome):
+    """Circuit breaker do processo para `nome` (ex.: a URL base da API)"""
+    with _circuitos_lock:
+        if nome not in _circuitos:
+            _circuitos[nome] = CircuitBreaker(nome)
+        return _circuitos[nome]
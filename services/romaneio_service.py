@@ -2,9 +2,21 @@
 Serviço de lógica de negócio para Romaneios
 """
 from datetime import datetime
+from sqlalchemy import select, update, insert, func, case, and_
 from services.api_client import RomaneioAPIClient
+from services.outbox_dispatcher import payload_insercao
+from services import alteracoes as feed_alteracoes
 import config
 
+# Itens fictícios dos romaneios criados no modo teste
+_ITENS_TESTE = (("01.000001", "PRODUTO TESTE A", 100),
+                ("01.000002", "PRODUTO TESTE B", 50))
+
+
+def _padrao(valor, padrao):
+    return padrao if valor is None else valor
+
+
 class RomaneioService:
     """
     Serviço para gerenciar romaneios
@@ -17,10 +29,17 @@ class RomaneioService:
                        apos_recebimento=None, programado=None, inserir_como_parcial=None,
                        observacoes=None):
         """
-        Cria um novo romaneio e chama a API externa para inserir
+        Cria um novo romaneio pendente e agenda a inserção na API externa
+        
+        O romaneio é gravado na hora; a inserção na API e a busca dos itens
+        vão para o outbox (mesmo commit) e rodam em segundo plano, com
+        retentativas. No modo teste recebe IDRO e itens fictícios.
+        
+        Returns:
+            tuple: (romaneio, None) ou (None, mensagem de erro)
         """
         # Importar aqui para evitar importação circular
-        from app import db, Romaneio, RomaneioLog
+        from app import db, Romaneio
         
         try:
             # Verificar se já existe
@@ -32,72 +51,122 @@ class RomaneioService:
             if len(chave_acesso) != 44:
                 return None, "Chave de acesso deve ter 44 dígitos"
             
-            # Usar valores padrão se não fornecidos
-            if apos_recebimento is None:
-                apos_recebimento = config.API_APOS_RECEBIMENTO
-            if programado is None:
-                programado = config.API_PROGRAMADO
-            if inserir_como_parcial is None:
-                inserir_como_parcial = config.API_INSERIR_PARCIAL_SE_EXISTIR
-            
-            # Criar romaneio no banco
-            romaneio = Romaneio(
-                pedido_compra=pedido_compra,
-                nota_fiscal=nota_fiscal,
-                chave_acesso=chave_acesso,
-                created_by=user_id,
-                status='P',  # Pendente
-                tentativas_contagem=0,
-                apos_recebimento=apos_recebimento,
-                programado=programado,
-                inserir_como_parcial=inserir_como_parcial,
-                observacoes=observacoes
-            )
-            
-            # Se não for modo teste, chamar API para inserir
-            if not config.MODO_TESTE:
-                try:
-                    resultado_api = self.api_client.inserir_romaneio(
-                        pedido_compra=pedido_compra,
-                        nota_fiscal=nota_fiscal,
-                        chave_acesso=chave_acesso,
-                        apos_recebimento=apos_recebimento,
-                        programado=programado,
-                        inserir_como_parcial=inserir_como_parcial
-                    )
-                    
-                    # Extrair IDRO da resposta se disponível
-                    if isinstance(resultado_api, dict) and 'idro' in resultado_api:
-                        romaneio.idro = resultado_api['idro']
-                    
-                except Exception as e:
-                    return None, f"Erro ao chamar API externa: {str(e)}"
-            else:
-                # Modo teste: usar IDRO fictício
-                romaneio.idro = 999999
-            
-            # Salvar no banco
-            db.session.add(romaneio)
-            db.session.flush()  # Garante que temos o ID antes de criar o log
-            
-            # Criar log de criação
-            log = RomaneioLog(
-                romaneio_id=romaneio.id,
-                acao='criado',
-                status_novo='P',
-                detalhes=f'Romaneio criado {"[MODO TESTE]" if config.MODO_TESTE else ""}',
-                user_id=user_id
-            )
-            db.session.add(log)
-            
+            ids = self.criar_romaneios_em_massa([{
+                'pedido_compra': pedido_compra,
+                'nota_fiscal': nota_fiscal,
+                'chave_acesso': chave_acesso,
+                'apos_recebimento': apos_recebimento,
+                'programado': programado,
+                'inserir_como_parcial': inserir_como_parcial,
+                'observacoes': observacoes,
+            }], user_id)
             db.session.commit()
             
-            return romaneio, None
+            return db.session.get(Romaneio, ids[0]), None
             
         except Exception as e:
             db.session.rollback()
             return None, f"Erro ao criar romaneio: {str(e)}"
     
+    def criar_romaneios_em_massa(self, linhas, user_id, origem='Romaneio criado'):
+        """
+        Grava romaneios pendentes na transação atual, sem commit
+        
+        Um executemany por tabela: romaneios, RomaneioLog 'criado', feed de
+        alterações e as mensagens inserir_romaneio do outbox (no modo teste,
+        IDRO 999999 e itens fictícios no lugar do outbox). Não confere pedidos
+        já cadastrados nem a chave de acesso: o chamador valida antes.
+        
+        Args:
+            linhas (list): dicts com pedido_compra, nota_fiscal, chave_acesso e,
+                opcionais, observacoes, apos_recebimento, programado e
+                inserir_como_parcial (None = padrão do config)
+            origem (str): início do texto do RomaneioLog
+        
+        Returns:
+            list: ids dos romaneios, na ordem das linhas
+        """
+        from app import db, Romaneio, RomaneioItem, RomaneioLog, ApiOutbox
+        
+        if not linhas:
+            return []
+        
+        agora = datetime.utcnow()
+        romaneios = [{
+            'pedido_compra': linha['pedido_compra'],
+            'nota_fiscal': linha['nota_fiscal'],
+            'chave_acesso': linha['chave_acesso'],
+            'observacoes': linha.get('observacoes') or None,
+            'idro': 999999 if config.MODO_TESTE else None,
+            'status': 'P',  # Pendente
+            'tentativas_contagem': 0,
+            'created_by': user_id,
+            'created_at': agora,
+            'updated_at': agora,
+            'apos_recebimento': _padrao(linha.get('apos_recebimento'), config.API_APOS_RECEBIMENTO),
+            'programado': _padrao(linha.get('programado'), config.API_PROGRAMADO),
+            'inserir_como_parcial': _padrao(linha.get('inserir_como_parcial'),
+                                            config.API_INSERIR_PARCIAL_SE_EXISTIR),
+        } for linha in linhas]
+        
+        ids = db.session.execute(
+            insert(Romaneio).returning(Romaneio.id, sort_by_parameter_order=True), romaneios
+        ).scalars().all()
+        
+        detalhes = f'{origem} {"[MODO TESTE]" if config.MODO_TESTE else "(inserção na API agendada)"}'
+        db.session.execute(insert(RomaneioLog), [{
+            'romaneio_id': romaneio_id,
+            'timestamp': agora,
+            'acao': 'criado',
+            'status_novo': 'P',
+            'detalhes': detalhes,
+            'user_id': user_id,
+        } for romaneio_id in ids])
+        
+        # Insert em massa não passa pelo flush: o feed de alterações é gravado aqui
+        linhas_feed = [
+            feed_alteracoes.alteracao(feed_alteracoes.ROMANEIO, romaneio_id, romaneio['pedido_compra'],
+                                      'criado', None, 'P', registrado_em=agora)
+            for romaneio_id, romaneio in zip(ids, romaneios)
+        ]
+        
+        if config.MODO_TESTE:
+            # Modo teste: itens fictícios, a API não é chamada
+            itens = [{
+                'romaneio_id': romaneio_id,
+                'codigo': codigo,
+                'descricao': descricao,
+                'quantidade_nf': quantidade,
+                'quantidade_contada': quantidade,
+                'created_at': agora,
+                'updated_at': agora,
+            } for romaneio_id in ids for codigo, descricao, quantidade in _ITENS_TESTE]
+            itens_ids = db.session.execute(
+                insert(RomaneioItem).returning(RomaneioItem.id, sort_by_parameter_order=True), itens
+            ).scalars().all()
+            pedidos = dict(zip(ids, (romaneio['pedido_compra'] for romaneio in romaneios)))
+            linhas_feed.extend(
+                feed_alteracoes.alteracao(feed_alteracoes.ITEM, item['romaneio_id'], pedidos[item['romaneio_id']],
+                                          campo, None, item[campo], item_id=item_id, codigo=item['codigo'],
+                                          registrado_em=agora)
+                for item_id, item in zip(itens_ids, itens) for campo in feed_alteracoes.CAMPOS_ITEM
+            )
+        else:
+            db.session.execute(insert(ApiOutbox), [{
+                'operacao': 'inserir_romaneio',
+                'romaneio_id': romaneio_id,
+                'payload': payload_insercao(romaneio['pedido_compra'], romaneio['nota_fiscal'],
+                                            romaneio['chave_acesso'], romaneio['apos_recebimento'],
+                                            romaneio['programado'], romaneio['inserir_como_parcial']),
+                'estado': 'pendente',
+                'tentativas': 0,
+                'proxima_tentativa_em': agora,
+                'criado_em': agora,
+            } for romaneio_id, romaneio in zip(ids, romaneios)])
+        
+        feed_alteracoes.registrar(db.session, linhas_feed)
+        return ids
+    
     def listar_romaneios(self, status=None, pedido=None, nf=None, page=1, per_page=10):
         """
         Lista romaneios com filtros e paginação
@@ -139,8 +208,11 @@ class RomaneioService:
             if not romaneio.pode_excluir():
                 return False, "Apenas romaneios pendentes sem tentativas podem ser excluídos"
             
+            pedido_compra = romaneio.pedido_compra
             db.session.delete(romaneio)
             db.session.commit()
+            # Um romaneio novo com o mesmo pedido não pode herdar os validadores (em disco)
+            self.api_client.esquecer_validadores(pedido_compra)
             
             return True, "Romaneio excluído com sucesso"
             
@@ -160,7 +232,7 @@ class RomaneioService:
             if not romaneio:
                 return False, "Romaneio não encontrado"
             
-            if novo_status not in config.STATUS_CHOICES:
+            if not isinstance(novo_status, str) or novo_status not in config.STATUS_CHOICES:
                 return False, f"Status inválido: {novo_status}"
             
             status_anterior = romaneio.status
@@ -179,6 +251,8 @@ class RomaneioService:
             db.session.add(log)
             
             db.session.commit()
+            # Status mudado à mão: a próxima verificação baixa o romaneio inteiro
+            self.api_client.esquecer_validadores(romaneio.pedido_compra)
             
             return True, f"Status atualizado para {config.STATUS_CHOICES[novo_status]}"
             
@@ -186,6 +260,159 @@ class RomaneioService:
             db.session.rollback()
             return False, f"Erro ao atualizar status: {str(e)}"
     
+    def listar_compacto(self, ids=None, status=None, pedido=None, nf=None, atualizado_desde=None,
+                        apos=0, limite=100, incluir_itens=False):
+        """
+        Página compacta de romaneios para integrações (GET /api/romaneios)
+        
+        Lê só as colunas (sem montar objetos nem carregar itens por romaneio):
+        uma consulta para a página, uma agregada para os totais de itens e,
+        com incluir_itens, uma para os itens de toda a página. Paginação por
+        cursor: `apos` é o último id da página anterior.
+        
+        Returns:
+            tuple: (lista de dicts, cursor da próxima página ou None)
+        """
+        from app import db, Romaneio, RomaneioItem
+        
+        consulta = select(
+            Romaneio.id, Romaneio.pedido_compra, Romaneio.nota_fiscal, Romaneio.chave_acesso,
+            Romaneio.idro, Romaneio.status, Romaneio.tentativas_contagem, Romaneio.observacoes,
+            Romaneio.created_by, Romaneio.created_at, Romaneio.updated_at
+        ).where(Romaneio.id > apos)
+        if ids is not None:
+            consulta = consulta.where(Romaneio.id.in_(ids))
+        if status:
+            consulta = consulta.where(Romaneio.status == status)
+        if pedido:
+            consulta = consulta.where(Romaneio.pedido_compra.contains(pedido))
+        if nf:
+            consulta = consulta.where(Romaneio.nota_fiscal.contains(nf))
+        if atualizado_desde:
+            consulta = consulta.where(Romaneio.updated_at >= atualizado_desde)
+        
+        # Uma linha a mais indica se existe próxima página
+        linhas = db.session.execute(consulta.order_by(Romaneio.id).limit(limite + 1)).mappings().all()
+        proximo = linhas[limite - 1]['id'] if len(linhas) > limite else None
+        linhas = linhas[:limite]
+        pagina_ids = [linha['id'] for linha in linhas]
+        
+        totais = {}
+        itens = {}
+        if pagina_ids:
+            # Mesma regra de RomaneioItem.tem_divergencia()
+            divergente = case((and_(RomaneioItem.quantidade_contada.isnot(None),
+                                    RomaneioItem.quantidade_contada != RomaneioItem.quantidade_nf), 1), else_=0)
+            totais = {romaneio_id: (total, divergentes) for romaneio_id, total, divergentes in db.session.execute(
+                select(RomaneioItem.romaneio_id, func.count(), func.sum(divergente))
+                .where(RomaneioItem.romaneio_id.in_(pagina_ids))
+                .group_by(RomaneioItem.romaneio_id)
+            )}
+            if incluir_itens:
+                for item in db.session.execute(
+                    select(RomaneioItem.romaneio_id, RomaneioItem.codigo, RomaneioItem.descricao,
+                           RomaneioItem.quantidade_nf, RomaneioItem.quantidade_contada)
+                    .where(RomaneioItem.romaneio_id.in_(pagina_ids))
+                    .order_by(RomaneioItem.romaneio_id, RomaneioItem.id)
+                ).mappings():
+                    item = dict(item)
+                    itens.setdefault(item.pop('romaneio_id'), []).append(item)
+        
+        romaneios = []
+        for linha in linhas:
+            dados = dict(linha)
+            dados['created_at'] = linha['created_at'].isoformat() if linha['created_at'] else None
+            dados['updated_at'] = linha['updated_at'].isoformat() if linha['updated_at'] else None
+            dados['total_itens'], dados['itens_divergentes'] = totais.get(linha['id'], (0, 0))
+            if incluir_itens:
+                dados['itens'] = itens.get(linha['id'], [])
+            romaneios.append(dados)
+        return romaneios, proximo
+    
+    def atualizar_status_em_massa(self, alteracoes, user_id):
+        """
+        Atualiza o status de vários romaneios em uma transação (uso administrativo)
+        
+        Tudo ou nada: com um status inválido ou um romaneio inexistente nada é
+        gravado. Romaneios que já estão no status pedido ficam como
+        'sem_alteracao' (sem log). As mudanças e os RomaneioLog vão em dois
+        comandos executemany e um único commit.
+        
+        Args:
+            alteracoes (list): dicts com id, status e observacoes (opcional)
+        
+        Returns:
+            tuple: (resumo com o resultado por romaneio, None) ou (None, mensagem de erro)
+        """
+        from app import db, Romaneio, RomaneioLog
+        
+        # Status vindo do JSON pode ser lista/objeto (não "hashable"): inválido também
+        invalidos = sorted({str(alteracao['status']) for alteracao in alteracoes
+                            if not isinstance(alteracao['status'], str)
+                            or alteracao['status'] not in config.STATUS_CHOICES})
+        if invalidos:
+            return None, f"Status inválido: {', '.join(invalidos)}"
+        
+        ids = [alteracao['id'] for alteracao in alteracoes]
+        if len(set(ids)) != len(ids):
+            return None, "Romaneio repetido na lista"
+        
+        try:
+            atuais = {}
+            pedidos = {}
+            for romaneio_id, status, pedido in db.session.execute(
+                select(Romaneio.id, Romaneio.status, Romaneio.pedido_compra).where(Romaneio.id.in_(ids))
+            ):
+                atuais[romaneio_id] = status
+                pedidos[romaneio_id] = pedido
+            faltando = [romaneio_id for romaneio_id in ids if romaneio_id not in atuais]
+            if faltando:
+                return None, f"Romaneio(s) não encontrado(s): {', '.join(map(str, faltando))}"
+            
+            agora = datetime.utcnow()
+            mudancas = [alteracao for alteracao in alteracoes if atuais[alteracao['id']] != alteracao['status']]
+            if mudancas:
+                db.session.execute(update(Romaneio), [
+                    {'id': alteracao['id'], 'status': alteracao['status'], 'updated_at': agora}
+                    for alteracao in mudancas
+                ])
+                db.session.execute(insert(RomaneioLog), [{
+                    'romaneio_id': alteracao['id'],
+                    'timestamp': agora,
+                    'acao': 'atualizado_manual',
+                    'status_anterior': atuais[alteracao['id']],
+                    'status_novo': alteracao['status'],
+                    'detalhes': alteracao.get('observacoes') or 'Status atualizado manualmente (em massa)',
+                    'user_id': user_id,
+                } for alteracao in mudancas])
+                # Update em massa não passa pelo flush: o feed de alterações é gravado aqui
+                feed_alteracoes.registrar(db.session, [
+                    feed_alteracoes.alteracao(feed_alteracoes.ROMANEIO, alteracao['id'], pedidos[alteracao['id']],
+                                              'status', atuais[alteracao['id']], alteracao['status'],
+                                              registrado_em=agora)
+                    for alteracao in mudancas
+                ])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return None, f"Erro ao atualizar status: {str(e)}"
+        
+        # Status mudados à mão: a próxima verificação de cada um baixa o romaneio inteiro
+        for alteracao in mudancas:
+            self.api_client.esquecer_validadores(pedidos[alteracao['id']])
+        
+        alterados = {alteracao['id'] for alteracao in mudancas}
+        return {
+            'atualizados': len(mudancas),
+            'sem_alteracao': len(alteracoes) - len(mudancas),
+            'resultados': [{
+                'id': alteracao['id'],
+                'status_anterior': atuais[alteracao['id']],
+                'status': alteracao['status'],
+                'resultado': 'atualizado' if alteracao['id'] in alterados else 'sem_alteracao',
+            } for alteracao in alteracoes],
+        }, None
+    
     def get_logs_romaneio(self, romaneio_id):
         """
         Busca o histórico de logs de um romaneio
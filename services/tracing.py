@@ -0,0 +1,373 @@
+"""
+Tracing leve: spans aninhados da requisição Flask, das chamadas à API, de
+cada SQL e das fases do verificador
+Os spans terminados vão para uma fila e uma thread de fundo grava em
+TRACING_ARQUIVO, em lotes, uma linha por lote no formato OTLP/JSON
+(ExportTraceServiceRequest, o mesmo do file exporter do OpenTelemetry
+Collector). `python ver_traces.py` mostra a árvore de um trace.
+
+Uso:
+    with tracing.span('verificador.consultar_api', pedido=pedido) as span:
+        ...
+        span.definir('itens', total)
+
+    @tracing.rastreado('verificador.comparar_quantidades')
+    def _verificar_quantidades(self, romaneio): ...
+
+Com TRACING_ATIVO=False span() devolve um span vazio e nada é registrado.
+"""
+import atexit
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import config
+from services import logs, medidor_sql, metricas
+
+logger = logs.obter_logger('tracing')
+
+# SpanKind do OTLP
+KIND_INTERNO = 1
+KIND_SERVIDOR = 2
+KIND_CLIENTE = 3
+
+STATUS_OK = 1
+STATUS_ERRO = 2
+
+_span_atual = contextvars.ContextVar('span_atual', default=None)
+
+
+class _SpanVazio:
+    """Span que não registra nada (tracing desligado ou trace não amostrado)"""
+    trace_id = None
+    gravando = False
+
+    def definir(self, chave, valor):
+        pass
+
+    def erro(self, mensagem):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traceback):
+        return False
+
+
+_VAZIO = _SpanVazio()
+
+
+class _SpanNaoAmostrado(_SpanVazio):
+    """Marca o contexto de um trace descartado pela amostragem: os filhos também não gravam"""
+
+    def __enter__(self):
+        self._token = _span_atual.set(self)
+        return self
+
+    def __exit__(self, tipo, valor, traceback):
+        _span_atual.reset(self._token)
+        return False
+
+
+class Span:
+    """Um span em andamento; termina no __exit__ ou em terminar()"""
+    gravando = True
+
+    def __init__(self, nome, pai=None, kind=KIND_INTERNO, trace_id=None, pai_id=None, atributos=None):
+        self.nome = nome
+        self.kind = kind
+        self.trace_id = pai.trace_id if pai else (trace_id or secrets.token_hex(16))
+        self.span_id = secrets.token_hex(8)
+        self.pai_id = pai.span_id if pai else pai_id
+        self.atributos = dict(atributos or {})
+        self.status = None
+        self.mensagem_status = None
+        self.inicio_ns = time.time_ns()
+        self.fim_ns = None
+        self._token = None
+
+    def definir(self, chave, valor):
+        self.atributos[chave] = valor
+
+    def erro(self, mensagem):
+        self.status = STATUS_ERRO
+        self.mensagem_status = str(mensagem)[:500]
+
+    def terminar(self):
+        if self.fim_ns is None:
+            self.fim_ns = time.time_ns()
+            _exportador.enviar(self)
+
+    def __enter__(self):
+        self._token = _span_atual.set(self)
+        return self
+
+    def __exit__(self, tipo, valor, traceback):
+        if valor is not None:
+            self.erro(f"{tipo.__name__}: {valor}")
+        _span_atual.reset(self._token)
+        self.terminar()
+        return False
+
+    def para_otlp(self):
+        dados = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.nome,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.inicio_ns),
+            'endTimeUnixNano': str(self.fim_ns),
+            'attributes': [_atributo_otlp(chave, valor) for chave, valor in self.atributos.items() if valor is not None],
+        }
+        if self.pai_id:
+            dados['parentSpanId'] = self.pai_id
+        if self.status:
+            dados['status'] = {'code': self.status}
+            if self.mensagem_status:
+                dados['status']['message'] = self.mensagem_status
+        return dados
+
+
+def _atributo_otlp(chave, valor):
+    if isinstance(valor, bool):
+        return {'key': chave, 'value': {'boolValue': valor}}
+    if isinstance(valor, int):
+        return {'key': chave, 'value': {'intValue': str(valor)}}
+    if isinstance(valor, float):
+        return {'key': chave, 'value': {'doubleValue': valor}}
+    return {'key': chave, 'value': {'stringValue': str(valor)}}
+
+
+# ==================== EXPORTADOR ====================
+
+class ExportadorArquivo:
+    """
+    Grava os spans terminados em JSON lines (OTLP/JSON) por uma thread de
+    fundo; quem termina o span só coloca na fila
+
+    Um lote que não pode ser gravado (disco cheio, permissão) é descartado e
+    contado em rpa_tracing_spans_descartados_total, assim como os spans que
+    chegam com TRACING_FILA_MAX já na fila; se a thread morrer, o próximo
+    span a recria.
+    """
+    TAMANHO_LOTE = 512
+    INTERVALO = 2.0
+
+    def __init__(self):
+        self._fila = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def enviar(self, span):
+        if self._fila.qsize() >= config.TRACING_FILA_MAX:
+            metricas.tracing_spans_descartados_total.inc(motivo='fila_cheia')
+            return
+        self._fila.put(span)
+        if self._thread is None or not self._thread.is_alive():
+            self._iniciar()
+
+    def _iniciar(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name='tracing-exportador', daemon=True)
+                self._thread.start()
+
+    def _executar(self):
+        while True:
+            lote = self._coletar_lote()
+            if lote is None:
+                return
+            if lote:
+                self._gravar(lote)
+
+    def _coletar_lote(self):
+        """Junta spans até TAMANHO_LOTE ou INTERVALO segundos; None = encerrar"""
+        lote = []
+        limite = time.monotonic() + self.INTERVALO
+        while len(lote) < self.TAMANHO_LOTE:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                span = self._fila.get(timeout=restante)
+            except queue.Empty:
+                break
+            if span is None:
+                if lote:
+                    self._gravar(lote)
+                return None
+            lote.append(span)
+        return lote
+
+    def _gravar(self, lote):
+        try:
+            self._gravar_arquivo(lote)
+        except Exception as e:
+            # Tracing nunca derruba nem trava o app: o lote é perdido
+            metricas.tracing_spans_descartados_total.inc(len(lote), motivo='erro_gravacao')
+            logger.warning("%d span(s) descartado(s): %s", len(lote), e)
+
+    def _gravar_arquivo(self, lote):
+        caminho = config.TRACING_ARQUIVO
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        try:
+            if os.path.getsize(caminho) > config.TRACING_ARQUIVO_MAX_MB * 1024 * 1024:
+                os.replace(caminho, caminho + '.1')
+        except OSError:
+            pass
+        registro = {'resourceSpans': [{
+            'resource': {'attributes': [
+                _atributo_otlp('service.name', config.TRACING_SERVICO),
+                _atributo_otlp('process.pid', os.getpid()),
+            ]},
+            'scopeSpans': [{
+                'scope': {'name': 'rpa.tracing'},
+                'spans': [span.para_otlp() for span in lote],
+            }],
+        }]}
+        with open(caminho, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+
+    def encerrar(self, timeout=5):
+        """Grava o que estiver na fila e para a thread"""
+        if self._thread is not None:
+            self._fila.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+
+_exportador = ExportadorArquivo()
+atexit.register(_exportador.encerrar)
+
+
+# ==================== API ====================
+
+def atual():
+    """Span corrente do contexto (None fora de um trace)"""
+    return _span_atual.get()
+
+
+def iniciar(nome, kind=KIND_INTERNO, raiz=False, trace_id=None, pai_id=None, **atributos):
+    """
+    Cria um span filho do span corrente, sem torná-lo o corrente
+    (use `with` para aninhar). Sem span corrente, cria a raiz de um novo trace.
+    """
+    if not config.TRACING_ATIVO:
+        return _VAZIO
+    pai = None if raiz else _span_atual.get()
+    if pai is not None and not pai.gravando:
+        return _SpanNaoAmostrado()
+    if pai is None and random.random() >= config.TRACING_AMOSTRAGEM:
+        return _SpanNaoAmostrado()
+    return Span(nome, pai=pai, kind=kind, trace_id=trace_id, pai_id=pai_id, atributos=atributos)
+
+
+def span(nome, kind=KIND_INTERNO, **atributos):
+    """Span aninhado para usar com `with`"""
+    return iniciar(nome, kind=kind, **atributos)
+
+
+def rastreado(nome):
+    """Decorador: cada chamada da função vira um span"""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            if not config.TRACING_ATIVO:
+                return funcao(*args, **kwargs)
+            with span(nome):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+def encerrar():
+    _exportador.encerrar()
+
+
+# ==================== INSTRUMENTAÇÃO ====================
+
+def _ler_traceparent(valor):
+    """(trace_id, span_id) de um header W3C traceparent, ou (None, None)"""
+    partes = (valor or '').split('-')
+    if len(partes) == 4 and len(partes[1]) == 32 and len(partes[2]) == 16:
+        return partes[1], partes[2]
+    return None, None
+
+
+def instrumentar_flask(app):
+    """Um span raiz por requisição; continua o trace de um header traceparent"""
+    from flask import g, request
+    from services import logs
+
+    @app.before_request
+    def _tracing_inicio():
+        trace_id, pai_id = _ler_traceparent(request.headers.get('traceparent'))
+        rota = request.url_rule.rule if request.url_rule else request.path
+        atual_span = iniciar(
+            f"{request.method} {rota}", kind=KIND_SERVIDOR, raiz=True,
+            trace_id=trace_id, pai_id=pai_id,
+            **{'http.method': request.method, 'http.route': rota, 'http.target': request.full_path.rstrip('?'),
+               'correlacao': logs.id_correlacao.get()}
+        )
+        if atual_span is not _VAZIO:
+            g._span_requisicao = atual_span.__enter__()
+
+    @app.after_request
+    def _tracing_status(response):
+        atual_span = g.get('_span_requisicao')
+        if atual_span is not None and atual_span.gravando:
+            atual_span.definir('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                atual_span.erro(f"HTTP {response.status_code}")
+            response.headers['X-Trace-Id'] = atual_span.trace_id
+        return response
+
+    @app.teardown_request
+    def _tracing_fim(erro=None):
+        atual_span = g.pop('_span_requisicao', None)
+        if atual_span is not None:
+            atual_span.__exit__(type(erro) if erro else None, erro, None)
+
+
+_engines_instrumentados = set()
+
+
+def instrumentar_banco(engine):
+    """Um span por statement SQL, filho do span corrente (uma vez por engine)"""
+    if not (config.TRACING_ATIVO and config.TRACING_SQL) or id(engine) in _engines_instrumentados:
+        return
+    _engines_instrumentados.add(id(engine))
+    medidor_sql.registrar(engine, _SpansSQL())
+
+
+class _SpansSQL(medidor_sql.ObservadorSQL):
+    """Abre o span do statement no início e o encerra no fim ou no erro"""
+
+    def iniciar(self, sql):
+        pai = _span_atual.get()
+        if pai is None or not pai.gravando:
+            return None
+        sql_span = Span(f"SQL {sql.comando}", pai=pai, kind=KIND_CLIENTE,
+                        atributos={'db.system': 'sqlite', 'db.statement': sql.statement[:2000]})
+        if sql.executemany:
+            sql_span.definir('db.executemany', True)
+        return sql_span
+
+    def terminar(self, sql, sql_span):
+        if sql_span is not None:
+            if sql.cursor.rowcount is not None and sql.cursor.rowcount >= 0:
+                sql_span.definir('db.linhas', sql.cursor.rowcount)
+            sql_span.terminar()
+
+    def falhar(self, sql, sql_span, contexto):
+        if sql_span is not None:
+            sql_span.erro(contexto.original_exception)
+            sql_span.terminar()
@@ -0,0 +1,91 @@
+"""
+Trava exclusiva baseada em arquivo
+Impede que dois passes do verificador rodem ao mesmo tempo na mesma máquina
+(ex.: um --once lento do Agendador de Tarefas e o próximo disparo)
+"""
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class TravaOcupadaError(Exception):
+    """A trava já está com outro processo"""
+    pass
+
+
+class TravaArquivo:
+    """
+    Lock exclusivo do sistema operacional sobre um arquivo.
+
+    O lock é liberado automaticamente se o processo morrer, então não há
+    trava "presa" após uma queda.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._arquivo = None
+
+    def _tentar(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self._arquivo.seek(0)
+                msvcrt.locking(self._arquivo.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def adquirir(self, espera_max=0, intervalo=1.0):
+        """
+        Tenta adquirir a trava
+
+        Args:
+            espera_max (float): segundos aguardando a trava (0 = não aguarda)
+
+        Raises:
+            TravaOcupadaError: se a trava continuar ocupada após a espera
+        """
+        pasta = os.path.dirname(self.caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        self._arquivo = open(self.caminho, 'a+')
+
+        limite = time.monotonic() + espera_max
+        while not self._tentar():
+            if time.monotonic() >= limite:
+                self._arquivo.close()
+                self._arquivo = None
+                raise TravaOcupadaError(f"Trava ocupada: {self.caminho}")
+            time.sleep(intervalo)
+
+        # Registra quem está com a trava (apenas informativo)
+        self._arquivo.seek(0)
+        self._arquivo.truncate()
+        self._arquivo.write(f"{os.getpid()}\n")
+        self._arquivo.flush()
+        return self
+
+    def liberar(self):
+        if self._arquivo is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._arquivo.fileno(), fcntl.LOCK_UN)
+            else:
+                self._arquivo.seek(0)
+                msvcrt.locking(self._arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._arquivo.close()
+            self._arquivo = None
+
+    def __enter__(self):
+        return self.adquirir()
+
+    def __exit__(self, *args):
+        self.liberar()
@@ -0,0 +1,292 @@
+"""
+Verificação de vários romaneios de uma vez (lotes) em segundo plano
+A requisição só cria o lote e responde 202; os romaneios são verificados por
+um pool de threads (VERIFICACAO_LOTE_CONCORRENCIA verificações simultâneas,
+somando todos os lotes do processo), cada um com o lease do romaneio como no
+botão "verificar". O progresso e o resultado de cada romaneio ficam no lote,
+consultados por polling ou acompanhados por SSE (text/event-stream).
+
+Os lotes ficam em memória, no processo do Flask: os VERIFICACAO_LOTE_MAX_LOTES
+mais recentes são mantidos e nada sobrevive a um reinício.
+"""
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import select
+from services.outbox_dispatcher import insercao_nao_concluida
+from services.resiliencia import APIIndisponivelError
+from services import logs, tracing
+import config
+
+logger = logs.obter_logger('verificacao_lote')
+
+# Status do resultado de cada romaneio, além dos do VerificadorService
+# (atualizado_aberto, mantido_pendente, max_tentativas, aguardando_contagem, ...)
+NAO_ENCONTRADO = 'nao_encontrado'
+AGUARDANDO_INSERCAO = 'aguardando_insercao'
+API_INDISPONIVEL = 'api_indisponivel'
+CANCELADO = 'cancelado'
+ERRO = 'erro'
+
+# Intervalo dos comentários de keep-alive no SSE
+_INTERVALO_PING = 15
+
+
+class LoteVerificacaoError(Exception):
+    """Lote que não pode ser criado (nenhum romaneio ou romaneios demais)"""
+
+
+def filtro_verificaveis():
+    """Romaneios que podem ser verificados e já foram inseridos na API"""
+    from app import Romaneio
+
+    return [Romaneio.status != 'F',
+            Romaneio.tentativas_contagem < config.MAX_TENTATIVAS_CONTAGEM,
+            ~insercao_nao_concluida(Romaneio.id)]
+
+
+def selecionar_ids(status=None, pedido=None, nf=None):
+    """
+    Ids dos romaneios verificáveis que atendem aos filtros da lista de romaneios
+
+    Raises:
+        LoteVerificacaoError: mais de VERIFICACAO_LOTE_MAX_ROMANEIOS romaneios
+    """
+    from app import db, Romaneio
+
+    consulta = select(Romaneio.id).where(*filtro_verificaveis())
+    if status:
+        consulta = consulta.where(Romaneio.status == status)
+    if pedido:
+        consulta = consulta.where(Romaneio.pedido_compra.contains(pedido))
+    if nf:
+        consulta = consulta.where(Romaneio.nota_fiscal.contains(nf))
+    ids = db.session.execute(
+        consulta.order_by(Romaneio.id).limit(config.VERIFICACAO_LOTE_MAX_ROMANEIOS + 1)
+    ).scalars().all()
+    if len(ids) > config.VERIFICACAO_LOTE_MAX_ROMANEIOS:
+        raise LoteVerificacaoError(f"O filtro seleciona mais de {config.VERIFICACAO_LOTE_MAX_ROMANEIOS} romaneios "
+                                   f"(VERIFICACAO_LOTE_MAX_ROMANEIOS); refine os filtros")
+    return ids
+
+
+class LoteVerificacao:
+    """
+    Um lote em andamento ou concluído
+
+    `resultados` fica na ordem em que os romaneios terminaram; a posição
+    (1, 2, ...) é o id do evento no SSE e o `desde` do polling.
+    """
+
+    def __init__(self, romaneio_ids, usuario_id):
+        self.id = uuid.uuid4().hex[:12]
+        self.romaneio_ids = romaneio_ids
+        self.usuario_id = usuario_id
+        self.criado_em = datetime.utcnow()
+        self.fim = None
+        self.estado = 'executando'  # executando, concluido, cancelado
+        self.motivo_cancelamento = None
+        self.resultados = []
+        self.contagem = {}
+        self._mudou = threading.Condition()
+
+    @property
+    def total(self):
+        return len(self.romaneio_ids)
+
+    @property
+    def terminado(self):
+        return self.estado != 'executando'
+
+    @property
+    def cancelado(self):
+        return self.motivo_cancelamento is not None
+
+    def cancelar(self, motivo):
+        """Os romaneios ainda não iniciados terminam como 'cancelado'"""
+        with self._mudou:
+            if self.motivo_cancelamento is None and not self.terminado:
+                self.motivo_cancelamento = motivo
+
+    def registrar(self, resultado):
+        with self._mudou:
+            self.resultados.append(resultado)
+            self.contagem[resultado['status']] = self.contagem.get(resultado['status'], 0) + 1
+            if len(self.resultados) == self.total:
+                self.estado = 'cancelado' if self.cancelado else 'concluido'
+                self.fim = datetime.utcnow()
+            self._mudou.notify_all()
+
+    def aguardar(self, desde, timeout):
+        """Espera um resultado além da posição `desde` (ou o fim do lote); True se houver novidade"""
+        with self._mudou:
+            return self._mudou.wait_for(lambda: len(self.resultados) > desde or self.terminado, timeout)
+
+    def progresso(self):
+        with self._mudou:
+            processados = len(self.resultados)
+            return {
+                'lote_id': self.id,
+                'estado': self.estado,
+                'total': self.total,
+                'processados': processados,
+                'percentual': round(100 * processados / self.total, 1) if self.total else 100.0,
+                'contagem': dict(self.contagem),
+                'motivo_cancelamento': self.motivo_cancelamento,
+                'criado_em': self.criado_em.isoformat(),
+                'fim': self.fim.isoformat() if self.fim else None,
+                'duracao': round(((self.fim or datetime.utcnow()) - self.criado_em).total_seconds(), 2),
+            }
+
+    def to_dict(self, desde=0):
+        """Progresso e os resultados a partir da posição `desde`"""
+        dados = self.progresso()
+        with self._mudou:
+            dados['desde'] = desde
+            dados['resultados'] = self.resultados[desde:]
+        return dados
+
+    def eventos_sse(self, desde=0):
+        """
+        Gera o stream SSE: um evento 'resultado' por romaneio (id = posição),
+        'progresso' a cada novidade e 'fim' quando o lote termina
+        """
+        enviados = desde
+        yield f"retry: 3000\nevent: progresso\ndata: {json.dumps(self.progresso())}\n\n"
+        while True:
+            if not self.aguardar(enviados, _INTERVALO_PING):
+                yield ": ping\n\n"
+                continue
+            with self._mudou:
+                novos = self.resultados[enviados:]
+                terminado = self.terminado
+            for posicao, resultado in enumerate(novos, start=enviados + 1):
+                yield f"id: {posicao}\nevent: resultado\ndata: {json.dumps(resultado, ensure_ascii=False)}\n\n"
+            enviados += len(novos)
+            if novos:
+                yield f"event: progresso\ndata: {json.dumps(self.progresso())}\n\n"
+            if terminado and enviados >= len(self.resultados):
+                yield f"event: fim\ndata: {json.dumps(self.progresso())}\n\n"
+                return
+
+
+class GerenciadorLotes:
+    """
+    Cria os lotes e os executa em um pool de threads compartilhado
+
+    Cada thread usa o seu próprio VerificadorService (cliente HTTP e worker_id
+    próprios) e uma sessão do banco por romaneio (um app_context por tarefa).
+    """
+
+    def __init__(self, app, concorrencia=None):
+        self.app = app
+        self.concorrencia = concorrencia or config.VERIFICACAO_LOTE_CONCORRENCIA
+        self._executor = ThreadPoolExecutor(max_workers=self.concorrencia,
+                                            thread_name_prefix='verificacao-lote')
+        self._lotes = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def criar(self, romaneio_ids, usuario_id):
+        """
+        Cria o lote e agenda a verificação de cada romaneio
+
+        Raises:
+            LoteVerificacaoError: lista vazia ou acima de VERIFICACAO_LOTE_MAX_ROMANEIOS
+        """
+        romaneio_ids = list(dict.fromkeys(romaneio_ids))
+        if not romaneio_ids:
+            raise LoteVerificacaoError("Nenhum romaneio para verificar")
+        if len(romaneio_ids) > config.VERIFICACAO_LOTE_MAX_ROMANEIOS:
+            raise LoteVerificacaoError(f"Máximo de {config.VERIFICACAO_LOTE_MAX_ROMANEIOS} romaneios por lote "
+                                       f"(VERIFICACAO_LOTE_MAX_ROMANEIOS)")
+
+        lote = LoteVerificacao(romaneio_ids, usuario_id)
+        with self._lock:
+            self._lotes[lote.id] = lote
+            self._descartar_antigos()
+        logger.info("Lote %s criado com %d romaneio(s)", lote.id, lote.total,
+                    extra={'lote': lote.id, 'total': lote.total, 'usuario_id': usuario_id})
+        for romaneio_id in romaneio_ids:
+            self._executor.submit(self._executar, lote, romaneio_id)
+        return lote
+
+    def obter(self, lote_id):
+        with self._lock:
+            return self._lotes.get(lote_id)
+
+    def listar(self):
+        with self._lock:
+            return list(reversed(self._lotes.values()))
+
+    def _descartar_antigos(self):
+        """Mantém os VERIFICACAO_LOTE_MAX_LOTES lotes mais recentes (nunca descarta um em andamento)"""
+        excedentes = len(self._lotes) - config.VERIFICACAO_LOTE_MAX_LOTES
+        for lote_id in [lote_id for lote_id, lote in self._lotes.items() if lote.terminado][:max(0, excedentes)]:
+            del self._lotes[lote_id]
+
+    def _verificador(self):
+        from services.verificador_service import VerificadorService
+
+        if not hasattr(self._local, 'verificador'):
+            self._local.verificador = VerificadorService()
+        return self._local.verificador
+
+    def _executar(self, lote, romaneio_id):
+        resultado = {'romaneio_id': romaneio_id, 'pedido_compra': None, 'status': CANCELADO,
+                     'mensagem': lote.motivo_cancelamento, 'status_romaneio': None}
+        try:
+            if not lote.cancelado:
+                with self.app.app_context(), logs.correlacao(f"lote-{lote.id}"), \
+                        tracing.span('verificacao_lote.romaneio', lote=lote.id, romaneio_id=romaneio_id) as span:
+                    self._verificar(lote, romaneio_id, resultado)
+                    span.definir('resultado', resultado['status'])
+        except Exception as e:
+            logger.error("ERRO no lote %s, romaneio %s: %s", lote.id, romaneio_id, e)
+            resultado.update(status=ERRO, mensagem=str(e))
+        finally:
+            lote.registrar(resultado)
+            if lote.terminado and lote.resultados[-1] is resultado:
+                logger.info("Lote %s %s: %s", lote.id, lote.estado, dict(lote.contagem),
+                            extra={'lote': lote.id, 'contagem': dict(lote.contagem)})
+
+    def _verificar(self, lote, romaneio_id, resultado):
+        from app import db, Romaneio
+
+        romaneio = db.session.get(Romaneio, romaneio_id)
+        if romaneio is None:
+            resultado.update(status=NAO_ENCONTRADO, mensagem='Romaneio não encontrado')
+            return
+        resultado['pedido_compra'] = romaneio.pedido_compra
+
+        if db.session.execute(select(insercao_nao_concluida(romaneio_id))).scalar():
+            resultado.update(status=AGUARDANDO_INSERCAO, mensagem='Romaneio ainda não foi inserido na API',
+                             status_romaneio=romaneio.status)
+            return
+
+        try:
+            verificacao = self._verificador().verificar_romaneio(romaneio)
+        except APIIndisponivelError as e:
+            # Como no passe do verificador: com a API fora, o restante do lote é cancelado
+            db.session.rollback()
+            lote.cancelar(f"API indisponível: {e}")
+            resultado.update(status=API_INDISPONIVEL, mensagem=str(e), status_romaneio=romaneio.status)
+            return
+        except Exception as e:
+            db.session.rollback()
+            logger.error("ERRO ao verificar romaneio %s no lote %s: %s", romaneio.pedido_compra, lote.id, e,
+                         extra={'pedido': romaneio.pedido_compra, 'lote': lote.id})
+            resultado.update(status=ERRO, mensagem=str(e), status_romaneio=romaneio.status)
+            return
+
+        resultado.update(status=verificacao['status'], mensagem=verificacao['mensagem'],
+                         status_romaneio=romaneio.status)
+
+    def parar(self):
+        """Cancela os lotes em andamento e espera as verificações já iniciadas"""
+        for lote in self.listar():
+            lote.cancelar('Servidor encerrando')
+        self._executor.shutdown(wait=True)
@@ -2,10 +2,51 @@
 Serviço de verificação automática de romaneios
 Verifica se as quantidades dos itens batem e atualiza o status
 """
-from datetime import datetime
-from services.api_client import RomaneioAPIClient
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, insert, or_, and_, func, case
+from services.api_client import RomaneioAPIClient, NAO_MODIFICADO
+from services.outbox_dispatcher import enfileirar_atualizacao_status, insercao_nao_concluida
+from services.resiliencia import APIIndisponivelError
+from services import alteracoes, logs, medidor_sql, metricas, tracing
 import config
 
+logger = logs.obter_logger('verificador')
+
+# Tempo gasto em SQL pela thread que está executando um passe
+_medicao_sql = threading.local()
+_engines_medidos = set()
+
+class _TempoSQLPasse(medidor_sql.ObservadorSQL):
+    """Soma em _medicao_sql.tempo os statements da thread com um passe em andamento"""
+    
+    def terminar(self, sql, estado):
+        if getattr(_medicao_sql, 'ativo', False):
+            _medicao_sql.tempo += sql.duracao
+    
+    def falhar(self, sql, estado, contexto):
+        if sql is not None:
+            self.terminar(sql, estado)
+
+# Resultados em que a resposta da API foi avaliada; quando a próxima consulta
+# condicional vem sem mudança, o resultado anterior diz o que fazer
+_RESULTADOS_SEM_TENTATIVA = ('aguardando_contagem', 'sem_dados')
+_RESULTADOS_REGISTRADOS = _RESULTADOS_SEM_TENTATIVA + ('atualizado_aberto', 'mantido_pendente', 'max_tentativas')
+
+def _instalar_medidor_sql(engine):
+    """Registra (uma vez por engine) o observador que cronometra cada statement"""
+    if id(engine) in _engines_medidos:
+        return
+    _engines_medidos.add(id(engine))
+    medidor_sql.registrar(engine, _TempoSQLPasse())
+
+class LeasePerdidoError(Exception):
+    """O lease do romaneio expirou e outro processo o reivindicou durante a verificação"""
+
 class VerificadorService:
     """
     Serviço para verificar romaneios automaticamente
@@ -13,33 +54,41 @@ class VerificadorService:
     
     def __init__(self):
         self.api_client = RomaneioAPIClient()
+        self._tempo_api = 0.0
+        # Identifica este processo como dono dos leases que reivindicar
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
     
-    def _log(self, mensagem):
-        """Log interno"""
-        if config.VERIFICADOR_LOG_DETALHADO:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            print(f"[{timestamp}] Verificador: {mensagem}")
-    
-    def executar_verificacao_automatica(self):
+    def executar_verificacao_automatica(self, deve_parar=None):
         """
         Executa a verificação automática de todos os romaneios não finalizados
         
+        Args:
+            deve_parar (callable): se informado, é consultado entre um romaneio e
+                outro; ao retornar True a verificação termina o romaneio atual e para
+        
         Returns:
             dict: Resumo da execução
         """
-        from app import Romaneio
+        # Todas as linhas de log do passe levam o mesmo id de correlação
+        with logs.correlacao(f"passe-{logs.novo_id()}") as correlacao, \
+                tracing.span('verificador.passe', worker=self.worker_id, correlacao=correlacao):
+            return self._executar_passe(deve_parar)
+    
+    def _executar_passe(self, deve_parar):
+        from app import db
         
         inicio = datetime.now()
-        self._log("=" * 60)
-        self._log("INICIANDO VERIFICACAO AUTOMATICA DE ROMANEIOS")
-        if config.MODO_TESTE:
-            self._log("*** ATENCAO: EXECUTANDO EM MODO TESTE ***")
-        self._log("=" * 60)
+        logger.info("Iniciando verificacao automatica de romaneios%s",
+                    " (MODO TESTE)" if config.MODO_TESTE else "")
         
-        # Buscar romaneios não finalizados
-        romaneios = Romaneio.query.filter(Romaneio.status != 'F').all()
+        inicio_passe = datetime.utcnow()
+        intervalo = max(0, config.INTERVALO_VERIFICACAO_MINUTOS * 60 - 10)
+        proxima_verificacao = inicio_passe + timedelta(seconds=intervalo)
         
-        self._log(f"Encontrados {len(romaneios)} romaneios para verificar")
+        backlog = self._contar_backlog(inicio_passe)
+        execucao = self._registrar_inicio(backlog)
+        logger.info("Worker %s: %d romaneios para verificar (execucao %s)", self.worker_id, backlog, execucao.id,
+                    extra={'worker': self.worker_id, 'backlog': backlog, 'execucao_id': execucao.id})
         
         resultados = {
             'total_verificados': 0,
@@ -47,147 +96,465 @@ class VerificadorService:
             'mantidos_pendente': 0,
             'max_tentativas_atingidas': 0,
             'aguardando_contagem': 0,
+            'sem_alteracao': 0,
             'erros': 0,
+            'interrompido': False,
+            'api_indisponivel': False,
             'detalhes': []
         }
         
-        for romaneio in romaneios:
-            try:
-                resultado = self.verificar_romaneio(romaneio)
-                resultados['total_verificados'] += 1
-                
-                if resultado['status'] == 'atualizado_aberto':
-                    resultados['atualizados_para_aberto'] += 1
-                elif resultado['status'] == 'mantido_pendente':
-                    resultados['mantidos_pendente'] += 1
-                elif resultado['status'] == 'max_tentativas':
-                    resultados['max_tentativas_atingidas'] += 1
-                elif resultado['status'] == 'aguardando_contagem':
-                    resultados['aguardando_contagem'] += 1
-                
-                resultados['detalhes'].append({
-                    'pedido': romaneio.pedido_compra,
-                    'status': resultado['status'],
-                    'mensagem': resultado['mensagem']
-                })
-                
-            except Exception as e:
-                self._log(f"ERRO ao verificar romaneio {romaneio.pedido_compra}: {str(e)}")
-                resultados['erros'] += 1
-                resultados['detalhes'].append({
-                    'pedido': romaneio.pedido_compra,
-                    'status': 'erro',
-                    'mensagem': str(e)
-                })
+        self._tempo_api = 0.0
+        _instalar_medidor_sql(db.engine)
+        _medicao_sql.ativo = True
+        _medicao_sql.tempo = 0.0
+        
+        try:
+            self._processar_backlog(resultados, inicio_passe, proxima_verificacao, deve_parar)
+        except Exception as e:
+            db.session.rollback()
+            self._registrar_fim(execucao, resultados, inicio, 'falhou', str(e))
+            raise
+        finally:
+            _medicao_sql.ativo = False
         
         duracao = (datetime.now() - inicio).total_seconds()
         
-        self._log("=" * 60)
-        self._log("VERIFICACAO CONCLUIDA")
-        self._log(f"Tempo total: {duracao:.2f} segundos")
-        self._log(f"Total verificados: {resultados['total_verificados']}")
-        self._log(f"Atualizados para Aberto: {resultados['atualizados_para_aberto']}")
-        self._log(f"Mantidos Pendente: {resultados['mantidos_pendente']}")
-        self._log(f"Max tentativas: {resultados['max_tentativas_atingidas']}")
-        self._log(f"Aguardando contagem: {resultados['aguardando_contagem']}")
-        self._log(f"Erros: {resultados['erros']}")
-        self._log("=" * 60)
+        resultados['circuito_api'] = self.api_client.estado_circuito()
+        contadores = {chave: resultados[chave] for chave in (
+            'total_verificados', 'atualizados_para_aberto', 'mantidos_pendente',
+            'max_tentativas_atingidas', 'aguardando_contagem', 'sem_alteracao', 'erros')}
+        logger.info(
+            "Verificacao concluida em %.2fs: %d verificados, %d abertos, %d pendentes, %d max tentativas, "
+            "%d aguardando contagem, %d sem alteracao, %d erros | API %.2fs, DB %.2fs, circuito %s",
+            duracao, resultados['total_verificados'], resultados['atualizados_para_aberto'],
+            resultados['mantidos_pendente'], resultados['max_tentativas_atingidas'],
+            resultados['aguardando_contagem'], resultados['sem_alteracao'], resultados['erros'],
+            self._tempo_api, _medicao_sql.tempo, resultados['circuito_api']['estado'],
+            extra={'duracao': round(duracao, 3), 'contadores': contadores, 'execucao_id': execucao.id,
+                   'tempo_api': round(self._tempo_api, 3), 'tempo_db': round(_medicao_sql.tempo, 3)}
+        )
+        resultados['limite_api'] = self.api_client.estado_limitadores()
+        resultados['cache_api'] = self.api_client.estado_cache()
+        resultados['consultas_api'] = self.api_client.estado_consultas()
+        
+        status = 'interrompido' if resultados['interrompido'] else 'concluido'
+        mensagem = 'API indisponivel (circuito aberto)' if resultados['api_indisponivel'] else None
+        self._registrar_fim(execucao, resultados, inicio, status, mensagem)
         
         resultados['duracao'] = duracao
         resultados['timestamp'] = inicio.isoformat()
+        resultados['backlog'] = backlog
+        resultados['tempo_api'] = self._tempo_api
+        resultados['tempo_db'] = _medicao_sql.tempo
+        resultados['execucao_id'] = execucao.id
         
         return resultados
     
+    def _processar_backlog(self, resultados, inicio_passe, proxima_verificacao, deve_parar):
+        """
+        Reivindica pequenos lotes até o backlog acabar; outros workers
+        rodando ao mesmo tempo pegam lotes diferentes
+        """
+        from app import db
+        
+        while not resultados['interrompido']:
+            lote = self._reivindicar_lote(inicio_passe)
+            if not lote:
+                break
+            
+            for romaneio in lote:
+                if deve_parar and deve_parar():
+                    logger.info("Parada solicitada - verificacao interrompida")
+                    resultados['interrompido'] = True
+                    break
+                
+                try:
+                    resultado = self.verificar_romaneio(romaneio)
+                    resultados['total_verificados'] += 1
+                    
+                    if resultado['status'] == 'atualizado_aberto':
+                        resultados['atualizados_para_aberto'] += 1
+                    elif resultado['status'] == 'mantido_pendente':
+                        resultados['mantidos_pendente'] += 1
+                    elif resultado['status'] == 'max_tentativas':
+                        resultados['max_tentativas_atingidas'] += 1
+                    elif resultado['status'] == 'aguardando_contagem':
+                        resultados['aguardando_contagem'] += 1
+                    elif resultado['status'] == 'sem_alteracao':
+                        resultados['sem_alteracao'] += 1
+                    
+                    resultados['detalhes'].append({
+                        'pedido': romaneio.pedido_compra,
+                        'status': resultado['status'],
+                        'mensagem': resultado['mensagem']
+                    })
+                    
+                except APIIndisponivelError as e:
+                    # API claramente fora: encerra o passe em vez de gastar
+                    # uma chamada (e um timeout) em cada romaneio restante
+                    db.session.rollback()
+                    logger.warning("API indisponivel, encerrando o passe: %s", e)
+                    resultados['interrompido'] = True
+                    resultados['api_indisponivel'] = True
+                    self._liberar_lease(romaneio.id, None)
+                    break
+                    
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error("ERRO ao verificar romaneio %s: %s", romaneio.pedido_compra, e,
+                                 extra={'pedido': romaneio.pedido_compra})
+                    resultados['erros'] += 1
+                    resultados['detalhes'].append({
+                        'pedido': romaneio.pedido_compra,
+                        'status': 'erro',
+                        'mensagem': str(e)
+                    })
+                
+                self._liberar_lease(romaneio.id, proxima_verificacao)
+            
+            # Romaneios do lote que não chegaram a ser processados
+            self._liberar_leases_restantes()
+    
+    def _registrar_inicio(self, backlog):
+        """Cria o registro do passe em VerificationRun"""
+        from app import db, VerificationRun
+        
+        metricas.verificador_backlog.definir(backlog)
+        execucao = VerificationRun(worker_id=self.worker_id, status='executando', backlog=backlog)
+        db.session.add(execucao)
+        db.session.commit()
+        return execucao
+    
+    def _registrar_fim(self, execucao, resultados, inicio, status, mensagem=None):
+        """Persiste contadores e tempos do passe"""
+        from app import db
+        
+        try:
+            execucao.status = status
+            execucao.fim = datetime.utcnow()
+            execucao.duracao = (datetime.now() - inicio).total_seconds()
+            for campo in ('total_verificados', 'atualizados_para_aberto', 'mantidos_pendente',
+                          'max_tentativas_atingidas', 'aguardando_contagem', 'sem_alteracao', 'erros'):
+                setattr(execucao, campo, resultados[campo])
+            execucao.tempo_api = self._tempo_api
+            execucao.tempo_db = _medicao_sql.tempo
+            execucao.mensagem = mensagem
+            db.session.commit()
+            
+            metricas.verificador_passe_segundos.observar(execucao.duracao, status=status)
+            metricas.verificador_ultimo_passe.definir(time.time())
+            for resultado in ('atualizados_para_aberto', 'mantidos_pendente', 'max_tentativas_atingidas',
+                              'aguardando_contagem', 'sem_alteracao', 'erros'):
+                metricas.verificador_romaneios_total.inc(resultados[resultado], resultado=resultado)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("ERRO ao registrar execucao: %s", e)
+    
+    def registrar_execucao_ignorada(self, motivo):
+        """Registra um passe que não rodou (ex.: outro passe ainda em andamento)"""
+        from app import db, VerificationRun
+        
+        agora = datetime.utcnow()
+        execucao = VerificationRun(
+            worker_id=self.worker_id,
+            status='ignorado',
+            inicio=agora,
+            fim=agora,
+            duracao=0,
+            mensagem=motivo
+        )
+        db.session.add(execucao)
+        db.session.commit()
+        return execucao
+    
+    def _filtro_elegiveis(self, inicio_passe, agora):
+        """Romaneios verificáveis, vencidos, sem lease válido e já inseridos na API"""
+        from app import Romaneio
+        
+        return and_(
+            Romaneio.status != 'F',
+            Romaneio.tentativas_contagem < config.MAX_TENTATIVAS_CONTAGEM,
+            or_(Romaneio.lease_owner.is_(None), Romaneio.lease_expira_em < agora),
+            or_(Romaneio.proxima_verificacao_em.is_(None),
+                Romaneio.proxima_verificacao_em <= inicio_passe),
+            ~insercao_nao_concluida(Romaneio.id)
+        )
+    
+    @tracing.rastreado('verificador.contar_backlog')
+    def _contar_backlog(self, inicio_passe):
+        from app import Romaneio
+        return Romaneio.query.filter(self._filtro_elegiveis(inicio_passe, datetime.utcnow())).count()
+    
+    @tracing.rastreado('verificador.reivindicar_lote')
+    def _reivindicar_lote(self, inicio_passe):
+        """
+        Reivindica atomicamente um lote de romaneios para este worker
+        
+        Um único UPDATE marca o lease; se outro worker pegou o mesmo romaneio
+        antes, a condição do WHERE deixa de valer e ele não entra no lote.
+        Leases expirados (worker que morreu) voltam a ser elegíveis.
+        """
+        from app import db, Romaneio
+        
+        agora = datetime.utcnow()
+        expira_em = agora + timedelta(seconds=config.LEASE_DURACAO_SEGUNDOS)
+        
+        candidatos = select(Romaneio.id)\
+            .where(self._filtro_elegiveis(inicio_passe, agora))\
+            .order_by(Romaneio.proxima_verificacao_em, Romaneio.id)\
+            .limit(config.LEASE_LOTE)
+        
+        db.session.execute(
+            update(Romaneio)
+            .where(Romaneio.id.in_(candidatos))
+            .where(or_(Romaneio.lease_owner.is_(None), Romaneio.lease_expira_em < agora))
+            .values(lease_owner=self.worker_id, lease_expira_em=expira_em,
+                    updated_at=Romaneio.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        
+        return Romaneio.query\
+            .filter(Romaneio.lease_owner == self.worker_id, Romaneio.lease_expira_em == expira_em)\
+            .order_by(Romaneio.id)\
+            .execution_options(populate_existing=True)\
+            .all()
+    
+    def _liberar_lease(self, romaneio_id, proxima_verificacao):
+        """
+        Libera o lease e agenda a próxima verificação do romaneio
+        (com `proxima_verificacao` None o romaneio continua vencido)
+        """
+        from app import db, Romaneio
+        
+        valores = {'lease_owner': None, 'lease_expira_em': None, 'updated_at': Romaneio.updated_at}
+        if proxima_verificacao is not None:
+            valores['proxima_verificacao_em'] = proxima_verificacao
+        
+        try:
+            db.session.execute(
+                update(Romaneio)
+                .where(Romaneio.id == romaneio_id, Romaneio.lease_owner == self.worker_id)
+                .values(**valores)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("ERRO ao liberar lease do romaneio %s: %s", romaneio_id, e)
+    
+    def _renovar_lease(self, romaneio_id):
+        """
+        Estende o lease por LEASE_DURACAO_SEGUNDOS se ele ainda for deste
+        worker (na transação corrente; o chamador faz o commit)
+        
+        Returns:
+            bool: False se outro processo reivindicou o romaneio
+        """
+        from app import db, Romaneio
+        
+        return bool(db.session.execute(
+            update(Romaneio)
+            .where(Romaneio.id == romaneio_id, Romaneio.lease_owner == self.worker_id)
+            .values(lease_expira_em=datetime.utcnow() + timedelta(seconds=config.LEASE_DURACAO_SEGUNDOS),
+                    updated_at=Romaneio.updated_at)
+            .execution_options(synchronize_session=False)
+        ).rowcount)
+    
+    def _confirmar_lease(self, romaneio):
+        """
+        Garante, na transação que grava o resultado, que o lease ainda é deste
+        worker: o SQLite só tem um escritor por vez, então ninguém reivindica o
+        romaneio entre esta checagem e o commit
+        
+        Raises:
+            LeasePerdidoError: outro processo assumiu o romaneio
+        """
+        if not self._renovar_lease(romaneio.id):
+            raise LeasePerdidoError(f"Lease do romaneio {romaneio.pedido_compra} expirou e foi "
+                                    f"reivindicado por outro processo")
+    
+    def _liberar_leases_restantes(self):
+        """Devolve ao backlog os romaneios reivindicados e não processados"""
+        from app import db, Romaneio
+        
+        db.session.execute(
+            update(Romaneio)
+            .where(Romaneio.lease_owner == self.worker_id)
+            .values(lease_owner=None, lease_expira_em=None, updated_at=Romaneio.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    
     def verificar_romaneio(self, romaneio):
         """
         Verifica um romaneio específico
+        
+        Só um worker/requisição verifica o mesmo romaneio por vez: fora de um
+        passe (ex.: botão "verificar"), o lease do romaneio é reivindicado
+        antes; se outro já estiver verificando, retorna 'em_verificacao' sem
+        consultar a API nem contar tentativa.
         """
+        from app import db, Romaneio
+        
+        if romaneio.lease_owner == self.worker_id:
+            # Reivindicado por este worker no passe em andamento: o lease foi
+            # marcado para o lote inteiro, então é renovado antes de cada romaneio
+            renovado = self._renovar_lease(romaneio.id)
+            db.session.commit()
+            if not renovado:
+                logger.warning("Romaneio %s: lease expirou e outro processo assumiu a verificacao",
+                               romaneio.pedido_compra, extra={'pedido': romaneio.pedido_compra})
+                return {
+                    'status': 'em_verificacao',
+                    'mensagem': 'Romaneio já está sendo verificado'
+                }
+            return self._verificar(romaneio)
+        
+        agora = datetime.utcnow()
+        reivindicado = db.session.execute(
+            update(Romaneio)
+            .where(Romaneio.id == romaneio.id)
+            .where(or_(Romaneio.lease_owner.is_(None), Romaneio.lease_expira_em < agora))
+            .values(lease_owner=self.worker_id,
+                    lease_expira_em=agora + timedelta(seconds=config.LEASE_DURACAO_SEGUNDOS),
+                    updated_at=Romaneio.updated_at)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        
+        if not reivindicado:
+            logger.info("Romaneio %s ja esta sendo verificado por outro processo", romaneio.pedido_compra)
+            return {
+                'status': 'em_verificacao',
+                'mensagem': 'Romaneio já está sendo verificado'
+            }
+        
+        try:
+            # Relê o romaneio: outro worker pode ter acabado de atualizá-lo
+            db.session.refresh(romaneio)
+            # Verificação pedida pelo usuário (botão ou lote) sempre baixa o
+            # romaneio inteiro, sem os cabeçalhos condicionais
+            self.api_client.esquecer_validadores(romaneio.pedido_compra)
+            return self._verificar(romaneio)
+        finally:
+            db.session.rollback()
+            self._liberar_lease(romaneio.id, None)
+    
+    def _verificar(self, romaneio):
+        """Consulta a API e aplica o resultado (o chamador detém o lease)"""
+        with tracing.span('verificador.romaneio', pedido=romaneio.pedido_compra) as span:
+            resultado = self._verificar_romaneio(romaneio)
+            span.definir('resultado', resultado['status'])
+            if resultado['status'] in _RESULTADOS_REGISTRADOS:
+                self.api_client.registrar_resultado(romaneio.pedido_compra, resultado['status'])
+            return resultado
+    
+    def _verificar_romaneio(self, romaneio):
         from app import db, RomaneioItem, RomaneioLog
         
-        self._log(f"\nVerificando romaneio: {romaneio.pedido_compra}")
+        pedido = romaneio.pedido_compra
+        extra = {'pedido': pedido}
+        logger.debug("Verificando romaneio: %s", pedido, extra=extra)
         
         # Verificar se pode ser verificado
         if not romaneio.pode_verificar():
-            self._log(f"  Romaneio nao pode ser verificado (status: {romaneio.status}, tentativas: {romaneio.tentativas_contagem})")
+            logger.debug("Romaneio %s nao pode ser verificado (status: %s, tentativas: %s)",
+                         pedido, romaneio.status, romaneio.tentativas_contagem, extra=extra)
             return {
                 'status': 'nao_verificavel',
                 'mensagem': 'Romaneio não pode ser verificado (finalizado ou max tentativas)'
             }
         
         try:
-            # Buscar dados da API
-            self._log(f"  Buscando dados da API para pedido {romaneio.pedido_compra}...")
-            dados_api = self.api_client.get_romaneio(romaneio.pedido_compra)
+            resposta = self._consultar_api(pedido)
+            
+            if resposta is NAO_MODIFICADO:
+                anterior = self.api_client.resultado_anterior(pedido)
+                if anterior in _RESULTADOS_SEM_TENTATIVA:
+                    # Continua sem contagem / sem dados: nada a gravar nem a contar
+                    logger.debug("Romaneio %s: sem alteracoes na API desde a ultima verificacao", pedido, extra=extra)
+                    return {
+                        'status': 'sem_alteracao',
+                        'mensagem': 'Romaneio não mudou na API desde a última verificação'
+                    }
+                if anterior is None:
+                    # Validadores sem o resultado da verificação (ex.: o processo
+                    # parou no meio dela): busca o romaneio completo
+                    self.api_client.esquecer_validadores(pedido)
+                    resposta = self._consultar_api(pedido)
+                else:
+                    # Os itens locais já são os da API: a decisão é refeita (e a
+                    # tentativa contada) sem baixar o romaneio de novo
+                    logger.debug("Romaneio %s: sem alteracoes na API, decidindo com os itens locais",
+                                 pedido, extra=extra)
+                    self._confirmar_lease(romaneio)
+                    return self._decidir(romaneio)
             
-            if not dados_api or len(dados_api) == 0:
-                self._log(f"  AVISO: API nao retornou dados")
+            # Itens lidos do stream e gravados em lotes; se algum item ainda
+            # estiver com QUANTIDADE_CONTADA = null, nada é gravado
+            with resposta, tracing.span('verificador.atualizar_itens') as span:
+                nao_contados, amostra_nao_contados = self._atualizar_itens_banco(
+                    romaneio, self._cronometrar_api(resposta.lotes_itens(config.VERIFICADOR_ITENS_POR_LOTE))
+                )
+                span.definir('itens', resposta.total_itens)
+            
+            if resposta.vazio:
+                logger.warning("Romaneio %s: API nao retornou dados", pedido, extra=extra)
                 return {
                     'status': 'sem_dados',
                     'mensagem': 'API não retornou dados para este pedido'
                 }
             
-            # Pegar primeiro romaneio da resposta
-            dados_romaneio = dados_api[0]
-            
-            # Atualizar IDRO se ainda não tiver
-            if not romaneio.idro and 'IDRO' in dados_romaneio:
-                romaneio.idro = dados_romaneio['IDRO']
-                self._log(f"  IDRO atualizado: {romaneio.idro}")
-            
-            # Processar itens
-            itens_api = dados_romaneio.get('ITEM', [])
-            self._log(f"  Encontrados {len(itens_api)} itens na API")
-            
-            # Verificar se todos os itens ja foram contados
-            # Se algum item ainda tiver QUANTIDADE_CONTADA = null, nao processar
-            itens_nao_contados = [
-                item for item in itens_api 
-                if item.get('QUANTIDADE_CONTADA') is None
-            ]
+            logger.debug("Romaneio %s: %d itens na API", pedido, resposta.total_itens, extra=extra)
             
-            if itens_nao_contados:
-                self._log(f"  IGNORADO: {len(itens_nao_contados)} item(ns) ainda sem contagem (QUANTIDADE_CONTADA = null)")
-                for item in itens_nao_contados:
-                    self._log(f"     - {item.get('CODIGO')}: {item.get('DESCRICAO')}")
+            if nao_contados:
+                # Desfaz os lotes gravados antes de encontrar o item sem contagem
+                db.session.rollback()
+                if self._atualizar_idro(romaneio, resposta.cabecalho):
+                    self._confirmar_lease(romaneio)
+                    db.session.commit()
+                logger.info("Romaneio %s: %d item(ns) ainda sem contagem (QUANTIDADE_CONTADA = null)",
+                            pedido, nao_contados,
+                            extra={'pedido': pedido, 'codigos_sem_contagem':
+                                   [item.get('CODIGO') for item in amostra_nao_contados]})
                 return {
                     'status': 'aguardando_contagem',
-                    'mensagem': f'{len(itens_nao_contados)} item(ns) ainda nao foram contados'
+                    'mensagem': f'{nao_contados} item(ns) ainda nao foram contados'
                 }
             
-            # Atualizar ou criar itens no banco
-            self._atualizar_itens_banco(romaneio, itens_api)
+            self._atualizar_idro(romaneio, resposta.cabecalho)
             
-            # Verificar quantidades
-            todas_contadas, todas_batem = self._verificar_quantidades(romaneio)
+            # Tudo daqui até o commit do resultado fica na mesma transação
+            self._confirmar_lease(romaneio)
+            return self._decidir(romaneio)
             
-            self._log(f"  Todas contadas: {todas_contadas}, Todas batem: {todas_batem}")
+        except APIIndisponivelError:
+            # Circuito aberto: nada foi consultado, não há o que registrar
+            raise
+        except LeasePerdidoError as e:
+            # O outro processo verifica e registra; nada desta verificação é gravado
+            db.session.rollback()
+            self.api_client.esquecer_validadores(romaneio.pedido_compra)
+            logger.warning("Romaneio %s: %s", pedido, e, extra=extra)
+            return {
+                'status': 'em_verificacao',
+                'mensagem': 'Romaneio já está sendo verificado'
+            }
+        except Exception as e:
+            logger.error("Romaneio %s: erro na verificacao: %s", pedido, e, extra=extra)
             
-            # Incrementar tentativa
-            romaneio.incrementar_tentativa()
+            # A resposta não foi aplicada: a próxima consulta precisa vir completa
+            self.api_client.esquecer_validadores(romaneio.pedido_compra)
             
-            # Decidir acao baseado nas quantidades
-            if todas_contadas and todas_batem:
-                # Todas as quantidades bateram -> Atualizar para ABERTO
-                self._log(f"  SUCESSO: Todas as quantidades bateram!")
-                return self._atualizar_para_aberto(romaneio)
-            else:
-                # Divergências encontradas
-                divergencias = [item for item in romaneio.itens if item.tem_divergencia()]
-                self._log(f"  Divergencias encontradas: {len(divergencias)} itens")
-                
-                if romaneio.tentativas_contagem >= config.MAX_TENTATIVAS_CONTAGEM:
-                    self._log(f"  ATENCAO: Maximo de tentativas atingido ({romaneio.tentativas_contagem})")
-                    return self._registrar_max_tentativas(romaneio, divergencias)
-                else:
-                    self._log(f"  Mantendo pendente (tentativa {romaneio.tentativas_contagem}/{config.MAX_TENTATIVAS_CONTAGEM})")
-                    return self._manter_pendente(romaneio, divergencias)
-            
-        except Exception as e:
-            self._log(f"  ERRO: {str(e)}")
+            # Desfaz os lotes de itens já gravados (e as alterações do feed)
+            # antes de registrar o erro, como no caso de itens sem contagem
+            romaneio_id = romaneio.id
+            db.session.rollback()
             
             # Registrar erro no log do romaneio
             log = RomaneioLog(
-                romaneio_id=romaneio.id,
+                romaneio_id=romaneio_id,
                 acao='erro_verificacao',
                 detalhes=f'Erro na verificação: {str(e)}',
                 tentativa=romaneio.tentativas_contagem
@@ -197,55 +564,192 @@ class VerificadorService:
             
             raise
     
-    def _atualizar_itens_banco(self, romaneio, itens_api):
-        """Atualiza os itens do romaneio no banco de dados"""
+    def _consultar_api(self, pedido):
+        """GET condicional do romaneio (tempo somado em _tempo_api)"""
+        inicio_api = time.perf_counter()
+        try:
+            with tracing.span('verificador.consultar_api'):
+                return self.api_client.abrir_romaneio(pedido, condicional=True)
+        finally:
+            self._tempo_api += time.perf_counter() - inicio_api
+    
+    def _decidir(self, romaneio):
+        """Compara as quantidades dos itens gravados, conta a tentativa e aplica o resultado"""
+        pedido = romaneio.pedido_compra
+        extra = {'pedido': pedido}
+        
+        # Verificar quantidades
+        todas_contadas, todas_batem = self._verificar_quantidades(romaneio)
+        
+        logger.debug("Romaneio %s: todas contadas: %s, todas batem: %s",
+                     pedido, todas_contadas, todas_batem, extra=extra)
+        
+        # Incrementar tentativa
+        romaneio.incrementar_tentativa()
+        
+        # Decidir acao baseado nas quantidades
+        if todas_contadas and todas_batem:
+            # Todas as quantidades bateram -> Atualizar para ABERTO
+            logger.info("Romaneio %s: todas as quantidades bateram", pedido, extra=extra)
+            return self._atualizar_para_aberto(romaneio)
+        
+        # Divergências encontradas
+        total_divergencias, divergencias = self._divergencias(romaneio)
+        if romaneio.tentativas_contagem >= config.MAX_TENTATIVAS_CONTAGEM:
+            logger.warning("Romaneio %s: %d divergencia(s), maximo de tentativas atingido (%d)",
+                           pedido, total_divergencias, romaneio.tentativas_contagem, extra=extra)
+            return self._registrar_max_tentativas(romaneio, divergencias, total_divergencias)
+        logger.info("Romaneio %s: %d divergencia(s), mantido pendente (tentativa %d/%d)",
+                    pedido, total_divergencias, romaneio.tentativas_contagem,
+                    config.MAX_TENTATIVAS_CONTAGEM, extra=extra)
+        return self._manter_pendente(romaneio, divergencias, total_divergencias)
+    
+    def _cronometrar_api(self, lotes):
+        """Soma em _tempo_api o tempo gasto lendo cada lote do stream HTTP"""
+        iterador = iter(lotes)
+        while True:
+            inicio = time.perf_counter()
+            try:
+                lote = next(iterador)
+            except StopIteration:
+                return
+            finally:
+                self._tempo_api += time.perf_counter() - inicio
+            yield lote
+    
+    def _atualizar_idro(self, romaneio, cabecalho):
+        """Atualiza o IDRO do romaneio se ainda não tiver"""
+        if not romaneio.idro and cabecalho.get('IDRO'):
+            romaneio.idro = cabecalho['IDRO']
+            logger.debug("Romaneio %s: IDRO atualizado para %s", romaneio.pedido_compra, romaneio.idro)
+            return True
+        return False
+    
+    def _atualizar_itens_banco(self, romaneio, lotes):
+        """
+        Atualiza os itens do romaneio no banco, um lote por vez
+        
+        Ao encontrar um item sem contagem, para de gravar e só conta o
+        restante (o chamador desfaz o que já foi gravado).
+        
+        Returns:
+            tuple: (quantidade de itens sem contagem, amostra desses itens)
+        """
+        nao_contados = 0
+        amostra = []
+        
+        for lote in lotes:
+            sem_contagem = [item for item in lote if item.get('QUANTIDADE_CONTADA') is None]
+            if sem_contagem:
+                nao_contados += len(sem_contagem)
+                amostra.extend(sem_contagem[:config.VERIFICADOR_MAX_ITENS_LOG - len(amostra)])
+            if nao_contados:
+                continue
+            self._gravar_lote_itens(romaneio, lote)
+        
+        return nao_contados, amostra
+    
+    @tracing.rastreado('verificador.gravar_lote_itens')
+    def _gravar_lote_itens(self, romaneio, itens_api):
+        """Upsert de um lote de itens: UPDATE por chave primária e INSERT em massa"""
         from app import db, RomaneioItem
         
-        # Criar um mapa dos itens existentes
-        itens_existentes = {item.codigo: item for item in romaneio.itens}
+        codigos = [item_api.get('CODIGO') for item_api in itens_api]
+        existentes = {codigo: (item_id, quantidade_nf, quantidade_contada)
+                      for codigo, item_id, quantidade_nf, quantidade_contada in db.session.execute(
+            select(RomaneioItem.codigo, RomaneioItem.id, RomaneioItem.quantidade_nf, RomaneioItem.quantidade_contada)
+            .where(RomaneioItem.romaneio_id == romaneio.id, RomaneioItem.codigo.in_(codigos))
+        )}
         
+        agora = datetime.utcnow()
+        atualizar = []
+        inserir = []
+        mudancas = []
         for item_api in itens_api:
             codigo = item_api.get('CODIGO')
-            
-            if codigo in itens_existentes:
-                # Atualizar item existente
-                item = itens_existentes[codigo]
-                item.quantidade_contada = item_api.get('QUANTIDADE_CONTADA')
-                item.quantidade_nf = item_api.get('QUANTIDADE_NF')
-                item.updated_at = datetime.utcnow()
+            if codigo in existentes:
+                item_id, quantidade_nf, quantidade_contada = existentes[codigo]
+                atualizar.append({
+                    'id': item_id,
+                    'quantidade_contada': item_api.get('QUANTIDADE_CONTADA'),
+                    'quantidade_nf': item_api.get('QUANTIDADE_NF'),
+                    'updated_at': agora
+                })
+                for campo, anterior in (('quantidade_nf', quantidade_nf), ('quantidade_contada', quantidade_contada)):
+                    novo = atualizar[-1][campo]
+                    if novo != anterior:
+                        mudancas.append(alteracoes.alteracao(alteracoes.ITEM, romaneio.id, romaneio.pedido_compra,
+                                                             campo, anterior, novo, item_id=item_id, codigo=codigo,
+                                                             registrado_em=agora))
             else:
-                # Criar novo item
-                item = RomaneioItem(
-                    romaneio_id=romaneio.id,
-                    idro=item_api.get('IDRO'),
-                    codigo=codigo,
-                    descricao=item_api.get('DESCRICAO', ''),
-                    quantidade_nf=item_api.get('QUANTIDADE_NF', 0),
-                    quantidade_contada=item_api.get('QUANTIDADE_CONTADA')
-                )
-                db.session.add(item)
+                inserir.append({
+                    'romaneio_id': romaneio.id,
+                    'idro': item_api.get('IDRO'),
+                    'codigo': codigo,
+                    'descricao': item_api.get('DESCRICAO', ''),
+                    'quantidade_nf': item_api.get('QUANTIDADE_NF', 0),
+                    'quantidade_contada': item_api.get('QUANTIDADE_CONTADA')
+                })
         
-        db.session.flush()
+        if atualizar:
+            db.session.execute(update(RomaneioItem), atualizar)
+        if inserir:
+            ids = db.session.execute(
+                insert(RomaneioItem).returning(RomaneioItem.id, sort_by_parameter_order=True), inserir
+            ).scalars().all()
+            for item_id, item in zip(ids, inserir):
+                for campo in ('quantidade_nf', 'quantidade_contada'):
+                    if item[campo] is not None:
+                        mudancas.append(alteracoes.alteracao(alteracoes.ITEM, romaneio.id, romaneio.pedido_compra,
+                                                             campo, None, item[campo], item_id=item_id,
+                                                             codigo=item['codigo'], registrado_em=agora))
+        # Upsert em massa não passa pelo flush: o feed de alterações é gravado aqui,
+        # na mesma transação (desfeito junto se o romaneio ainda tiver itens sem contagem)
+        alteracoes.registrar(db.session, mudancas)
     
+    @tracing.rastreado('verificador.comparar_quantidades')
     def _verificar_quantidades(self, romaneio):
         """
         Verifica se todas as quantidades foram contadas e se batem
+        (agregação no banco, sem carregar os itens)
         """
-        if len(romaneio.itens) == 0:
-            return False, False
+        from app import db, RomaneioItem
         
-        todas_contadas = True
-        todas_batem = True
+        total, contados, batem = db.session.execute(
+            select(
+                func.count(RomaneioItem.id),
+                func.count(RomaneioItem.quantidade_contada),
+                func.coalesce(func.sum(case(
+                    (RomaneioItem.quantidade_contada == RomaneioItem.quantidade_nf, 1), else_=0
+                )), 0)
+            ).where(RomaneioItem.romaneio_id == romaneio.id)
+        ).one()
         
-        for item in romaneio.itens:
-            if item.quantidade_contada is None:
-                todas_contadas = False
-                todas_batem = False
-            elif item.quantidade_nf != item.quantidade_contada:
-                todas_batem = False
+        if total == 0:
+            return False, False
         
+        todas_contadas = contados == total
+        todas_batem = todas_contadas and batem == total
         return todas_contadas, todas_batem
     
+    @tracing.rastreado('verificador.divergencias')
+    def _divergencias(self, romaneio):
+        """
+        Returns:
+            tuple: (total de itens divergentes, amostra limitada desses itens)
+        """
+        from app import RomaneioItem
+        
+        filtro = RomaneioItem.query.filter(
+            RomaneioItem.romaneio_id == romaneio.id,
+            RomaneioItem.quantidade_contada.isnot(None),
+            RomaneioItem.quantidade_contada != RomaneioItem.quantidade_nf
+        )
+        total = filtro.count()
+        amostra = filtro.order_by(RomaneioItem.id).limit(config.VERIFICADOR_MAX_ITENS_LOG).all()
+        return total, amostra
+    
+    @tracing.rastreado('verificador.atualizar_para_aberto')
     def _atualizar_para_aberto(self, romaneio):
         """Atualiza romaneio para status ABERTO"""
         from app import db, RomaneioLog
@@ -253,13 +757,10 @@ class VerificadorService:
         status_anterior = romaneio.status
         romaneio.status = 'A'  # Aberto
         
-        # Chamar API para atualizar status (se não for modo teste)
-        if not config.MODO_TESTE and romaneio.idro:
-            try:
-                self.api_client.atualizar_status_romaneio(romaneio.idro, 'A')
-            except Exception as e:
-                self._log(f"  ERRO ao atualizar status na API: {str(e)}")
-                # Continua mesmo com erro na API
+        # A atualização na API vai para o outbox, gravado no mesmo commit do
+        # status local; o despachante entrega em segundo plano com retentativas
+        if romaneio.idro and status_anterior != 'A':
+            enfileirar_atualizacao_status(romaneio, 'A')
         
         # Criar log
         log = RomaneioLog(
@@ -278,11 +779,8 @@ class VerificadorService:
             'mensagem': f'Romaneio atualizado para ABERTO (tentativa {romaneio.tentativas_contagem})'
         }
     
-    def _manter_pendente(self, romaneio, divergencias):
-        """Mantém romaneio como PENDENTE"""
-        from app import db, RomaneioLog
-        
-        # Criar log detalhado das divergências
+    def _descrever_divergencias(self, divergencias, total_divergencias):
+        """Linhas do log de divergências (limitadas à amostra)"""
         detalhes_divergencias = []
         for item in divergencias:
             if item.quantidade_contada is None:
@@ -292,6 +790,20 @@ class VerificadorService:
                 detalhes_divergencias.append(
                     f"  - {item.codigo}: NF={item.quantidade_nf}, Contado={item.quantidade_contada} (diff: {diff:+d})"
                 )
+        if total_divergencias > len(divergencias):
+            detalhes_divergencias.append(f"  ... e mais {total_divergencias - len(divergencias)} item(ns)")
+        return detalhes_divergencias
+    
+    @tracing.rastreado('verificador.manter_pendente')
+    def _manter_pendente(self, romaneio, divergencias, total_divergencias=None):
+        """Mantém romaneio como PENDENTE"""
+        from app import db, RomaneioLog
+        
+        if total_divergencias is None:
+            total_divergencias = len(divergencias)
+        
+        # Criar log detalhado das divergências
+        detalhes_divergencias = self._descrever_divergencias(divergencias, total_divergencias)
         
         detalhes = f"Divergencias encontradas:\n" + "\n".join(detalhes_divergencias)
         
@@ -308,22 +820,18 @@ class VerificadorService:
         
         return {
             'status': 'mantido_pendente',
-            'mensagem': f'Mantido PENDENTE - {len(divergencias)} divergencia(s) (tentativa {romaneio.tentativas_contagem}/{config.MAX_TENTATIVAS_CONTAGEM})'
+            'mensagem': f'Mantido PENDENTE - {total_divergencias} divergencia(s) (tentativa {romaneio.tentativas_contagem}/{config.MAX_TENTATIVAS_CONTAGEM})'
         }
     
-    def _registrar_max_tentativas(self, romaneio, divergencias):
+    @tracing.rastreado('verificador.registrar_max_tentativas')
+    def _registrar_max_tentativas(self, romaneio, divergencias, total_divergencias=None):
         """Registra que o máximo de tentativas foi atingido"""
         from app import db, RomaneioLog
         
-        detalhes_divergencias = []
-        for item in divergencias:
-            if item.quantidade_contada is None:
-                detalhes_divergencias.append(f"  - {item.codigo}: Nao contado")
-            else:
-                diff = item.quantidade_contada - item.quantidade_nf
-                detalhes_divergencias.append(
-                    f"  - {item.codigo}: NF={item.quantidade_nf}, Contado={item.quantidade_contada} (diff: {diff:+d})"
-                )
+        if total_divergencias is None:
+            total_divergencias = len(divergencias)
+        
+        detalhes_divergencias = self._descrever_divergencias(divergencias, total_divergencias)
         
         detalhes = f"MAXIMO DE TENTATIVAS ATINGIDO ({romaneio.tentativas_contagem}).\n\nDivergencias persistentes:\n" + "\n".join(detalhes_divergencias)
         
@@ -340,5 +848,5 @@ class VerificadorService:
         
         return {
             'status': 'max_tentativas',
-            'mensagem': f'MAXIMO DE TENTATIVAS ATINGIDO - {len(divergencias)} divergencia(s) persistentes'
+            'mensagem': f'MAXIMO DE TENTATIVAS ATINGIDO - {total_divergencias} divergencia(s) persistentes'
         }
@@ -0,0 +1,394 @@
+"""
+Simulador local da API externa de Romaneios
+Implementa GET /api/romaneio/<pedido>, POST /api/romaneio/inserir e
+PUT /api/romaneio/atualizar/<idro> com latência, erros, timeouts e contagem
+progressiva configuráveis, para medir o cliente, o verificador e o painel
+sem depender do ERP
+
+Uso:
+    python simulador_api_romaneios.py --porta 8900 --itens 5-40 --latencia normal:80,20
+    API_BASE_URL=http://127.0.0.1:8900 MODO_TESTE=False python verificador_romaneios.py --once
+
+Endpoints de controle:
+    GET  /__stats   contadores por endpoint
+    POST /__reset   apaga romaneios e contadores
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def interpretar_latencia(texto):
+    """
+    Converte a especificação de latência (em ms) em uma função que sorteia segundos
+
+    Formatos: fixa:50 | uniforme:20,200 | normal:80,20 | lognormal:80,0.5
+    (lognormal: mediana em ms e sigma)
+    """
+    tipo, _, parametros = texto.partition(':')
+    valores = [float(v) for v in parametros.split(',')] if parametros else []
+
+    if tipo == 'fixa':
+        return lambda rng: valores[0] / 1000
+    if tipo == 'uniforme':
+        return lambda rng: rng.uniform(valores[0], valores[1]) / 1000
+    if tipo == 'normal':
+        return lambda rng: max(0.0, rng.gauss(valores[0], valores[1])) / 1000
+    if tipo == 'lognormal':
+        import math
+        mu = math.log(valores[0])
+        return lambda rng: rng.lognormvariate(mu, valores[1]) / 1000
+    raise argparse.ArgumentTypeError(f"Latencia invalida: {texto}")
+
+
+def interpretar_faixa(texto):
+    """'30' -> (30, 30); '5-40' -> (5, 40)"""
+    minimo, _, maximo = texto.partition('-')
+    return int(minimo), int(maximo or minimo)
+
+
+class EstadoSimulador:
+    """Romaneios conhecidos e contadores (compartilhado entre as threads do servidor)"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.rng = random.Random(args.semente)
+        self.romaneios = {}      # pedido -> dict
+        self.por_idro = {}
+        self.proximo_idro = 100000
+        self.contadores = {}
+        self.inicio = time.time()
+
+    def contar(self, chave):
+        with self.lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + 1
+
+    def obter_ou_criar(self, pedido, nota_fiscal=None, chave_acesso=None):
+        with self.lock:
+            romaneio = self.romaneios.get(pedido)
+            if romaneio is None:
+                semente = zlib.crc32(f"{self.args.semente}:{pedido}".encode())
+                minimo, maximo = self.args.itens
+                romaneio = {
+                    'pedido': pedido,
+                    'idro': self.proximo_idro,
+                    'nota_fiscal': nota_fiscal or f"{semente % 1000000:06d}",
+                    'chave_acesso': chave_acesso,
+                    'status': 'P',
+                    'criado_em': time.time(),
+                    'semente': semente,
+                    'quantidade_itens': random.Random(semente).randint(minimo, maximo)
+                }
+                self.proximo_idro += 1
+                self.romaneios[pedido] = romaneio
+                self.por_idro[romaneio['idro']] = romaneio
+            return romaneio
+
+    def itens(self, romaneio, agora):
+        """
+        Itens do romaneio no instante `agora`
+
+        Cada item é contado em um momento sorteado dentro de
+        --duracao-contagem após a criação; com probabilidade --divergencia a
+        primeira contagem vem errada e é corrigida --recontagem segundos depois.
+
+        Returns:
+            tuple: (lista de itens, instante da última mudança)
+        """
+        itens = []
+        ultima_mudanca = romaneio['criado_em']
+        for indice in range(romaneio['quantidade_itens']):
+            rng = random.Random(romaneio['semente'] * 100003 + indice)
+            quantidade_nf = rng.randint(1, 500)
+            contado_em = romaneio['criado_em'] + rng.uniform(0, self.args.duracao_contagem)
+            divergente = rng.random() < self.args.divergencia
+            corrigido_em = contado_em + self.args.recontagem
+            erro = rng.choice([-2, -1, 1, 2])
+
+            if agora < contado_em:
+                quantidade_contada = None
+            elif divergente and agora < corrigido_em:
+                quantidade_contada = max(0, quantidade_nf + erro)
+                ultima_mudanca = max(ultima_mudanca, contado_em)
+            else:
+                quantidade_contada = quantidade_nf
+                ultima_mudanca = max(ultima_mudanca, corrigido_em if divergente else contado_em)
+
+            itens.append({
+                "IDRO": romaneio['idro'],
+                "CODIGO": f"{romaneio['semente'] % 90 + 10:02d}.{indice:06d}",
+                "DESCRICAO": f"PRODUTO SIMULADO {indice}",
+                "QUANTIDADE_CONTADA": quantidade_contada,
+                "QUANTIDADE_NF": quantidade_nf
+            })
+        return itens, ultima_mudanca
+
+
+class ManipuladorAPI(BaseHTTPRequestHandler):
+    """Atende as requisições; `estado` é definido em main()"""
+
+    protocol_version = 'HTTP/1.1'
+    estado = None
+
+    def log_message(self, formato, *args):
+        if self.estado.args.verbose:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {self.address_string()} {formato % args}")
+
+    # ----- respostas -----
+
+    def _enviar_json(self, status, dados, headers=None):
+        corpo = json.dumps(dados).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in (headers or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _enviar_vazio(self, status, headers=None):
+        self.send_response(status)
+        for nome, valor in (headers or {}).items():
+            self.send_header(nome, valor)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _ler_corpo(self):
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        if not tamanho:
+            return {}
+        return json.loads(self.rfile.read(tamanho) or b'{}')
+
+    def _simular_falhas(self, endpoint):
+        """
+        Aplica latência e falhas sorteadas
+
+        Returns:
+            bool: True se a requisição já foi respondida (ou abandonada)
+        """
+        args = self.estado.args
+        with self.estado.lock:
+            latencia = args.latencia(self.estado.rng)
+            sorteio = self.estado.rng.random()
+        time.sleep(latencia)
+
+        if sorteio < args.taxa_timeout:
+            self.estado.contar(f'{endpoint}:timeout')
+            # Segura a conexão além do timeout do cliente e fecha sem responder
+            time.sleep(args.tempo_timeout)
+            self.close_connection = True
+            return True
+        sorteio -= args.taxa_timeout
+
+        if sorteio < args.taxa_erro:
+            self.estado.contar(f'{endpoint}:500')
+            self._enviar_json(500, {"success": False, "message": "Erro interno simulado"})
+            return True
+        sorteio -= args.taxa_erro
+
+        if sorteio < args.taxa_429:
+            self.estado.contar(f'{endpoint}:429')
+            self._enviar_json(429, {"success": False, "message": "Muitas requisicoes"},
+                              headers={'Retry-After': str(args.retry_after)})
+            return True
+
+        return False
+
+    def _system_id_valido(self):
+        esperado = self.estado.args.system_id
+        if esperado and self.headers.get('x-system-id-romaneios') != esperado:
+            self._enviar_json(401, {"success": False, "message": "x-system-id-romaneios invalido"})
+            return False
+        return True
+
+    # ----- rotas -----
+
+    def do_GET(self):
+        if self.path == '/__stats':
+            with self.estado.lock:
+                dados = {
+                    'uptime': round(time.time() - self.estado.inicio, 1),
+                    'romaneios': len(self.estado.romaneios),
+                    'contadores': dict(sorted(self.estado.contadores.items()))
+                }
+            return self._enviar_json(200, dados)
+
+        if not self.path.startswith('/api/romaneio/'):
+            return self._enviar_json(404, {"success": False, "message": "Rota nao encontrada"})
+        if not self._system_id_valido():
+            return
+        if self._simular_falhas('get'):
+            return
+
+        pedido = self.path[len('/api/romaneio/'):]
+        args = self.estado.args
+        if args.somente_inseridos and pedido not in self.estado.romaneios:
+            self.estado.contar('get:vazio')
+            return self._enviar_json(200, [])
+
+        romaneio = self.estado.obter_ou_criar(pedido)
+        itens, ultima_mudanca = self.estado.itens(romaneio, time.time())
+        corpo = json.dumps([{
+            "PEDIDO": pedido,
+            "IDRO": romaneio['idro'],
+            "NOTA_FISCAL": romaneio['nota_fiscal'],
+            "ITEM": itens
+        }]).encode()
+
+        headers = {}
+        if not args.sem_validadores:
+            etag = '"' + hashlib.sha1(corpo).hexdigest() + '"'
+            ultima_mudanca = int(ultima_mudanca)
+            headers = {'ETag': etag, 'Last-Modified': formatdate(ultima_mudanca, usegmt=True)}
+
+            if self.headers.get('If-None-Match') == etag:
+                self.estado.contar('get:304')
+                return self._enviar_vazio(304, headers)
+            desde = self.headers.get('If-Modified-Since')
+            if desde and not self.headers.get('If-None-Match'):
+                try:
+                    if ultima_mudanca <= parsedate_to_datetime(desde).timestamp():
+                        self.estado.contar('get:304')
+                        return self._enviar_vazio(304, headers)
+                except (TypeError, ValueError):
+                    pass
+
+        self.estado.contar('get:200')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in headers.items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_POST(self):
+        if self.path == '/__reset':
+            with self.estado.lock:
+                self.estado.romaneios.clear()
+                self.estado.por_idro.clear()
+                self.estado.contadores.clear()
+            return self._enviar_json(200, {"success": True})
+
+        if self.path != '/api/romaneio/inserir':
+            return self._enviar_json(404, {"success": False, "message": "Rota nao encontrada"})
+        if not self._system_id_valido():
+            return
+        dados = self._ler_corpo().get('romaneio', {})
+        if self._simular_falhas('post'):
+            return
+
+        pedido = dados.get('pedidoCompra')
+        if not pedido:
+            self.estado.contar('post:400')
+            return self._enviar_json(400, {"success": False, "message": "pedidoCompra obrigatorio"})
+
+        existia = pedido in self.estado.romaneios
+        romaneio = self.estado.obter_ou_criar(pedido, dados.get('notaFiscal'), dados.get('chaveAcesso'))
+        self.estado.contar('post:200')
+        self._enviar_json(200, {
+            "success": True,
+            "message": "Romaneio ja existia" if existia else "Romaneio inserido com sucesso",
+            "idro": romaneio['idro'],
+            "pedido": pedido
+        })
+
+    def do_PUT(self):
+        if not self.path.startswith('/api/romaneio/atualizar/'):
+            return self._enviar_json(404, {"success": False, "message": "Rota nao encontrada"})
+        if not self._system_id_valido():
+            return
+        dados = self._ler_corpo()
+        if self._simular_falhas('put'):
+            return
+
+        try:
+            idro = int(self.path.rsplit('/', 1)[-1])
+        except ValueError:
+            idro = None
+        romaneio = self.estado.por_idro.get(idro)
+        if romaneio is None:
+            self.estado.contar('put:404')
+            return self._enviar_json(404, {"success": False, "message": f"IDRO {idro} nao encontrado"})
+
+        romaneio['status'] = dados.get('status', romaneio['status'])
+        self.estado.contar('put:200')
+        self._enviar_json(200, {"success": True, "idro": idro, "status": romaneio['status']})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Simulador local da API de Romaneios',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exemplos:
+  python simulador_api_romaneios.py                                   # defaults
+  python simulador_api_romaneios.py --itens 2000-5000 --sem-validadores
+  python simulador_api_romaneios.py --latencia lognormal:120,0.6 --taxa-erro 0.05 --taxa-timeout 0.01
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8900)
+    parser.add_argument('--itens', type=interpretar_faixa, default=(5, 40),
+                        help='Itens por romaneio: N ou MIN-MAX (padrão: 5-40)')
+    parser.add_argument('--latencia', type=interpretar_latencia, default=interpretar_latencia('normal:80,20'),
+                        help='fixa:MS | uniforme:MIN,MAX | normal:MEDIA,DESVIO | lognormal:MEDIANA,SIGMA (padrão: normal:80,20)')
+    parser.add_argument('--taxa-erro', type=float, default=0.0, help='Fração de respostas 500 (padrão: 0)')
+    parser.add_argument('--taxa-429', type=float, default=0.0, help='Fração de respostas 429 (padrão: 0)')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After dos 429 em segundos (padrão: 1)')
+    parser.add_argument('--taxa-timeout', type=float, default=0.0,
+                        help='Fração de requisições que nunca respondem (padrão: 0)')
+    parser.add_argument('--tempo-timeout', type=float, default=60,
+                        help='Segundos segurando a conexão nos timeouts (padrão: 60)')
+    parser.add_argument('--duracao-contagem', type=float, default=600,
+                        help='Segundos, após a criação, em que os itens vão sendo contados (padrão: 600)')
+    parser.add_argument('--divergencia', type=float, default=0.1,
+                        help='Probabilidade de a primeira contagem de um item vir errada (padrão: 0.1)')
+    parser.add_argument('--recontagem', type=float, default=300,
+                        help='Segundos até a contagem errada ser corrigida (padrão: 300)')
+    parser.add_argument('--sem-validadores', action='store_true',
+                        help='Não envia ETag / Last-Modified (testa o fallback por hash)')
+    parser.add_argument('--somente-inseridos', action='store_true',
+                        help='GET de pedido nunca inserido retorna lista vazia')
+    parser.add_argument('--system-id', default=None,
+                        help='Exige este x-system-id-romaneios (padrão: não valida)')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true', help='Loga cada requisição')
+    args = parser.parse_args()
+
+    ManipuladorAPI.estado = EstadoSimulador(args)
+    servidor = ThreadingHTTPServer((args.host, args.porta), ManipuladorAPI)
+    servidor.daemon_threads = True
+
+    print("=" * 70)
+    print("SIMULADOR DA API DE ROMANEIOS")
+    print("=" * 70)
+    print(f"Endereco: http://{args.host}:{args.porta}")
+    print(f"Itens por romaneio: {args.itens[0]}-{args.itens[1]}")
+    print(f"Erros: 500={args.taxa_erro:.1%} 429={args.taxa_429:.1%} timeout={args.taxa_timeout:.1%}")
+    print(f"Contagem: {args.duracao_contagem:.0f}s, divergencia {args.divergencia:.0%}, recontagem {args.recontagem:.0f}s")
+    print(f"Validadores (ETag/Last-Modified): {'nao' if args.sem_validadores else 'sim'}")
+    print("=" * 70)
+    print(f"Use: API_BASE_URL=http://{args.host}:{args.porta} MODO_TESTE=False")
+    print("Pressione Ctrl+C para parar\n")
+
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[INFO] Simulador interrompido")
+    finally:
+        servidor.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Mostra os traces gravados por services/tracing.py (TRACING_ARQUIVO)
+Lista os traces mais lentos ou a árvore de spans de um trace, com o início
+relativo e a duração de cada span e o tempo próprio (sem os filhos).
+
+Uso:
+    python ver_traces.py                          # 20 traces mais lentos
+    python ver_traces.py --rota /romaneios/add    # só os dessa rota
+    python ver_traces.py --trace 4bf92f3577b34da6a3ce929d0e0e4736
+"""
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+import config
+
+
+def _valor_atributo(valor):
+    for tipo in ('stringValue', 'boolValue', 'doubleValue'):
+        if tipo in valor:
+            return valor[tipo]
+    if 'intValue' in valor:
+        return int(valor['intValue'])
+    return None
+
+
+def carregar_spans(caminho):
+    """Lê os spans do arquivo e do backup (.1), se existir"""
+    spans = []
+    for arquivo in (caminho + '.1', caminho):
+        if not os.path.exists(arquivo):
+            continue
+        with open(arquivo, encoding='utf-8') as entrada:
+            for linha in entrada:
+                if not linha.strip():
+                    continue
+                for recurso in json.loads(linha).get('resourceSpans', []):
+                    for escopo in recurso.get('scopeSpans', []):
+                        for span in escopo.get('spans', []):
+                            span['atributos'] = {a['key']: _valor_atributo(a['value']) for a in span.get('attributes', [])}
+                            span['inicio'] = int(span['startTimeUnixNano'])
+                            span['duracao_ms'] = (int(span['endTimeUnixNano']) - span['inicio']) / 1e6
+                            spans.append(span)
+    return spans
+
+
+def agrupar_traces(spans):
+    traces = defaultdict(list)
+    for span in spans:
+        traces[span['traceId']].append(span)
+    return traces
+
+
+def raiz(spans_trace):
+    """Span sem pai dentro do trace (ou o mais antigo)"""
+    ids = {span['spanId'] for span in spans_trace}
+    raizes = [span for span in spans_trace if span.get('parentSpanId') not in ids]
+    return min(raizes or spans_trace, key=lambda span: span['inicio'])
+
+
+def listar_lentos(traces, limite, rota=None):
+    linhas = []
+    for trace_id, spans_trace in traces.items():
+        span_raiz = raiz(spans_trace)
+        if rota and rota not in span_raiz['name'] and rota not in str(span_raiz['atributos'].get('http.target', '')):
+            continue
+        linhas.append((span_raiz['duracao_ms'], trace_id, span_raiz, len(spans_trace)))
+    linhas.sort(key=lambda linha: linha[0], reverse=True)
+
+    print(f"{'duracao':>10}  {'spans':>5}  {'trace':32}  nome")
+    for duracao, trace_id, span_raiz, total in linhas[:limite]:
+        print(f"{duracao:>8.1f}ms  {total:>5}  {trace_id}  {span_raiz['name']}")
+    if not linhas:
+        print("[AVISO] Nenhum trace encontrado")
+
+
+def imprimir_arvore(spans_trace):
+    filhos = defaultdict(list)
+    for span in spans_trace:
+        filhos[span.get('parentSpanId')].append(span)
+    for lista in filhos.values():
+        lista.sort(key=lambda span: span['inicio'])
+    span_raiz = raiz(spans_trace)
+    inicio_trace = span_raiz['inicio']
+
+    print(f"{'inicio':>9}  {'duracao':>9}  {'proprio':>9}  span")
+
+    def imprimir(span, nivel):
+        tempo_filhos = sum(filho['duracao_ms'] for filho in filhos[span['spanId']])
+        detalhe = span['atributos'].get('db.statement') or span['atributos'].get('pedido') or ''
+        detalhe = ' '.join(str(detalhe).split())[:90]
+        erro = ' [ERRO]' if span.get('status', {}).get('code') == 2 else ''
+        print(f"{(span['inicio'] - inicio_trace) / 1e6:>7.1f}ms  {span['duracao_ms']:>7.1f}ms  "
+              f"{max(0.0, span['duracao_ms'] - tempo_filhos):>7.1f}ms  {'  ' * nivel}{span['name']}{erro}"
+              f"{'  ' + detalhe if detalhe else ''}")
+        for filho in filhos[span['spanId']]:
+            imprimir(filho, nivel + 1)
+
+    imprimir(span_raiz, 0)
+
+    # Resumo por tipo de span (soma das durações)
+    por_nome = defaultdict(lambda: [0, 0.0])
+    for span in spans_trace:
+        por_nome[span['name']][0] += 1
+        por_nome[span['name']][1] += span['duracao_ms']
+    print()
+    print(f"{'qtd':>5}  {'total':>9}  span")
+    for nome, (quantidade, total) in sorted(por_nome.items(), key=lambda item: item[1][1], reverse=True):
+        print(f"{quantidade:>5}  {total:>7.1f}ms  {nome}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mostra os traces gravados pelo tracing (OTLP/JSON)')
+    parser.add_argument('--arquivo', default=config.TRACING_ARQUIVO,
+                        help=f'Arquivo de spans (padrão: {config.TRACING_ARQUIVO})')
+    parser.add_argument('--trace', help='Id do trace a detalhar (header X-Trace-Id da resposta)')
+    parser.add_argument('--rota', help='Filtra a lista pela rota/nome do span raiz')
+    parser.add_argument('--limite', type=int, default=20, help='Traces na lista (padrão: 20)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.arquivo):
+        print(f"[ERRO] Arquivo nao encontrado: {args.arquivo} (TRACING_ATIVO=True?)")
+        return 1
+
+    traces = agrupar_traces(carregar_spans(args.arquivo))
+    if args.trace:
+        if args.trace not in traces:
+            print(f"[ERRO] Trace {args.trace} nao encontrado")
+            return 1
+        imprimir_arvore(traces[args.trace])
+    else:
+        listar_lentos(traces, args.limite, args.rota)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,14 +4,17 @@ Executa a cada X minutos (configurável via .env)
 Verifica se as quantidades dos itens batem com a NF e atualiza o status
 """
 import sys
-import time
 from datetime import datetime
 from app import app
+from services import metricas
+from services.agendador import AgendadorTaxaFixa
+from services.outbox_dispatcher import OutboxDispatcher
+from services.trava_execucao import TravaArquivo, TravaOcupadaError
 from services.verificador_service import VerificadorService
 import config
 
-def main():
-    """Função principal"""
+def imprimir_cabecalho():
+    """Imprime o cabeçalho com as configurações atuais"""
     print("=" * 70)
     print("VERIFICADOR AUTOMATICO DE ROMANEIOS - RPA Profectum")
     print("=" * 70)
@@ -20,17 +23,27 @@ def main():
     print(f"Intervalo: {config.INTERVALO_VERIFICACAO_MINUTOS} minutos")
     print(f"Max Tentativas: {config.MAX_TENTATIVAS_CONTAGEM}")
     print("=" * 70)
+
+def executar_passe(verificador, deve_parar=None):
+    """
+    Executa um passe de verificação e imprime o resumo
     
-    if not config.VERIFICADOR_ATIVO:
-        print("\n[AVISO] Verificador desativado no .env (VERIFICADOR_ATIVO=False)")
-        print("        Ative-o para executar a verificacao automatica.\n")
-        return
-    
-    verificador = VerificadorService()
+    Returns:
+        int: código de saída (0 = sucesso, 1 = falha)
+    """
+    trava = TravaArquivo(config.VERIFICADOR_ARQUIVO_TRAVA)
+    espera = config.VERIFICADOR_ESPERA_MAX_SEGUNDOS if config.VERIFICADOR_SE_OCUPADO == 'aguardar' else 0
     
     with app.app_context():
         try:
-            resultado = verificador.executar_verificacao_automatica()
+            trava.adquirir(espera_max=espera)
+        except TravaOcupadaError:
+            print("\n[AVISO] Outro passe do verificador ainda esta em execucao - passe ignorado")
+            verificador.registrar_execucao_ignorada('Outro passe ainda em execucao')
+            return 0
+        
+        try:
+            resultado = verificador.executar_verificacao_automatica(deve_parar=deve_parar)
             
             print("\n" + "=" * 70)
             print("RESUMO DA EXECUCAO")
@@ -39,8 +52,25 @@ def main():
             print(f"Atualizados para Aberto: {resultado['atualizados_para_aberto']}")
             print(f"Mantidos Pendente: {resultado['mantidos_pendente']}")
             print(f"Max tentativas atingidas: {resultado['max_tentativas_atingidas']}")
+            consultas = resultado['consultas_api']
+            print(f"Sem alteracao na API: {resultado['sem_alteracao']} "
+                  f"(304: {consultas['nao_modificadas_304']}, mesmo hash: {consultas['nao_modificadas_hash']}, "
+                  f"respostas completas: {consultas['completas']})")
             print(f"Erros: {resultado['erros']}")
-            print(f"Duracao: {resultado['duracao']:.2f} segundos")
+            print(f"Duracao: {resultado['duracao']:.2f} segundos (API: {resultado['tempo_api']:.2f}s, DB: {resultado['tempo_db']:.2f}s)")
+            print(f"Circuito da API: {resultado['circuito_api']['estado']}")
+            limite_get = resultado['limite_api'].get('get_romaneio')
+            if limite_get:
+                print(f"Taxa de consultas a API: {limite_get['taxa']:.1f} req/s "
+                      f"({limite_get['reducoes']} reducoes, {limite_get['tempo_espera']:.1f}s em espera)")
+            cache = resultado['cache_api']
+            if cache:
+                print(f"Cache da API: {cache['acertos']} acertos em memoria, {cache['acertos_disco']} em disco, "
+                      f"{cache['faltas']} faltas, {cache['remocoes']} remocoes")
+            if resultado['api_indisponivel']:
+                print("Passe encerrado antecipadamente: API indisponivel")
+            elif resultado['interrompido']:
+                print("Passe interrompido por sinal de parada")
             print("=" * 70)
             
             if resultado['erros'] > 0:
@@ -57,38 +87,110 @@ def main():
             import traceback
             traceback.print_exc()
             return 1
+        finally:
+            trava.liberar()
 
-def executar_loop():
-    """Executa o verificador em loop contínuo"""
-    print("\n[INFO] Modo LOOP ativado - Verificacao continua")
-    print(f"[INFO] Pressione Ctrl+C para interromper\n")
+def iniciar_gravacao(verificador, arquivo):
+    """
+    Prepara a gravação das respostas da API do passe em `arquivo` e salva uma
+    cópia do banco como estava antes do passe (para o replay_verificacao.py)
+    """
+    from app import db
+    from services.gravacao import ClienteGravador, GravadorRespostas, copiar_banco_sqlite
     
-    contador = 1
+    base = arquivo[:-len('.jsonl.gz')] if arquivo.endswith('.jsonl.gz') else arquivo
+    copia_banco = None
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            copia_banco = base + '.db'
+            copiar_banco_sqlite(db.engine.url.database, copia_banco)
+            print(f"[INFO] Copia do banco antes do passe: {copia_banco}")
+        else:
+            print("[AVISO] Banco nao e SQLite - copia para replay nao foi gerada")
+    
+    gravador = GravadorRespostas(arquivo, api_base_url=config.API_BASE_URL, banco=copia_banco)
+    verificador.api_client = ClienteGravador(verificador.api_client, gravador)
+    print(f"[INFO] Gravando respostas da API em: {arquivo}")
+    return gravador
+
+def main(gravar=None):
+    """Função principal"""
+    imprimir_cabecalho()
     
+    if not config.VERIFICADOR_ATIVO:
+        print("\n[AVISO] Verificador desativado no .env (VERIFICADOR_ATIVO=False)")
+        print("        Ative-o para executar a verificacao automatica.\n")
+        return
+    
+    verificador = VerificadorService()
+    gravador = iniciar_gravacao(verificador, gravar) if gravar else None
     try:
-        while True:
-            print(f"\n{'='*70}")
-            print(f"EXECUCAO #{contador}")
-            print(f"{'='*70}")
-            
-            main()
-            
-            contador += 1
-            
-            print(f"\n[INFO] Aguardando {config.INTERVALO_VERIFICACAO_MINUTOS} minutos ate proxima verificacao...")
-            print(f"[INFO] Proxima execucao: {datetime.now().strftime('%H:%M:%S')}")
-            
-            time.sleep(config.INTERVALO_VERIFICACAO_MINUTOS * 60)
-            
-    except KeyboardInterrupt:
-        print("\n\n[INFO] Verificador interrompido pelo usuario.")
-        print("[INFO] Encerrando...")
+        codigo = executar_passe(verificador)
+    finally:
+        if gravador:
+            gravador.fechar()
+            print(f"[INFO] {gravador.total} resposta(s) gravada(s) em {gravador.caminho}")
+    
+    # Entrega as atualizações de status geradas pelo passe
+    with app.app_context():
+        try:
+            despachante = OutboxDispatcher(api_client=verificador.api_client)
+            resumo = despachante.despachar_pendentes()
+            despachante.parar()
+            print(f"\nOutbox: {resumo['enviados']} enviado(s), {resumo['reagendados']} reagendado(s), "
+                  f"{resumo['falhas_definitivas']} falha(s) definitiva(s)")
+        except Exception as e:
+            print(f"\n[ERRO] Falha ao despachar outbox: {str(e)}")
+    
+    return codigo
+
+def executar_loop():
+    """
+    Executa o verificador como serviço de longa duração
+    
+    - Passes em taxa fixa (o início não escorrega pela duração do passe)
+    - Janelas perdidas são agrupadas e passes nunca se sobrepõem
+    - SIGTERM/SIGINT encerram após o romaneio em andamento
+    - Conexões HTTP e do banco permanecem abertas entre os passes
+    """
+    imprimir_cabecalho()
+    
+    if not config.VERIFICADOR_ATIVO:
+        print("\n[AVISO] Verificador desativado no .env (VERIFICADOR_ATIVO=False)")
         return 0
+    
+    print("\n[INFO] Modo SERVICO ativado - Verificacao continua")
+    print(f"[INFO] Envie SIGTERM ou pressione Ctrl+C para encerrar\n")
+    
+    verificador = VerificadorService()
+    agendador = AgendadorTaxaFixa(
+        config.INTERVALO_VERIFICACAO_MINUTOS * 60,
+        nome='Verificador'
+    )
+    agendador.instalar_sinais()
+    
+    # Atualizações de status para a API saem em paralelo, fora do passe
+    despachante = OutboxDispatcher()
+    despachante.iniciar_thread(app)
+    
+    def passe():
+        print(f"\n{'='*70}")
+        print(f"EXECUCAO #{agendador.execucoes}")
+        print(f"{'='*70}")
+        executar_passe(verificador, deve_parar=agendador.deve_parar)
+    
+    try:
+        agendador.executar(passe)
     except Exception as e:
         print(f"\n[ERRO] Erro no loop de verificacao: {str(e)}")
         import traceback
         traceback.print_exc()
         return 1
+    finally:
+        despachante.parar()
+    
+    print("\n[INFO] Verificador encerrado.")
+    return 0
 
 if __name__ == '__main__':
     import argparse
@@ -99,7 +201,7 @@ if __name__ == '__main__':
     parser.add_argument(
         '--loop',
         action='store_true',
-        help='Executar em loop continuo (a cada X minutos)'
+        help='Executar como servico continuo (a cada X minutos, taxa fixa)'
     )
     parser.add_argument(
         '--once',
@@ -107,10 +209,43 @@ if __name__ == '__main__':
         help='Executar uma unica vez e sair (padrao)'
     )
     
+    parser.add_argument(
+        '--se-ocupado',
+        choices=['pular', 'aguardar'],
+        default=config.VERIFICADOR_SE_OCUPADO,
+        help='O que fazer se outro passe estiver em execucao (padrao: %(default)s)'
+    )
+    parser.add_argument(
+        '--trava',
+        default=config.VERIFICADOR_ARQUIVO_TRAVA,
+        help='Arquivo de trava contra passes sobrepostos (padrao: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--gravar',
+        metavar='ARQUIVO',
+        help='Grava as respostas da API do passe (ex.: passe.jsonl.gz) para o replay_verificacao.py (apenas com --once)'
+    )
+    
+    parser.add_argument(
+        '--metricas-porta',
+        type=int,
+        metavar='PORTA',
+        help='Expoe as metricas do processo em http://127.0.0.1:PORTA/metrics (formato Prometheus)'
+    )
+    
     args = parser.parse_args()
+    if args.gravar and args.loop:
+        parser.error('--gravar so pode ser usado com --once')
+    config.VERIFICADOR_SE_OCUPADO = args.se_ocupado
+    config.VERIFICADOR_ARQUIVO_TRAVA = args.trava
+    
+    if args.metricas_porta:
+        metricas.iniciar_servidor(args.metricas_porta)
+        print(f"[INFO] Metricas em http://127.0.0.1:{args.metricas_porta}/metrics")
     
     if args.loop:
         sys.exit(executar_loop())
     else:
-        sys.exit(main())
+        sys.exit(main(gravar=args.gravar))
 